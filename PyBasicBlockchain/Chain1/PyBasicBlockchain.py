@@ -2,76 +2,1094 @@
 This is PyBasicBlockchain Lib V1
 """
 
+from bisect import bisect_left, bisect_right  # Binary search through sorted timestamps. 🔎
+import cProfile  # X-ray goggles for a slow mining run. 🩻
+import heapq  # Picking the richest folks without sorting everyone! 🏆
 import hashlib  # Hashing magic, like turning data into digital fingerprints! 🕵️‍♂️
 import json  # Speaking in JSONish because it's the blockchain lingua franca! 🌐
-from time import time  # Time flies when you're mining blocks! 🕒
-from typing import List, Dict, Any, Optional  # Making Python understand our crazy types! 📋
+import math  # Logarithms, for saying how hard a target is in bits. 📐
+import queue  # A conveyor belt for blocks read ahead of a scan. 🛤️
+import sys  # For interning addresses so every copy shares one string. 🔗
+import threading  # A helper that fetches blocks before we ask for them. 🏃
+from array import array  # Tightly packed columns of numbers. 🗄️
+from collections import OrderedDict  # Remembers which blocks we touched most recently. 🧠
+from collections.abc import Mapping, MutableMapping, Sequence  # So compact rows still quack like dicts. 🦆
+from concurrent.futures import ProcessPoolExecutor  # A whole crew of miners, one per CPU core! 👷‍♀️👷
+from multiprocessing import Value  # A shared scoreboard the miners can all peek at! 📋
+from time import perf_counter, time  # Time flies when you're mining blocks! 🕒
+from typing import Callable, Iterator, List, Dict, Any, Optional, Tuple  # Making Python understand our crazy types! 📋
+
+MINING_CHUNK_SIZE = 4096  # How many nonces a parallel miner grabs before checking the scoreboard. 📦
+HASH_VERSION_LEGACY = 1  # Old-school fingerprint: the whole block dict as JSON. 📜
+HASH_VERSION_HEADER = 2  # New-school fingerprint: a small header with a digest of the transactions. 🧾
+HASH_VERSION_TARGET = 3  # The same header, plus the target Mr. Block was mined against. 🎯
+MEMPOOL_MAX_COUNT = 100_000  # How many transactions may wait for a block at once. 🚪
+MEMPOOL_MAX_BYTES = 64 * 1024 * 1024  # And how much JSON they may add up to. 📏
+MEMPOOL_SKIP_LIMIT = 64  # Give up filling a block after this many transactions in a row didn't fit. 🧩
+MEMPOOL_COMPACT_SLACK = 1024  # Stale heap entries we tolerate before tidying up. 🧽
+BLOCK_MAX_TRANSACTIONS = 5000  # The most transactions one block takes from the mempool. 📦
+BLOCK_MAX_BYTES = 1024 * 1024  # And the most bytes of them. 📦
+CHAIN_PREFETCH = 64  # How many blocks a lazy chain reads ahead of a scan. 🔭
+MAX_TARGET = 2 ** 256 - 1  # The easiest possible target: any hash will do. 🎯
+RETARGET_WINDOW = 10  # Rethink the target every this many blocks. 🔁
+RETARGET_MAX_ADJUST = 4.0  # And never make mining more than 4x easier or harder in one go. 🪜
+_best_nonce = None  # The lowest winning nonce found so far, shared between miner processes. 🏆
+
+def _init_miner(best_nonce):
+    global _best_nonce
+    _best_nonce = best_nonce  # Hand each miner process the shared scoreboard. 📋
+
+def _search_nonces(block: 'Block', required: str, start: int, worker: int, workers: int) -> Tuple[Optional[int], int]:
+    hash_nonce = block.nonce_hasher()  # Serialize the header once, then only the nonce changes. ⚡
+    attempts = 0  # How many hashes this miner tried. 🔢
+    chunk_start = start + worker * MINING_CHUNK_SIZE  # Each miner owns every `workers`-th chunk of nonces. 🍰
+    while chunk_start < _best_nonce.value:  # Stop once someone found a winner below our chunk. 🛑
+        for nonce in range(chunk_start, chunk_start + MINING_CHUNK_SIZE):
+            attempts += 1
+            if hash_nonce(nonce) <= required:  # Jackpot! 🎰
+                with _best_nonce.get_lock():
+                    if nonce < _best_nonce.value:
+                        _best_nonce.value = nonce  # Tell the other miners to stop past this nonce. 📣
+                return nonce, attempts
+        chunk_start += workers * MINING_CHUNK_SIZE  # Jump to this miner's next chunk. 🦘
+    return None, attempts
+
+def _timed_query(metrics: Any, name: str, method: Callable) -> Callable:
+    def timed(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.observe('query_seconds', perf_counter() - started, query=name)  # How long the lookup took. ⏱️
+    return timed
+
+def _check_block(block: 'Block') -> Optional[str]:
+    if block.hash != block.compute_hash():  # Check if the block’s fingerprint hasn’t changed. ❓
+        return "hash mismatch"
+    if type(block.transactions) is ArchivedPayload:  # Pruned? The root was checked before pruning and is checked again on every thaw. 🧊
+        return None
+    if not block.has_valid_merkle_root():  # Make sure nobody slipped in a fake transaction. 🌳
+        return "merkle root mismatch"
+    return None  # Mr. Block is squeaky clean. ✨
+
+def entry_bytes(entry: Dict[str, Any]) -> bytes:
+    return json.dumps(entry if type(entry) is dict else dict(entry), sort_keys=True).encode()  # One transaction as canonical JSON. 📜
+
+def hash_entry(entry: Dict[str, Any]) -> str:
+    return hashlib.sha256(b'\x00' + entry_bytes(entry)).hexdigest()  # Leaves get a 0x00 tag so they can't pose as branches. 🍃
+
+def transaction_fee(transaction: Dict[str, Any]) -> int:
+    return transaction.get('fee', 0) if type(transaction) is dict else 0  # Compact rows never carry a fee. 🪙
+
+def fee_rate(transaction: Dict[str, Any], size: int) -> float:
+    return transaction_fee(transaction) / size  # Coins paid per byte of block space. 💸
+
+def difficulty_target(difficulty: int) -> int:
+    return MAX_TARGET >> (4 * difficulty)  # A hash that starts with `difficulty` zeros is at most this. 🎯
+
+def target_hex(target: int) -> str:
+    # Hex digests all have 64 digits, so comparing them as strings is comparing them as numbers. 🔢
+    return format(target, '064x')
+
+def difficulty_bits(target: int) -> float:
+    return 256 - math.log2(target + 1)  # How many leading zero bits a hash needs, on average (4 per hex zero). 📐
+
+def _hash_pair(left: str, right: str) -> str:
+    return hashlib.sha256(b'\x01' + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()  # Branches get a 0x01 tag. 🌿
+
+def _merkle_levels(entries: List[Dict[str, Any]]) -> List[List[str]]:
+    levels = [[hash_entry(entry) for entry in entries]]  # The bottom row of leaves. 🍃
+    while len(levels[-1]) > 1:  # Keep pairing up until only the root is left. 🌳
+        level = levels[-1]
+        parents = [_hash_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])  # An odd one out gets promoted as-is instead of being duplicated. ⬆️
+        levels.append(parents)
+    return levels
+
+def compute_merkle_root(entries: List[Dict[str, Any]]) -> str:
+    if not entries:
+        return hashlib.sha256(b'').hexdigest()  # An empty block still needs a root. 🕳️
+    return _merkle_levels(entries)[-1][0]  # The single hash at the top of the tree. 🌳
+
+def build_merkle_proof(entries: List[Dict[str, Any]], position: int) -> List[Tuple[str, str]]:
+    if not 0 <= position < len(entries):
+        raise IndexError(f"No entry at position {position}")  # Can't prove what isn't there! 🙅
+    proof = []  # (side, sibling hash) pairs from the leaf up to the root. 🪜
+    for level in _merkle_levels(entries)[:-1]:
+        sibling = position ^ 1  # Our neighbour at this level. 👯
+        if sibling < len(level):
+            proof.append(('L' if sibling < position else 'R', level[sibling]))
+        position //= 2  # Climb one level up. 🧗
+    return proof
+
+def verify_merkle_proof(entry: Dict[str, Any], proof: List[Tuple[str, str]], merkle_root: str) -> bool:
+    current = hash_entry(entry)  # Start from the leaf we want to prove. 🍃
+    for side, sibling in proof:
+        current = _hash_pair(sibling, current) if side == 'L' else _hash_pair(current, sibling)  # Hash our way up. 🧗
+    return current == merkle_root  # Did we land on the root? 🎯
+
+_address_ids: Dict[str, int] = {}  # Address -> small number, shared by every compact block. 🔢
+_addresses: List[str] = []  # Small number -> address, the other way around. 🔤
+
+def intern_address(address: str) -> int:
+    address_id = _address_ids.get(address)
+    if address_id is None:  # First time we meet this address? Give it a number. 🎫
+        address_id = _address_ids[address] = len(_addresses)
+        _addresses.append(sys.intern(address))
+    return address_id
+
+def plain_entries(entries: Sequence) -> List[Dict[str, Any]]:
+    if type(entries) is list and all(type(entry) is dict for entry in entries):
+        return entries
+    return [dict(entry) for entry in entries]  # Back to good old dicts for JSON, rows and all. 📜
+
+class TransactionRow(MutableMapping):
+    __slots__ = ('_columns', '_position')  # A row is just a pointer into the columns. 👉
+
+    def __init__(self, columns: 'TransactionColumns', position: int):
+        self._columns = columns
+        self._position = position
+
+    def __getitem__(self, key: str) -> Any:
+        return self._columns.get_field(self._position, key)
+
+    def __setitem__(self, key: str, value: Any):
+        self._columns.set_field(self._position, key, value)  # Edits go straight back into the columns. ✍️
+
+    def __delitem__(self, key: str):
+        raise TypeError("Fields of a compact transaction can't be deleted")
+
+    def __iter__(self):
+        return iter(TransactionColumns.FIELDS)
+
+    def __len__(self) -> int:
+        return len(TransactionColumns.FIELDS)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+class TransactionColumns(Sequence):
+    FIELDS = ('sender', 'recipient', 'amount')
+    __slots__ = ('senders', 'recipients', 'amounts')  # One array per field instead of one dict per transaction. 🗄️
+
+    @classmethod
+    def pack(cls, entries: Sequence) -> Sequence:
+        if isinstance(entries, cls):
+            return entries
+        fields = set(cls.FIELDS)
+        for entry in entries:  # Only plain sender/recipient/amount transactions fit in the columns. 📏
+            if not isinstance(entry, Mapping) or entry.keys() != fields or type(entry['sender']) is not str or type(entry['recipient']) is not str:
+                return entries  # Anything fancier stays a list of dicts. 🤷
+        columns = cls.__new__(cls)
+        columns.senders = array('I', [intern_address(entry['sender']) for entry in entries])
+        columns.recipients = array('I', [intern_address(entry['recipient']) for entry in entries])
+        amounts = [entry['amount'] for entry in entries]
+        columns.amounts = array('q', amounts) if all(type(amount) is int and -2 ** 63 <= amount < 2 ** 63 for amount in amounts) else amounts
+        return columns
+
+    def get_field(self, position: int, key: str) -> Any:
+        if key == 'sender':
+            return _addresses[self.senders[position]]
+        if key == 'recipient':
+            return _addresses[self.recipients[position]]
+        if key == 'amount':
+            return self.amounts[position]
+        raise KeyError(key)
+
+    def set_field(self, position: int, key: str, value: Any):
+        if key in ('sender', 'recipient'):
+            if type(value) is not str:
+                raise TypeError(f"{key} of a compact transaction must be a string")
+            (self.senders if key == 'sender' else self.recipients)[position] = intern_address(value)
+        elif key == 'amount':
+            if type(self.amounts) is array and not (type(value) is int and -2 ** 63 <= value < 2 ** 63):
+                self.amounts = list(self.amounts)  # The new amount doesn't fit the packed column; loosen it. 🪢
+            self.amounts[position] = value
+        else:
+            raise KeyError(key)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [TransactionRow(self, i) for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("transaction index out of range")
+        return TransactionRow(self, position)
+
+    def __len__(self) -> int:
+        return len(self.senders)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Sequence) and len(self) == len(other) and all(row == entry for row, entry in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(plain_entries(self))
+
+    def __reduce__(self):
+        # Address numbers only mean something inside this process, so ship plain dicts. 📦
+        return (TransactionColumns.pack, (plain_entries(self),))
+
+class ArchivedPayload(Sequence):
+    __slots__ = ('archive', 'position', 'count', 'merkle_root')  # Just a claim ticket for transactions in cold storage. 🎟️
+
+    def __init__(self, archive: Any, position: int, count: int, merkle_root: str):
+        self.archive = archive  # The PayloadArchive holding the transactions (None once shipped to another process). 🧊
+        self.position = position  # Where they sit in the archive. 📍
+        self.count = count  # How many there are, without thawing them. 🔢
+        self.merkle_root = merkle_root  # What they must hash to when they come back. 🌳
+
+    def load(self) -> List[Dict[str, Any]]:
+        if self.archive is None:
+            raise LookupError("This pruned payload is detached from its archive")
+        return self.archive.read(self.position, self._matches)  # Thaw them out (or grab them from the cache). 🔥
+
+    def _matches(self, entries: List[Dict[str, Any]]) -> bool:
+        return len(entries) == self.count and compute_merkle_root(entries) == self.merkle_root  # Nobody swapped the archive file? 🕵️‍♂️
+
+    def __getitem__(self, position):
+        return self.load()[position]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Sequence) and len(self) == len(other) and all(entry == other_entry for entry, other_entry in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"ArchivedPayload(position={self.position}, count={self.count})"
+
+    def __reduce__(self):
+        # Another process can't read our archive, and checking a pruned block doesn't need the payload anyway. 📦
+        return (ArchivedPayload, (None, self.position, self.count, self.merkle_root))
 
 class Block:
-    def __init__(self, index: int, timestamp: float, transactions: List[Dict[str, Any]], previous_hash: str):
+    PAYLOAD_FIELD = 'transactions'  # Which attribute holds Mr. Block's payload. 📦
+    __slots__ = ('index', 'timestamp', 'transactions', 'previous_hash', 'nonce', 'version', 'target', 'merkle_root', 'hash')  # No per-block __dict__. 🪶
+
+    def __init__(self, index: int, timestamp: float, transactions: List[Dict[str, Any]], previous_hash: str, version: int = HASH_VERSION_TARGET,
+                 target: Optional[int] = None):
         self.index = index  # Where Mr. Block stands in the queue. 🏷️
         self.timestamp = timestamp  # When Mr. Block was born. ⏰
         self.transactions = transactions  # The juicy details (transactions) Mr. Block carries. 💸
         self.previous_hash = previous_hash  # The ID of Mr. Block's older sibling. 🧬
         self.nonce = 0  # Mr. Block's random number for mining tricks. 🎲
+        self.version = version  # Which fingerprint recipe Mr. Block uses. 📖
+        self.target = target if version >= HASH_VERSION_TARGET else None  # The biggest hash Mr. Block promises to beat. 🎯
+        self.merkle_root = compute_merkle_root(transactions)  # One hash that vouches for every transaction. 🌳
         self.hash = self.compute_hash()  # Mr. Block’s unique fingerprint. 🖐️
 
-    def compute_hash(self) -> str:
-        block_string = json.dumps(self.__dict__, sort_keys=True)  # Turn Mr. Block into a JSON string for hashing. 📜
+    def to_dict(self) -> Dict[str, Any]:
+        return {  # Mr. Block, packed for travel. 🧳
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'transactions': plain_entries(self.transactions),
+            'previous_hash': self.previous_hash,
+            'nonce': self.nonce,
+            'version': self.version,
+            'target': self.target,
+            'merkle_root': self.merkle_root,
+            'hash': self.hash,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Block':
+        block = cls.__new__(cls)  # Skip __init__ so we keep the stored fingerprint instead of recomputing it. 📦
+        block.index = data['index']
+        block.timestamp = data['timestamp']
+        block.transactions = data['transactions']
+        block.previous_hash = data['previous_hash']
+        block.nonce = data['nonce']
+        block.version = data.get('version', HASH_VERSION_LEGACY)  # Blocks from before versioning are legacy. 📜
+        block.target = data.get('target') if block.version >= HASH_VERSION_TARGET else None  # Only a hashed target counts. 🎯
+        block.merkle_root = data.get('merkle_root') or compute_merkle_root(block.transactions)
+        block.hash = data['hash']
+        return block
+
+    def has_valid_merkle_root(self) -> bool:
+        return self.merkle_root == compute_merkle_root(self.transactions)  # Does the root still match the transactions? 🕵️‍♂️
+
+    def get_inclusion_proof(self, position: int) -> List[Tuple[str, str]]:
+        return build_merkle_proof(self.transactions, position)  # Proof that one transaction lives in Mr. Block. 🪪
+
+    def header_prefix(self) -> bytes:
+        # Everything in the header except the nonce, serialized once per mining run. 🧱
+        if self.version < HASH_VERSION_TARGET:
+            return f"{self.version}|{self.index}|{self.timestamp!r}|{self.previous_hash}|{self.merkle_root}|".encode()
+        target = '' if self.target is None else format(self.target, 'x')  # The target is sealed in too, so nobody can swap it. 🔏
+        return f"{self.version}|{self.index}|{self.timestamp!r}|{self.previous_hash}|{target}|{self.merkle_root}|".encode()
+
+    def compute_legacy_hash(self) -> str:
+        block_data = {  # The full block, transactions and all, the way version 1 hashed it. 📜
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'transactions': plain_entries(self.transactions),
+            'previous_hash': self.previous_hash,
+            'nonce': self.nonce,
+        }
+        block_string = json.dumps(block_data, sort_keys=True)  # Turn Mr. Block into a JSON string for hashing. 📜
         return hashlib.sha256(block_string.encode()).hexdigest()  # Hash the string like a blender on high speed. 🌀
 
-    def mine_block(self, difficulty: int):
-        required_prefix = '0' * difficulty  # The number of zeros Mr. Block needs to find. 🎯
-        while not self.hash.startswith(required_prefix):  # Keep mining until Mr. Block gets lucky. 🍀
-            self.nonce += 1  # Increment the nonce for each mining attempt. 🚀
-            self.hash = self.compute_hash()  # Update Mr. Block’s fingerprint after each try. 🔄
+    def nonce_hasher(self) -> Callable[[int], str]:
+        if self.version == HASH_VERSION_LEGACY:
+            def hash_legacy(nonce: int) -> str:
+                self.nonce = nonce
+                return self.compute_legacy_hash()  # Re-serialize everything, like the good old days. 🐢
+            return hash_legacy
+        midstate = hashlib.sha256(self.header_prefix())  # Pre-chew the header once. 🍖
+        def hash_header(nonce: int) -> str:
+            attempt = midstate.copy()  # Start from the pre-chewed header... 📋
+            attempt.update(str(nonce).encode())  # ...and only feed in the nonce. ⚡
+            return attempt.hexdigest()
+        return hash_header
 
-class Blockchain:
+    def compute_hash(self) -> str:
+        return self.nonce_hasher()(self.nonce)  # Fingerprint Mr. Block with his current nonce. 🖐️
+
+    def mining_target(self, difficulty: int, target: Optional[int] = None) -> int:
+        if target is not None:
+            return target  # Asked for a particular target. 🎯
+        return difficulty_target(difficulty) if self.target is None else self.target  # Otherwise the one Mr. Block carries. 🧾
+
+    def mine_block(self, difficulty: int, workers: int = 1, target: Optional[int] = None) -> int:
+        if workers > 1:
+            return self.mine_block_parallel(difficulty, workers, target)  # Call in the whole mining crew. 👷‍♀️👷
+        required = target_hex(self.mining_target(difficulty, target))  # The biggest hash Mr. Block may have. 🎯
+        hash_nonce = self.nonce_hasher()  # Serialize the header once, then only the nonce changes. ⚡
+        nonce = self.nonce
+        block_hash = hash_nonce(nonce)
+        attempts = 1
+        while block_hash > required:  # Keep mining until Mr. Block gets lucky. 🍀
+            nonce += 1  # Increment the nonce for each mining attempt. 🚀
+            block_hash = hash_nonce(nonce)  # Fingerprint the new attempt. 🔄
+            attempts += 1
+        self.nonce = nonce
+        self.hash = block_hash  # Lock in Mr. Block's winning fingerprint. 🔒
+        return attempts  # How many hashes it took. 🔢
+
+    def mine_block_parallel(self, difficulty: int, workers: int, target: Optional[int] = None) -> int:
+        required = target_hex(self.mining_target(difficulty, target))
+        best_nonce = Value('q', 2 ** 63 - 1)  # Nobody has won yet. 🏁
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_miner, initargs=(best_nonce,)) as pool:
+            futures = [pool.submit(_search_nonces, self, required, self.nonce, worker, workers) for worker in range(workers)]
+            results = [future.result() for future in futures]  # Wait for every miner to clock out. ⏱️
+        self.nonce = min(nonce for nonce, _ in results if nonce is not None)  # The lowest winner, same as the serial miner finds. 🥇
+        self.hash = self.compute_hash()  # Lock in Mr. Block's winning fingerprint. 🔒
+        return sum(attempts for _, attempts in results)  # Total hashes across the whole crew. 🔢
+
+class BalanceLedger:
+    def __init__(self):
+        self.balances: Dict[str, int] = {}  # Address -> balance, kept up to date block by block. 📒
+
+    def apply_block(self, block: Block):
+        for transaction in block.transactions:  # Book every transaction in the new block. 🧾
+            self.balances[transaction['sender']] = self.balances.get(transaction['sender'], 0) - transaction['amount'] - transaction_fee(transaction)  # ➖ (plus the miner's tip)
+            self.balances[transaction['recipient']] = self.balances.get(transaction['recipient'], 0) + transaction['amount']  # ➕
+
+    def rebuild(self, chain: List[Block]):
+        self.balances = {}  # Tear out all the pages... 📒
+        for block in chain:
+            self.apply_block(block)  # ...and write them again from the chain. ✍️
+
+    def get_balance(self, address: str) -> int:
+        return self.balances.get(address, 0)  # Never seen this address? Then it's broke. 🪙
+
+    def get_balances(self, addresses: List[str]) -> Dict[str, int]:
+        return {address: self.balances.get(address, 0) for address in addresses}  # A whole dashboard in one go. 📊
+
+    def top_holders(self, n: int) -> List[Tuple[str, int]]:
+        return heapq.nlargest(n, self.balances.items(), key=lambda item: item[1])  # The richest n addresses. 🤑
+
+class TimestampIndex:
     def __init__(self):
+        self.times = array('d')  # Timestamps, kept sorted so we can binary search them. ⏱️
+        self.blocks = array('q')  # Which block each timestamp belongs to. 📦
+        self.positions = array('q')  # And where inside that block. 📍
+
+    def add(self, timestamp: float, block: int, position: int = 0):
+        if not self.times or timestamp >= self.times[-1]:  # Clocks usually only go forward... ⏩
+            self.times.append(timestamp)
+            self.blocks.append(block)
+            self.positions.append(position)
+        else:  # ...but not always, so slot stragglers into their sorted place. 🧩
+            slot = bisect_right(self.times, timestamp)
+            self.times.insert(slot, timestamp)
+            self.blocks.insert(slot, block)
+            self.positions.insert(slot, position)
+
+    def span(self, start: Optional[float] = None, end: Optional[float] = None) -> range:
+        low = 0 if start is None else bisect_left(self.times, start)  # First entry at or after start. 🔎
+        high = len(self.times) if end is None else bisect_left(self.times, end)  # First entry at or after end (end is exclusive). 🔎
+        return range(low, max(low, high))
+
+    def between(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Tuple[int, int]]:
+        for slot in self.span(start, end):  # Hand out (block, position) pairs one at a time. 🐌
+            yield self.blocks[slot], self.positions[slot]
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+class Mempool:
+    def __init__(self, max_count: int = MEMPOOL_MAX_COUNT, max_bytes: int = MEMPOOL_MAX_BYTES, priority: Optional[Callable[[Dict[str, Any], int], float]] = None):
+        self.max_count = max_count  # At most this many transactions wait at once... 🚪
+        self.max_bytes = max_bytes  # ...taking up at most this many bytes of JSON. 📏
+        self.priority = priority or fee_rate  # Who gets into the next block first (higher wins). 🥇
+        self.entries: Dict[str, list] = {}  # Transaction hash -> [priority, arrival, hash, transaction, size]. 🗂️
+        self.bytes = 0
+        self._best: List[Tuple[float, int, str]] = []  # Max-heap (negated) for picking block contents. 🔝
+        self._worst: List[Tuple[float, int, str]] = []  # Min-heap for picking who gets kicked out. 🔻
+        self._arrivals = 0  # Ticket numbers, so equal priorities go first come, first served. 🎟️
+        self.duplicates = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def add(self, transaction: Dict[str, Any]) -> bool:
+        """Queue `transaction`; False if it is already waiting, has no numeric priority, or ranks too low to fit."""
+        if type(transaction) is not dict:
+            transaction = dict(transaction)  # A row from a compact block (say, after a reorg) becomes a plain dict again. 📜
+        data = entry_bytes(transaction)
+        key = hashlib.sha256(b'\x00' + data).hexdigest()  # Same as hash_entry: the transaction's Merkle leaf. 🍃
+        if key in self.entries:
+            self.duplicates += 1  # Seen it, still waiting. 🙅
+            return False
+        size = len(data)
+        try:
+            priority = float(self.priority(transaction, size))  # A fee of "lots" can't be ranked... 🤷
+        except (TypeError, ValueError):
+            priority = math.nan
+        if math.isnan(priority):
+            self.rejected += 1  # ...so turn it away before it touches the pool. 🚪
+            return False
+        victims: List[list] = []
+        freed = 0
+        while len(self.entries) - len(victims) >= self.max_count or self.bytes - freed + size > self.max_bytes:
+            worst = self._pop_worst()
+            if worst is None or worst[0] >= priority:  # Nobody cheaper to kick out, so the newcomer loses. 🚫
+                for record in ([worst] if worst else []) + victims:
+                    heapq.heappush(self._worst, (record[0], -record[1], record[2]))  # Put the would-be victims back. ↩️
+                self.rejected += 1
+                return False
+            victims.append(worst)
+            freed += worst[4]
+        for record in victims:
+            self._drop(record[2])  # Make room at the bottom of the pile. 🧹
+        self.evicted += len(victims)
+        self._arrivals += 1
+        self.entries[key] = [priority, self._arrivals, key, transaction, size]
+        self.bytes += size
+        heapq.heappush(self._best, (-priority, self._arrivals, key))
+        heapq.heappush(self._worst, (priority, -self._arrivals, key))
+        return True
+
+    def _live(self, key: str, arrival: int) -> Optional[list]:
+        record = self.entries.get(key)
+        return record if record is not None and record[1] == arrival else None  # Heaps hold stale tickets until they're popped. 👻
+
+    def _pop_worst(self) -> Optional[list]:
+        while self._worst:
+            _, arrival, key = heapq.heappop(self._worst)
+            record = self._live(key, -arrival)
+            if record is not None:
+                return record
+        return None
+
+    def _drop(self, key: str) -> Optional[Dict[str, Any]]:
+        record = self.entries.pop(key, None)
+        if record is None:
+            return None
+        self.bytes -= record[4]
+        if len(self._best) > 2 * len(self.entries) + MEMPOOL_COMPACT_SLACK:
+            self._compact()  # Too many stale tickets; tidy the heaps up. 🧽
+        return record[3]
+
+    def _compact(self):
+        self._best = [(-record[0], record[1], record[2]) for record in self.entries.values()]
+        self._worst = [(record[0], -record[1], record[2]) for record in self.entries.values()]
+        heapq.heapify(self._best)
+        heapq.heapify(self._worst)
+
+    def take(self, max_count: Optional[int] = None, max_bytes: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Remove and return the highest-priority transactions that fit in `max_count` entries and `max_bytes` bytes."""
+        taken: List[Dict[str, Any]] = []
+        skipped: List[Tuple[float, int, str]] = []
+        used = 0
+        while self._best and (max_count is None or len(taken) < max_count) and len(skipped) < MEMPOOL_SKIP_LIMIT:
+            item = heapq.heappop(self._best)
+            record = self._live(item[2], item[1])
+            if record is None:
+                continue
+            if max_bytes is not None and used + record[4] > max_bytes:
+                skipped.append(item)  # Too big for what's left of the block; maybe next time. ⏭️
+                continue
+            used += record[4]
+            self.entries.pop(item[2])
+            self.bytes -= record[4]
+            taken.append(record[3])
+        for item in skipped:
+            heapq.heappush(self._best, item)
+        if len(self._worst) > 2 * len(self.entries) + MEMPOOL_COMPACT_SLACK:
+            self._compact()
+        return taken
+
+    def remove(self, transaction: Dict[str, Any]) -> bool:
+        """Forget `transaction` (e.g. because another node already mined it)."""
+        return self._drop(hash_entry(transaction)) is not None
+
+    def clear(self):
+        self.entries = {}
+        self.bytes = 0
+        self._best = []
+        self._worst = []
+
+    def __contains__(self, transaction: Dict[str, Any]) -> bool:
+        return hash_entry(transaction) in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for record in self.entries.values():  # In arrival order. 🚶
+            yield record[3]
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self.entries), 'bytes': self.bytes, 'duplicates': self.duplicates, 'rejected': self.rejected, 'evicted': self.evicted}
+
+class PendingEntries(list):
+    """A snapshot of the mempool. Appending to it queues the entry in the mempool too; any other edit raises."""
+    __slots__ = ('_add',)
+
+    def __init__(self, entries: Iterator[Dict[str, Any]], add: Callable[[Dict[str, Any]], bool]):
+        super().__init__(entries)
+        self._add = add  # Where new arrivals really go. 📬
+
+    def append(self, entry: Dict[str, Any]):
+        if self._add(entry):  # Into the mempool first, so it actually gets mined. ⛏️
+            super().append(entry)
+
+    def extend(self, entries: Iterator[Dict[str, Any]]):
+        for entry in entries:
+            self.append(entry)
+
+    def __iadd__(self, entries: Iterator[Dict[str, Any]]) -> 'PendingEntries':
+        self.extend(entries)
+        return self
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Pending entries are a snapshot of the mempool; assign a new list or use the mempool to change them")  # No silent no-ops. 🙅
+
+    insert = remove = pop = clear = sort = reverse = __setitem__ = __delitem__ = __imul__ = _read_only
+
+class DifficultyRetarget:
+    """Moves the mining target every `window` blocks so blocks arrive about every `block_interval` seconds."""
+
+    def __init__(self, block_interval: float, window: int = RETARGET_WINDOW, initial_target: int = difficulty_target(4),
+                 max_adjust: float = RETARGET_MAX_ADJUST, start_height: int = 1):
+        self.block_interval = block_interval  # Seconds we'd like between blocks. ⏱️
+        self.window = window  # Blocks per retarget period. 🔁
+        self.initial_target = initial_target  # The target of the first period. 🎯
+        self.max_adjust = max_adjust  # The biggest step in either direction. 🪜
+        self.start_height = start_height  # The first block we retarget; the ones before it keep the target they were mined at. 🚩
+
+    def period(self, height: int) -> int:
+        return max(height - self.start_height, 0) // self.window  # The first window blocks are period 0, and so on. 🗓️
+
+    def known_periods(self, height: int) -> int:
+        return max(height - self.start_height + 1, 0) // self.window + 1  # Periods worked out from blocks up to `height` only. 🗓️
+
+    def next_target(self, target: int, elapsed: float) -> int:
+        """The target after a period whose `window` blocks took `elapsed` seconds under `target`."""
+        # Random block times make window / elapsed a biased speedometer: on average it reads window / (window - 1) too fast. 📏
+        # So aim at window - 1 intervals, and the mean block time lands right on block_interval. 🎯
+        expected = max(self.window - 1, 1) * self.block_interval
+        elapsed = min(max(elapsed, expected / self.max_adjust), expected * self.max_adjust)  # No wild swings. 🪜
+        # Integer microseconds keep the arithmetic exact, so every node lands on the very same target. 🔢
+        return max(1, min(MAX_TARGET, target * round(elapsed * 1e6) // round(expected * 1e6)))
+
+    def target_at(self, height: int, timestamp_of: Callable[[int], float], targets: List[int]) -> int:
+        """Target of the block at `height`. `timestamp_of(h)` is block h's timestamp; `targets` caches one target per period."""
+        if not targets:
+            targets.append(self.initial_target)
+        while len(targets) <= self.period(height):
+            start = (len(targets) - 1) * self.window + self.start_height - 1  # The previous period ran from this block... ⏮️
+            elapsed = timestamp_of(start + self.window) - timestamp_of(start)  # ...to this one. ⏭️
+            targets.append(self.next_target(targets[-1], elapsed))
+        return targets[self.period(height)]
+
+    def expected_target(self, height: int, previous_target: Optional[int], timestamp_of: Callable[[int], float], targets: List[int]) -> int:
+        """The target the block at `height` must carry, given the target stored in the block before it."""
+        if previous_target is None or height <= self.start_height:
+            return self.target_at(height, timestamp_of, targets)  # The first block, or one after blocks that carry no target. 📜
+        if (height - self.start_height) % self.window:
+            return previous_target  # Mid-period: same target as the block before. 🔁
+        elapsed = timestamp_of(height - 1) - timestamp_of(height - 1 - self.window)  # How long the last period took. ⏱️
+        return self.next_target(previous_target, elapsed)
+
+class ChainView(Sequence):
+    """The chain as a sequence whose blocks are loaded from `source` on access and kept in an LRU cache (unbounded if `cache_size` is None)."""
+
+    def __init__(self, source: Any, cache_size: Optional[int], length: Optional[int] = None,
+                 prepare: Optional[Callable[[Block], None]] = None, prefetch: int = CHAIN_PREFETCH):
+        self.source = source  # Where the blocks really live: anything with source[height], like a BlockStore. 💾
+        self.cache_size = cache_size  # How many blocks we keep in memory at most (None: every block we ever loaded). 🧠
+        self.prepare = prepare  # Called on every block freshly loaded from the source. 🧽
+        self.prefetch = prefetch  # How far scans read ahead (0 = no helper thread). 🔭
+        self._length = len(source) if length is None else length
+        self._cache: 'OrderedDict[int, Block]' = OrderedDict()  # Height -> block, least recently used first. 🗂️
+        self._lock = threading.Lock()  # The read-ahead helper touches the cache too. 🔒
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _load(self, height: int) -> Block:
+        block = self.source[height]  # Fetch Mr. Block from the source. 📖
+        if self.prepare is not None:
+            self.prepare(block)
+        return block
+
+    def _cached(self, height: int) -> Optional[Block]:
+        with self._lock:
+            block = self._cache.get(height)
+            if block is None:
+                self.misses += 1
+            else:
+                self._cache.move_to_end(height)  # Freshly used, so last in line for eviction. 🔝
+                self.hits += 1
+            return block
+
+    def _remember(self, height: int, block: Block):
+        with self._lock:
+            self._cache[height] = block
+            self._cache.move_to_end(height)
+            while self.cache_size is not None and len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)  # Forget whoever we haven't needed for the longest. 🗑️
+                self.evictions += 1
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[i] for i in range(*height.indices(len(self)))]
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError("block index out of range")
+        block = self._cached(height)
+        if block is None:
+            block = self._load(height)  # Not in memory? Load it and keep it around for a while. 📥
+            self._remember(height, block)
+        return block
+
+    def append(self, block: Block):
+        self._remember(self._length, block)  # The owner has already saved it to the source. 💾
+        self._length += 1
+
+    def __delitem__(self, index):
+        start, stop, step = index.indices(len(self)) if isinstance(index, slice) else (None, None, None)
+        if start is None or stop != len(self) or step != 1:
+            raise TypeError("A ChainView can only drop blocks from the end")
+        with self._lock:
+            for height in [height for height in self._cache if height >= start]:
+                del self._cache[height]
+        self._length = min(self._length, start)
+
+    def __iter__(self) -> Iterator[Block]:
+        return self.scan()
+
+    def scan(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Block]:
+        """Blocks [start, stop) in order, with a helper thread reading up to `prefetch` blocks ahead."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if self.prefetch <= 0 or stop - start < 2:
+            for height in range(start, stop):
+                yield self[height]
+            return
+        ahead: 'queue.Queue' = queue.Queue(self.prefetch)  # Blocks the helper fetched but we haven't used yet. 🛤️
+        done = threading.Event()
+
+        def read_ahead():
+            for height in range(start, stop):
+                try:
+                    block = self._cached(height) or self._load(height)
+                except BaseException as error:  # Hand any trouble over to the scanning thread. 🚨
+                    block = error
+                while not done.is_set():
+                    try:
+                        ahead.put((height, block), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if done.is_set() or isinstance(block, BaseException):
+                    return
+
+        helper = threading.Thread(target=read_ahead, name='chain-prefetch', daemon=True)
+        helper.start()
+        try:
+            for _ in range(start, stop):
+                height, block = ahead.get()
+                if isinstance(block, BaseException):
+                    raise block
+                self._remember(height, block)
+                yield block
+        finally:
+            done.set()  # Tell the helper to stop if we quit early. 🛑
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {'length': len(self), 'cached': len(self._cache), 'cache_size': self.cache_size, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+class Blockchain:
+    TIMED_QUERIES = ('get_transaction_proof', 'get_balance', 'get_balances', 'top_holders', 'scan_balance')  # Lookups whose latency we report. ⏱️
+
+    def __init__(self, store: Optional[Any] = None, compact: bool = False, metrics: Optional[Any] = None,
+                 checkpoints: Optional[Any] = None, trust_checkpoint: bool = False, archive: Optional[Any] = None,
+                 keep_blocks: Optional[int] = None, keep_seconds: Optional[float] = None, cache_blocks: Optional[int] = None,
+                 retarget: Optional[DifficultyRetarget] = None):
         self.chain: List[Block] = []  # The list where all Mr. Blocks hang out. 📚
-        self.pending_transactions: List[Dict[str, Any]] = []  # Transactions waiting for a block party. 🎉
-        self.difficulty = 4  # How tough the mining challenge is. 💪
+        if store is not None and (cache_blocks is not None or checkpoints is not None):
+            # Mr. Blocks load from disk when asked for, so a restart never decodes the ones it doesn't need. 💤
+            # With cache_blocks only the hottest stay in memory; with just checkpoints, every one we load stays. 🧠
+            self.chain = ChainView(store, cache_blocks, prepare=self._prepare_loaded)
+        self.store = store  # Where Mr. Blocks are saved on disk (a BlockStore), if anywhere. 💾
+        self.archive = archive  # Where pruned blocks' transactions go (a PayloadArchive), if we prune at all. 🧊
+        self.keep_blocks = keep_blocks  # Keep full transactions for the newest this many blocks... 📦
+        self.keep_seconds = keep_seconds  # ...or for blocks younger than this many seconds. ⏳
+        self.pruned_height = 0  # Blocks below this height have been through pruning. ✂️
+        self.checkpoints = checkpoints  # Where balance snapshots are saved (a CheckpointStore), if anywhere. 📸
+        self.checkpoint_interval = 1000  # Snapshot the balances every this many blocks (0 = only when asked). ⏲️
+        self.checkpoint_height: Optional[int] = None  # Height of the latest snapshot we saved or started from. 📍
+        self.trust_checkpoint = trust_checkpoint  # Count blocks up to the snapshot as already checked on startup. 🤝
+        self.compact = compact  # Keep transactions in packed columns instead of one dict each. 🗄️
+        self.mempool = Mempool()  # Transactions waiting for a block party, best tippers first. 🎉
+        self.max_block_transactions = BLOCK_MAX_TRANSACTIONS  # How many of them fit in one block... 📦
+        self.max_block_bytes = BLOCK_MAX_BYTES  # ...and how many bytes. 📦
+        self.difficulty = 4  # How tough the mining challenge is (leading hex zeros), unless we retarget. 💪
+        self.retarget = retarget  # Adjusts the target to hold a block interval, if set. 🎯
+        self.targets: List[int] = []  # The target of each retarget period so far, worked out as needed. 🗓️
         self.reward = 50  # Reward for mining a block. 💰
-        self.create_genesis_block()  # The birth of the very first Mr. Block. 🌟
+        self.mining_workers = 1  # How many CPU cores to mine with. 🧠
+        self.last_mining_stats: Dict[str, float] = {}  # Hashes, seconds and hash rate of the latest block. 📈
+        self.verified_height = 0  # The highest block we already checked. 🏔️
+        self.verified_hash: Optional[str] = None  # Its hash, so we notice if the chain was swapped out. 🔐
+        self.validation_error: Optional[str] = None  # Why the last check failed, if it did. 📝
+        self.ledger = BalanceLedger()  # Everybody's balance, updated as blocks arrive. 📒
+        self._block_times: Optional[TimestampIndex] = None  # Block timestamps, sorted for time-range queries once somebody asks. ⏱️
+        self.set_metrics(metrics)  # Where counters and timings go (see Metrics.py), or None to skip them. 📈
+        self.mining_profile: Optional[str] = None  # Set to a file path to cProfile the next mining runs into it. 🩻
+        if archive is not None and len(archive) > (len(store) if store is not None else 0):
+            archive.truncate(len(store) if store is not None else 0)  # Anything past our saved chain is left over from another run. 🧹
+        if store is not None and len(store):
+            self.load_from_store()  # Pick up where the last run left off. 💾
+        else:
+            self.create_genesis_block()  # The birth of the very first Mr. Block. 🌟
+
+    def set_metrics(self, metrics: Optional[Any]):
+        self.metrics = metrics
+        for name in self.TIMED_QUERIES:  # Wrap the lookups in stopwatches only while someone is watching... 👀
+            if metrics is None:
+                self.__dict__.pop(name, None)  # ...so with metrics off they cost exactly nothing extra. 🙈
+            else:
+                setattr(self, name, _timed_query(metrics, name, getattr(type(self), name).__get__(self)))
 
     def create_genesis_block(self):
-        genesis_block = Block(0, time(), [], "0")  # The first block ever, with no transactions and no history. 👶
-        self.chain.append(genesis_block)  # Add this ancient block to the chain. 📜
+        genesis_block = Block(0, time(), [], "0", target=self.target_at(0))  # The first block ever, with no transactions and no history. 👶
+        self.append_block(genesis_block)  # Add this ancient block to the chain. 📜
+
+    def append_block(self, block: Block):
+        if self.store is not None:
+            self.store.append(block)  # Save Mr. Block to disk first. 💾
+        if self.compact:
+            block.transactions = TransactionColumns.pack(block.transactions)  # Squeeze the transactions into columns. 🗜️
+        self.chain.append(block)  # Add Mr. Block to the chain. 📚
+        self.ledger.apply_block(block)  # And book his transactions right away. 📒
+        if self._block_times is not None:
+            self._block_times.add(block.timestamp, len(self.chain) - 1)  # And note when he showed up. ⏱️
+        if self.checkpoints is not None and self.checkpoint_interval and block.index and block.index % self.checkpoint_interval == 0:
+            self.save_checkpoint()  # Every so often, snapshot the balances for a quick restart. 📸
+        if self.archive is not None:
+            self.prune()  # Send whatever just left the keep window to cold storage. 🧊
+
+    def _prepare_loaded(self, block: Block):
+        if block.index < self.pruned_height and block.version >= HASH_VERSION_HEADER:
+            # The store still has the whole block, but a pruned one comes back as just a claim ticket. 🎟️
+            block.transactions = ArchivedPayload(self.archive, block.index, len(block.transactions), block.merkle_root)
+        elif self.compact:
+            block.transactions = TransactionColumns.pack(block.transactions)  # Reloaded blocks get squeezed too. 🗜️
+
+    def load_from_store(self):
+        if self.archive is not None:
+            self.pruned_height = len(self.archive)  # A previous run already archived these, so they come back as claim tickets. 🎟️
+        if not isinstance(self.chain, ChainView):
+            for block in self.store:  # Read every saved Mr. Block back in. 📖
+                self._prepare_loaded(block)  # Squeezed or pruned, just like before the restart. 🗜️
+                self.chain.append(block)
+                if self.archive is not None:
+                    self.prune()  # Prune as we go so old transactions never all sit in memory at once. ✂️
+        elif self.archive is not None:
+            self.prune()  # A lazy chain already knows its length; only blocks that newly left the keep window get loaded. ✂️
+        self.restore_balances()  # Then count the coins, from a snapshot if we have one (replaying only the blocks after it). 📒
+
+    def prune(self) -> int:
+        """Move the transactions of blocks outside the keep window into self.archive; returns how many blocks were pruned."""
+        if self.archive is None or (self.keep_blocks is None and self.keep_seconds is None):
+            return 0  # Pruning is off. 🙅
+        limit = len(self.chain)
+        if self.keep_blocks is not None:
+            limit -= self.keep_blocks  # The newest keep_blocks stay whole... 📦
+        if self.keep_seconds is not None:
+            cutoff = time() - self.keep_seconds  # ...and so does anything younger than keep_seconds. ⏳
+            height = self.pruned_height
+            while height < limit and self.chain[height].timestamp < cutoff:
+                height += 1
+            limit = height
+        pruned = 0
+        for height in range(self.pruned_height, limit):
+            block = self.chain[height]
+            if height == len(self.archive):
+                self.archive.append(plain_entries(block.transactions))  # Freeze the transactions (unless a previous run already did)... 🧊
+            if block.version >= HASH_VERSION_HEADER:  # Legacy fingerprints hash the whole payload, so those blocks stay whole. 📜
+                block.transactions = ArchivedPayload(self.archive, height, len(block.transactions), block.merkle_root)  # ...and keep just a claim ticket. 🎟️
+                pruned += 1
+        self.pruned_height = max(self.pruned_height, limit)
+        return pruned
+
+    def save_checkpoint(self) -> str:
+        """Snapshot the balances at the current tip into self.checkpoints; returns the file written."""
+        started = perf_counter()
+        tip = self.get_last_block()
+        path = self.checkpoints.save(len(self.chain) - 1, tip.hash, self.ledger.balances)  # Balances plus the tip's fingerprint. 📸
+        self.checkpoint_height = len(self.chain) - 1
+        if self.metrics is not None:
+            self.metrics.observe('checkpoint_save_seconds', perf_counter() - started)  # How long the snapshot took. ⏱️
+        return path
+
+    def restore_balances(self):
+        """Rebuild the ledger from the newest checkpoint that matches this chain, or from scratch if none does."""
+        checkpoint = None
+        if self.checkpoints is not None:
+            checkpoint = self.checkpoints.latest(  # Only a snapshot of *this* chain will do. 🔐
+                lambda snapshot: snapshot['height'] < len(self.chain) and self.chain[snapshot['height']].hash == snapshot['block_hash'])
+        if checkpoint is None:
+            self.ledger.rebuild(self.chain)  # No snapshot? Count everything the long way. 🐢
+            return
+        height = checkpoint['height']
+        self.ledger.balances = checkpoint['balances']  # Start from the snapshot... 📸
+        for block in self.iter_blocks(height + 1):
+            self.ledger.apply_block(block)  # ...and book only what came after it. ⏩
+        self.checkpoint_height = height
+        if self.trust_checkpoint:
+            self.verified_height = height  # Take the snapshot's word for everything up to it. 🤝
+            self.verified_hash = checkpoint['block_hash']
+        if self.metrics is not None:
+            self.metrics.inc('checkpoint_blocks_skipped_total', height + 1)  # Blocks we didn't have to replay. ⏭️
+
+    def rewind(self, height: int) -> List[Block]:
+        """Drop every block above `height` (-1 drops genesis too) and return them, oldest first."""
+        dropped = self.chain[height + 1:]
+        del self.chain[height + 1:]  # Back up to the fork... ⏪
+        if self.store is not None:
+            self.store.truncate(len(self.chain))  # ...on disk too. 💾
+        if self.archive is not None and self.pruned_height > len(self.chain):
+            for block in dropped:
+                if type(block.transactions) is ArchivedPayload:
+                    block.transactions = block.transactions.load()  # Thaw the dropped blocks before their archive entries go. 🔥
+            self.archive.truncate(len(self.chain))  # ...and in the archive. 🧊
+            self.pruned_height = len(self.chain)
+        if self.verified_height > height:
+            self.verified_height = max(height, 0)
+            self.verified_hash = self.chain[height].hash if height >= 0 else None
+        if self.retarget is not None:
+            del self.targets[self.retarget.known_periods(height) if height >= 0 else 0:]  # Forget targets worked out from dropped blocks. 🗓️
+        self.checkpoint_height = None
+        self.restore_balances()  # Recount the coins (from a snapshot if one is still on this chain). 📒
+        self._block_times = None  # Re-sorted on the next time query. ⏱️
+        return dropped
+
+    def target_at(self, height: int) -> int:
+        """The target a new block at `height` should carry (and the one older, target-less blocks must meet)."""
+        if self.retarget is None or height < self.retarget.start_height:
+            return difficulty_target(self.difficulty)  # Same target for everyone. 🎯
+        previous = self.chain[height - 1].target if 0 < height <= len(self.chain) else None  # Where the last block left off. ⏮️
+        return self.retarget.expected_target(height, previous, lambda h: self.chain[h].timestamp, self.targets)
+
+    def block_target(self, height: int) -> int:
+        """The target the block at `height` was mined against: hash <= target."""
+        target = self.chain[height].target  # Sealed into the header, so changing the difficulty later can't break old blocks. 🔏
+        return self.target_at(height) if target is None else target
+
+    def target_problem(self, height: int) -> Optional[str]:
+        target = self.chain[height].target
+        if target is None:
+            return None  # Older blocks don't carry one; block_target holds them to target_at. 📜
+        if not 0 < target <= MAX_TARGET:
+            return "target out of range"
+        if self.retarget is not None and height >= self.retarget.start_height and target != self.target_at(height):
+            return "target off schedule"  # Mr. Block picked an easier target than the schedule allows. 🙅
+        return None
 
     def get_last_block(self) -> Block:
         return self.chain[-1]  # Find the most recent Mr. Block. 🔍
 
-    def add_transaction(self, transaction: Dict[str, Any]):
-        self.pending_transactions.append(transaction)  # Add a transaction to the waiting list. 📝
+    @property
+    def pending_transactions(self) -> PendingEntries:
+        return PendingEntries(self.mempool, self.add_transaction)  # Everything still waiting, in arrival order; .append() queues more. 📝
+
+    @pending_transactions.setter
+    def pending_transactions(self, transactions: List[Dict[str, Any]]):
+        self.mempool.clear()
+        for transaction in transactions:
+            self.mempool.add(transaction)
+
+    def add_transaction(self, transaction: Dict[str, Any]) -> bool:
+        accepted = self.mempool.add(transaction)  # Add a transaction to the waiting list, unless it's a repeat or the list is full. 📝
+        if self.metrics is not None:
+            self.metrics.set('mempool_size', len(self.mempool))  # How long the waiting list is. 📏
+            self.metrics.set('mempool_bytes', self.mempool.bytes)
+            if not accepted:
+                self.metrics.inc('mempool_rejected_total')
+        return accepted
 
-    def mine_pending_transactions(self, miner_address: str):
+    def mine_pending_transactions(self, miner_address: str, workers: Optional[int] = None):
+        transactions = self.mempool.take(self.max_block_transactions, self.max_block_bytes)  # The best-paying transactions that fit. 🥇
+        reward = self.reward + sum(transaction_fee(transaction) for transaction in transactions)  # The miner pockets the tips too. 💰
         new_block = Block(
             index=len(self.chain),  # The new block’s position in the chain. 🏷️
             timestamp=time(),  # The time the new block is created. ⏰
-            transactions=self.pending_transactions + [{'sender': 'network', 'recipient': miner_address, 'amount': self.reward}],  # Transactions plus the mining reward. 💸
-            previous_hash=self.get_last_block().hash  # The previous block’s hash. 🧬
+            transactions=transactions + [{'sender': 'network', 'recipient': miner_address, 'amount': reward}],  # Transactions plus the mining reward. 💸
+            previous_hash=self.get_last_block().hash,  # The previous block’s hash. 🧬
+            target=self.target_at(len(self.chain))  # Sealed into the header, so it can be checked forever after. 🔏
         )
-        new_block.mine_block(self.difficulty)  # Start mining until the block is worthy. ⛏️
-        self.chain.append(new_block)  # Add this new block to the blockchain party. 🎉
-        self.pending_transactions = []  # Clear the list of pending transactions. 🧹
+        workers = workers or self.mining_workers  # Use the crew size we were given, or the default. 👷
+        target = new_block.target  # How small Mr. Block's fingerprint has to be. 🎯
+        started = time()  # Start the stopwatch. ⏱️
+        if self.mining_profile:
+            profile = cProfile.Profile()
+            attempts = profile.runcall(new_block.mine_block, self.difficulty, workers, target)  # Mine with the X-ray goggles on. 🩻
+            profile.dump_stats(self.mining_profile)  # Open it with pstats or snakeviz. 📂
+        else:
+            attempts = new_block.mine_block(self.difficulty, workers, target)  # Start mining until the block is worthy. ⛏️
+        elapsed = time() - started
+        self.last_mining_stats = {'workers': workers, 'attempts': attempts, 'seconds': elapsed, 'hash_rate': attempts / elapsed if elapsed else 0.0,
+                                  'difficulty_bits': difficulty_bits(target)}  # Brag about the hash rate. 📈
+        self.append_block(new_block)  # Add this new block to the blockchain party. 🎉
+        if self.metrics is not None:
+            self.metrics.inc('hash_attempts_total', attempts)  # Every nonce we tried. 🔢
+            self.metrics.inc('blocks_mined_total')
+            self.metrics.set('mining_difficulty_bits', difficulty_bits(target))  # How hard the current target is. 📐
+            self.metrics.observe('block_mine_seconds', elapsed)  # How long this block took. ⏱️
+            self.metrics.set('mempool_size', len(self.mempool))  # Whatever didn't fit waits for the next block. ⏳
+            self.metrics.set('mempool_bytes', self.mempool.bytes)
 
-    def is_chain_valid(self) -> bool:
-        for i in range(1, len(self.chain)):  # Loop through each block starting from the second one. 🔁
-            current_block = self.chain[i]  # The block we're currently checking. 🕵️‍♂️
-            previous_block = self.chain[i - 1]  # The block just before the current one. 🧓
+    def find_invalid_block(self, full: bool = False, workers: int = 1) -> Optional[int]:
+        if self.metrics is None:
+            return self._find_invalid_block(full, workers)
+        started = perf_counter()
+        bad_block = self._find_invalid_block(full, workers)
+        self.metrics.observe('validation_seconds', perf_counter() - started, full=full)  # How long the check took. ⏱️
+        if bad_block is not None:
+            self.metrics.inc('validation_failures_total')  # Uh-oh. 🚨
+        return bad_block
 
-            if current_block.hash != current_block.compute_hash():  # Check if the block’s fingerprint hasn’t changed. ❓
-                return False
-            if current_block.previous_hash != previous_block.hash:  # Make sure the block’s previous hash matches the actual previous block. 🔗
-                return False
-        return True  # If everything checks out, the chain is valid! ✅
+    def _find_invalid_block(self, full: bool = False, workers: int = 1) -> Optional[int]:
+        start = 1  # Genesis has nobody to link to, so start from the second block. 🔁
+        if not full and 0 < self.verified_height < len(self.chain) and self.chain[self.verified_height].hash == self.verified_hash:
+            start = self.verified_height + 1  # Skip everything we already checked last time. ⏭️
+        heights = range(start, len(self.chain))
+        if self.metrics is not None:
+            self.metrics.inc('blocks_validated_total', len(heights))  # How many blocks this check had to look at. 🔢
+        if workers > 1 and len(heights) > 1:
+            blocks = [self.chain[i] for i in heights]
+            with ProcessPoolExecutor(max_workers=workers) as pool:  # Every block's fingerprint can be checked on its own. 👷‍♀️👷
+                problems = list(pool.map(_check_block, blocks, chunksize=max(1, len(blocks) // (workers * 4))))
+        else:
+            problems = map(_check_block, self.iter_blocks(start))  # One block at a time, so a lazy chain never loads it all. 🐌
+        for i, problem in zip(heights, problems):  # Only the hash links have to be walked in order. 🔗
+            if problem is None and self.chain[i].previous_hash != self.chain[i - 1].hash:  # Make sure the block’s previous hash matches the actual previous block. 🔗
+                problem = "previous hash mismatch"
+            if problem is None:
+                problem = self.target_problem(i)
+            if problem is None and self.chain[i].hash > target_hex(self.block_target(i)):
+                problem = "hash above target"  # Not enough work for this height. ⛏️
+            if problem is not None:
+                self.validation_error = f"Block {i}: {problem}"  # Remember what went wrong. 📝
+                self.verified_height = i - 1
+                self.verified_hash = self.chain[i - 1].hash
+                return i  # The first bad block. 🚨
+        self.validation_error = None
+        self.verified_height = len(self.chain) - 1  # Everything up to the tip checks out. 🏔️
+        self.verified_hash = self.chain[-1].hash
+        return None
+
+    def is_chain_valid(self, full: bool = False, workers: int = 1) -> bool:
+        return self.find_invalid_block(full, workers) is None  # If everything checks out, the chain is valid! ✅
+
+    def get_transaction_proof(self, block_index: int, position: int) -> Dict[str, Any]:
+        block = self.chain[block_index]  # The block holding the transaction. 📦
+        return {
+            'block_index': block.index,
+            'block_hash': block.hash,
+            'merkle_root': block.merkle_root,
+            'transaction': block.transactions[position],
+            'proof': block.get_inclusion_proof(position),  # Just log2(n) hashes, not the whole block! 🪶
+        }
 
     def get_balance(self, address: str) -> int:
+        return self.ledger.get_balance(address)  # Look it up instead of walking the whole chain. 🏧
+
+    def get_balances(self, addresses: List[str]) -> Dict[str, int]:
+        return self.ledger.get_balances(addresses)  # Many balances, one call. 📊
+
+    def top_holders(self, n: int = 10) -> List[Tuple[str, int]]:
+        return self.ledger.top_holders(n)  # Who's got the most coins? 🤑
+
+    def rebuild_balances(self):
+        self.ledger.rebuild(self.chain)  # Recount everything from the chain. 🔁
+
+    @property
+    def block_times(self) -> TimestampIndex:
+        if self._block_times is None:
+            self.rebuild_block_times()  # Built the first time somebody asks, not on every startup. 💤
+        return self._block_times
+
+    def rebuild_block_times(self):
+        block_times = TimestampIndex()  # Start a fresh timeline... ⏱️
+        for height, block in enumerate(self.chain):
+            block_times.add(block.timestamp, height)  # ...and fill it from the chain. 🔁
+        self._block_times = block_times
+
+    def iter_blocks(self, start_height: int = 0, stop_height: Optional[int] = None) -> Iterator[Block]:
+        if isinstance(self.chain, ChainView):
+            yield from self.chain.scan(start_height, stop_height)  # A lazy chain reads ahead while we work. 🔭
+            return
+        for height in range(*slice(start_height, stop_height).indices(len(self.chain))):  # Heights [start, stop), no list copy. 🐌
+            yield self.chain[height]
+
+    def get_blocks_between(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Block]:
+        for height, _ in self.block_times.between(start, end):  # Blocks with start <= timestamp < end, oldest first. 🗓️
+            yield self.chain[height]
+
+    def get_transactions_between(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        for block in self.get_blocks_between(start, end):  # Transactions carry no clock, so they go by their block's time. ⏰
+            yield from block.transactions
+
+    def scan_balance(self, address: str) -> int:
         balance = 0  # Start with zero balance. 🏦
         for block in self.chain:  # Loop through each block. 🔄
             for transaction in block.transactions:  # Loop through each transaction in the block. 🧾
-                if transaction['sender'] == address:  # If this address is the sender, subtract the amount. ➖
-                    balance -= transaction['amount']
+                if transaction['sender'] == address:  # If this address is the sender, subtract the amount (and any tip). ➖
+                    balance -= transaction['amount'] + transaction_fee(transaction)
                 if transaction['recipient'] == address:  # If this address is the recipient, add the amount. ➕
                     balance += transaction['amount']
         return balance  # Return the final balance. 🏧
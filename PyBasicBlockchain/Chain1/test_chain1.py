@@ -0,0 +1,284 @@
+"""
+Regression tests for the blockchain library. Run from this folder with `python -m pytest`.
+"""
+
+import os
+import random
+import tempfile
+import zlib
+
+import pytest
+
+import PyBasicBlockchain
+from BlockStore import RECORD_HEADER, BlockStore
+from ChainSync import ChainSync, SyncServer
+from Checkpoints import CheckpointStore
+from PayloadArchive import PayloadArchive
+
+def make_node(directory: str, genesis: PyBasicBlockchain.Block) -> PyBasicBlockchain.Blockchain:
+    """A compact, store-backed chain that shares `genesis` with its peers."""
+    store = BlockStore(os.path.join(directory, 'chain'), PyBasicBlockchain.Block)
+    store.append(genesis)
+    node = PyBasicBlockchain.Blockchain(store=store, compact=True)
+    node.difficulty = 1
+    return node
+
+def test_mining_after_a_fork_switch_on_a_compact_stored_chain():
+    peer = PyBasicBlockchain.Blockchain()
+    peer.difficulty = 1
+    with tempfile.TemporaryDirectory() as directory:
+        node = make_node(directory, peer.chain[0])
+        transaction = {'sender': 'alice', 'recipient': 'bob', 'amount': 5}
+        node.add_transaction(transaction)
+        node.mine_pending_transactions('node-miner')
+        for _ in range(2):
+            peer.mine_pending_transactions('peer-miner')  # a longer fork that leaves the transaction out
+        with SyncServer(peer) as server:
+            assert ChainSync(node, [server.address]).sync()
+        assert [block.hash for block in node.chain] == [block.hash for block in peer.chain]
+        assert node.pending_transactions == [transaction]
+        node.mine_pending_transactions('node-miner')  # used to fail encoding the re-queued row for the store
+        assert dict(node.chain[-1].transactions[0]) == transaction
+        assert node.is_chain_valid()
+        node.store.close()
+
+def test_a_transaction_on_both_forks_is_not_requeued():
+    peer = PyBasicBlockchain.Blockchain()
+    peer.difficulty = 1
+    with tempfile.TemporaryDirectory() as directory:
+        node = make_node(directory, peer.chain[0])
+        transaction = {'sender': 'alice', 'recipient': 'bob', 'amount': 5}
+        node.add_transaction(transaction)
+        node.mine_pending_transactions('node-miner')
+        peer.add_transaction(transaction)
+        for _ in range(2):
+            peer.mine_pending_transactions('peer-miner')  # the same transfer, on a longer fork
+        with SyncServer(peer) as server:
+            assert ChainSync(node, [server.address]).sync()
+        assert len(node.mempool) == 0
+        node.mine_pending_transactions('node-miner')
+        assert node.get_balance('alice') == -5 and node.get_balance('bob') == 5
+        node.store.close()
+
+def test_a_transaction_with_a_fee_that_is_not_a_number_leaves_no_trace():
+    mempool = PyBasicBlockchain.Mempool()
+    assert not mempool.add({'sender': 'alice', 'recipient': 'bob', 'amount': 5, 'fee': 'lots'})
+    assert (len(mempool), mempool.bytes, mempool.rejected) == (0, 0, 1)
+    assert mempool.add({'sender': 'alice', 'recipient': 'bob', 'amount': 5, 'fee': 1})
+    assert [entry['fee'] for entry in mempool.take(10, 10_000)] == [1]
+
+def test_a_full_mempool_evicts_its_lowest_fee_transaction():
+    mempool = PyBasicBlockchain.Mempool(max_count=3)
+    for fee in (2, 1, 3):
+        assert mempool.add({'sender': 'alice', 'recipient': 'bob', 'amount': 1, 'fee': fee})
+    assert not mempool.add({'sender': 'carol', 'recipient': 'bob', 'amount': 1, 'fee': 0})  # ranks below everything waiting
+    assert mempool.add({'sender': 'carol', 'recipient': 'bob', 'amount': 1, 'fee': 5})  # pushes the fee-1 transfer out
+    assert (mempool.rejected, mempool.evicted, len(mempool)) == (1, 1, 3)
+    assert [entry['fee'] for entry in mempool.take(2)] == [5, 3]
+    assert [entry['fee'] for entry in mempool] == [2]
+
+def test_mempool_take_skips_what_does_not_fit_in_the_block():
+    mempool = PyBasicBlockchain.Mempool(priority=lambda transaction, size: transaction['fee'])
+    big = {'sender': 'alice', 'recipient': 'bob', 'amount': 1, 'fee': 9, 'memo': 'x' * 500}
+    small = {'sender': 'carol', 'recipient': 'bob', 'amount': 1, 'fee': 1}
+    mempool.add(big)
+    mempool.add(small)
+    assert mempool.take(max_bytes=len(PyBasicBlockchain.entry_bytes(small))) == [small]
+    assert mempool.take() == [big] and mempool.bytes == 0
+
+def test_appending_to_pending_transactions_queues_them():
+    blockchain = PyBasicBlockchain.Blockchain()
+    blockchain.difficulty = 1
+    transaction = {'sender': 'alice', 'recipient': 'bob', 'amount': 5}
+    blockchain.pending_transactions.append(transaction)
+    assert blockchain.pending_transactions == [transaction]
+    with pytest.raises(TypeError):
+        blockchain.pending_transactions.pop()
+    blockchain.mine_pending_transactions('miner')
+    assert blockchain.get_balance('bob') == 5
+
+def test_longer_chain_beats_a_lucky_low_hash():
+    peer = PyBasicBlockchain.Blockchain()
+    peer.difficulty = 1
+    with tempfile.TemporaryDirectory() as directory:
+        node = make_node(directory, peer.chain[0])
+        block = PyBasicBlockchain.Block(1, peer.chain[0].timestamp + 1, [], peer.chain[0].hash, target=node.target_at(1))
+        block.mine_block(1, target=PyBasicBlockchain.difficulty_target(5))  # far more leading zeros than the target it carries
+        node.append_block(block)
+        for _ in range(2):
+            peer.mine_pending_transactions('peer-miner')
+        with SyncServer(peer) as server:
+            assert ChainSync(node, [server.address]).sync()
+        assert node.chain[-1].hash == peer.chain[-1].hash
+        node.store.close()
+
+def test_blocks_must_meet_the_fixed_difficulty_target():
+    blockchain = PyBasicBlockchain.Blockchain()
+    blockchain.difficulty = 2
+    blockchain.mine_pending_transactions('miner')
+    assert blockchain.is_chain_valid()
+    tip = blockchain.chain[-1]
+    target = PyBasicBlockchain.target_hex(blockchain.target_at(tip.index))
+    while tip.hash <= target:
+        tip.nonce += 1  # re-mine it the wrong way: keep the hash honest, miss the target
+        tip.hash = tip.compute_hash()
+    assert not blockchain.is_chain_valid()
+    assert blockchain.validation_error == f'Block {tip.index}: hash above target'
+
+def test_blocks_keep_their_target_when_the_difficulty_changes():
+    blockchain = PyBasicBlockchain.Blockchain()
+    blockchain.difficulty = 1
+    for _ in range(3):
+        blockchain.mine_pending_transactions('miner')
+    blockchain.difficulty = 3
+    assert blockchain.is_chain_valid(full=True)
+    blockchain.retarget = PyBasicBlockchain.DifficultyRetarget(1.0, 2, PyBasicBlockchain.difficulty_target(1), start_height=len(blockchain.chain))
+    for _ in range(4):
+        blockchain.mine_pending_transactions('miner')
+    assert blockchain.is_chain_valid(full=True)
+    assert blockchain.chain[-1].target != blockchain.chain[1].target  # the schedule has moved since it was turned on
+
+def test_a_block_cannot_claim_an_easier_target():
+    blockchain = PyBasicBlockchain.Blockchain(retarget=PyBasicBlockchain.DifficultyRetarget(1.0, 2, PyBasicBlockchain.difficulty_target(1)))
+    for _ in range(2):
+        blockchain.mine_pending_transactions('miner')
+    tip = blockchain.chain[-1]
+    tip.target = PyBasicBlockchain.MAX_TARGET
+    assert not blockchain.is_chain_valid(full=True)
+    assert blockchain.validation_error == f'Block {tip.index}: hash mismatch'  # the target is part of the hashed header
+    tip.hash = tip.compute_hash()
+    assert not blockchain.is_chain_valid(full=True)
+    assert blockchain.validation_error == f'Block {tip.index}: target off schedule'
+
+def test_retargeting_settles_on_the_block_interval():
+    rng = random.Random(1)
+    retarget = PyBasicBlockchain.DifficultyRetarget(2.0, 10, PyBasicBlockchain.difficulty_target(4))
+    timestamps, targets, times = [0.0], [], []
+    for height in range(1, 4001):
+        target = retarget.target_at(height, timestamps.__getitem__, targets)
+        expected_hashes = (PyBasicBlockchain.MAX_TARGET + 1) / (target + 1)
+        times.append(rng.expovariate(1e5 / expected_hashes))  # a steady 100k hashes a second
+        timestamps.append(timestamps[-1] + times[-1])
+    settled = times[len(times) // 2:]
+    assert abs(sum(settled) / len(settled) - 2.0) <= 0.05 * 2.0
+
+def test_pruned_blocks_stay_pruned_when_a_lazy_chain_reloads_them():
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlockStore(os.path.join(directory, 'chain'), PyBasicBlockchain.Block)
+        blockchain = PyBasicBlockchain.Blockchain(store=store, archive=PayloadArchive(os.path.join(directory, 'archive')),
+                                                  keep_blocks=2, cache_blocks=2)
+        blockchain.difficulty = 1
+        for amount in range(1, 7):
+            blockchain.add_transaction({'sender': 'alice', 'recipient': 'bob', 'amount': amount})
+            blockchain.mine_pending_transactions('miner')
+        assert blockchain.pruned_height == len(blockchain.chain) - 2
+        blockchain.chain.clear_cache()  # every block now comes back from the store
+        old = blockchain.chain[1]
+        assert type(old.transactions) is PyBasicBlockchain.ArchivedPayload
+        assert dict(old.transactions[0]) == {'sender': 'alice', 'recipient': 'bob', 'amount': 1}
+        assert len(store[1].transactions) == 2  # pruning saves memory only: the store keeps every block whole
+        assert blockchain.is_chain_valid(full=True)
+        store.close()
+        blockchain.archive.close()
+
+def test_a_restart_from_a_checkpoint_only_loads_the_blocks_after_it():
+    with tempfile.TemporaryDirectory() as directory:
+        chain_path, checkpoints_path = os.path.join(directory, 'chain'), os.path.join(directory, 'checkpoints')
+        with BlockStore(chain_path, PyBasicBlockchain.Block) as store:
+            blockchain = PyBasicBlockchain.Blockchain(store=store, checkpoints=CheckpointStore(checkpoints_path))
+            blockchain.difficulty = 1
+            for amount in range(1, 8):
+                blockchain.add_transaction({'sender': 'alice', 'recipient': 'bob', 'amount': amount})
+                blockchain.mine_pending_transactions('miner')
+                if amount == 5:
+                    blockchain.save_checkpoint()
+        with BlockStore(chain_path, PyBasicBlockchain.Block) as store:
+            restarted = PyBasicBlockchain.Blockchain(store=store, checkpoints=CheckpointStore(checkpoints_path), trust_checkpoint=True)
+            assert restarted.ledger.balances == blockchain.ledger.balances
+            assert restarted.is_chain_valid()
+            assert restarted.chain.stats()['cached'] == 3  # the checkpoint's block and the two after it
+            assert len(restarted.chain) == 8 and len(list(restarted.get_blocks_between())) == 8  # the time index is built when first asked for
+
+def test_opening_a_lazy_chain_loads_no_blocks_until_asked():
+    with tempfile.TemporaryDirectory() as directory:
+        chain_path, archive_path = os.path.join(directory, 'chain'), os.path.join(directory, 'archive')
+        with BlockStore(chain_path, PyBasicBlockchain.Block) as store:
+            blockchain = PyBasicBlockchain.Blockchain(store=store, archive=PayloadArchive(archive_path), keep_blocks=2)
+            blockchain.difficulty = 1
+            for amount in range(1, 7):
+                blockchain.add_transaction({'sender': 'alice', 'recipient': 'bob', 'amount': amount})
+                blockchain.mine_pending_transactions('miner')
+            blockchain.archive.close()
+        with BlockStore(chain_path, PyBasicBlockchain.Block) as store:
+            reopened = PyBasicBlockchain.Blockchain(store=store, archive=PayloadArchive(archive_path), keep_blocks=2, cache_blocks=4)
+            assert len(reopened.chain) == 7 and reopened.pruned_height == 5
+            assert reopened.get_balance('bob') == 21  # the ledger replay is the only full pass
+            assert type(reopened.chain[1].transactions) is PyBasicBlockchain.ArchivedPayload
+            assert reopened.is_chain_valid(full=True)
+            reopened.archive.close()
+
+def test_a_block_store_recovers_from_a_torn_write():
+    blockchain = PyBasicBlockchain.Blockchain()
+    blockchain.difficulty = 1
+    for _ in range(4):
+        blockchain.mine_pending_transactions('miner')
+    with tempfile.TemporaryDirectory() as directory:
+        with BlockStore(directory, PyBasicBlockchain.Block) as store:
+            for block in blockchain.chain[:3]:
+                store.append(block)
+            payload = store._encode(blockchain.chain[3])
+        segment = os.path.join(directory, 'blocks-00000.dat')
+        with open(segment, 'ab') as file:
+            file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)  # written, but the crash beat the index
+            file.write(RECORD_HEADER.pack(100, 0) + b'torn')  # and the next one only got this far
+        with BlockStore(directory, PyBasicBlockchain.Block) as store:
+            assert len(store) == 4
+            assert [block.hash for block in store] == [block.hash for block in blockchain.chain[:4]]
+            assert os.path.getsize(segment) == sum(RECORD_HEADER.size + len(store.read_raw(height)) for height in range(4))
+            assert store.append(blockchain.chain[4]) == 4
+
+def test_truncating_a_block_store_drops_whole_segments():
+    blockchain = PyBasicBlockchain.Blockchain()
+    blockchain.difficulty = 1
+    for _ in range(4):
+        blockchain.mine_pending_transactions('miner')
+    with tempfile.TemporaryDirectory() as directory:
+        with BlockStore(directory, PyBasicBlockchain.Block, segment_size=1) as store:  # one block per segment
+            for block in blockchain.chain:
+                store.append(block)
+            store.truncate(2)
+            assert len(store) == 2 and sorted(os.listdir(directory)) == ['blocks-00000.dat', 'blocks-00001.dat', 'index.dat']
+            with pytest.raises(IndexError):
+                store.truncate(3)
+            store.append(blockchain.chain[4])
+        with BlockStore(directory, PyBasicBlockchain.Block, segment_size=1) as store:
+            assert [block.hash for block in store] == [block.hash for block in blockchain.chain[:2]] + [blockchain.chain[4].hash]
+
+def test_a_damaged_checkpoint_falls_back_to_an_older_one():
+    with tempfile.TemporaryDirectory() as directory:
+        chain_path, checkpoints_path = os.path.join(directory, 'chain'), os.path.join(directory, 'checkpoints')
+        checkpoints = CheckpointStore(checkpoints_path)
+        with BlockStore(chain_path, PyBasicBlockchain.Block) as store:
+            blockchain = PyBasicBlockchain.Blockchain(store=store, checkpoints=checkpoints)
+            blockchain.difficulty = 1
+            for amount in range(1, 8):
+                blockchain.add_transaction({'sender': 'alice', 'recipient': 'bob', 'amount': amount})
+                blockchain.mine_pending_transactions('miner')
+                if amount in (3, 5):
+                    blockchain.save_checkpoint()
+        newest = checkpoints._file_path(5)
+        with open(newest) as file:
+            tampered = file.read().replace('"bob":15', '"bob":1500')
+        assert '"bob":1500' in tampered
+        with open(newest, 'w') as file:
+            file.write(tampered)  # the checksum no longer matches
+        with BlockStore(chain_path, PyBasicBlockchain.Block) as store:
+            restarted = PyBasicBlockchain.Blockchain(store=store, checkpoints=checkpoints, trust_checkpoint=True)
+            assert restarted.checkpoint_height == 3 and restarted.chain.stats()['cached'] == 5
+            assert restarted.get_balance('bob') == 28
+        os.remove(checkpoints._file_path(3))
+        with BlockStore(chain_path, PyBasicBlockchain.Block) as store:
+            restarted = PyBasicBlockchain.Blockchain(store=store, checkpoints=checkpoints, trust_checkpoint=True)
+            assert restarted.checkpoint_height is None  # nothing usable left: replay the whole chain
+            assert restarted.ledger.balances == blockchain.ledger.balances
+            assert restarted.is_chain_valid()
@@ -0,0 +1,611 @@
+"""
+Benchmarks for PyBasicBlockchain2 Lib V1.
+
+    python Benchmark.py codec --blocks 200 --messages 100
+    python Benchmark.py memory --blocks 200 --messages 500
+    python Benchmark.py range --blocks 2000 --messages 100 --windows 90
+    python Benchmark.py mining --difficulty 4 --workers 1,2
+    python Benchmark.py hashing --sizes 1,10,100,1000,10000
+    python Benchmark.py validation --lengths 100,1000,5000
+    python Benchmark.py queries --blocks 2000 --messages 100
+    python Benchmark.py mempool --messages 50000 --capacity 20000
+    python Benchmark.py sync --lengths 500,2000 --peers 1,2,4
+    python Benchmark.py pruning --blocks 2000 --messages 100 --keep 100
+    python Benchmark.py lazy --blocks 2000 --messages 100 --cache 200
+    python Benchmark.py retarget --interval 2 --hash-rates 1e5,4e5,5e4 --mine 60
+
+Run everything and save the results, then compare two runs:
+
+    python Benchmark.py --output before.json all --scale 1.0
+    python Benchmark.py --output after.json all --scale 1.0
+    python Benchmark.py compare before.json after.json --threshold 0.10
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter, time
+from typing import Any, Callable, Dict, List, Optional
+
+import PyBasicBlockchain2
+from BlockCodec import encode_block, decode_block
+from BlockStore import BlockStore
+from ChainSync import ChainSync, SyncServer
+from PayloadArchive import PayloadArchive
+
+WORDS = ["hello", "there", "blockchain", "chat", "see", "you", "soon", "lol", "what", "is", "up", "mining", "block"]
+
+def make_users(count: int) -> List[str]:
+    """Synthetic user names."""
+    return [f"user_{i:05d}" for i in range(count)]
+
+def make_messages(count: int, users: List[str], rng: random.Random, start: float) -> List[Dict[str, Any]]:
+    """Random chat messages between the given users."""
+    return [{"sender": rng.choice(users), "recipient": rng.choice(users),
+             "content": " ".join(rng.choices(WORDS, k=rng.randint(2, 12))), "timestamp": start + i * 0.01}
+            for i in range(count)]
+
+def make_chain(blocks: int, messages_per_block: int, users: int = 1000, seed: int = 42) -> List[PyBasicBlockchain2.MessageBlock]:
+    """A linked (but unmined) chain of blocks full of synthetic messages, each claiming the easiest target."""
+    rng = random.Random(seed)
+    people = make_users(users)
+    easiest = PyBasicBlockchain2.MAX_TARGET
+    chain = [PyBasicBlockchain2.MessageBlock(0, 1_700_000_000.0, [], "0", target=easiest)]
+    for index in range(1, blocks):
+        timestamp = 1_700_000_000.0 + index * 10
+        chain.append(PyBasicBlockchain2.MessageBlock(index, timestamp, make_messages(messages_per_block, people, rng, timestamp - 10), chain[-1].hash,
+                                                     target=easiest))
+    return chain
+
+def best_of(repeat: int, func: Callable[[], Any]) -> float:
+    """Best wall-clock time of `repeat` runs of `func`, in seconds."""
+    times = []
+    for _ in range(repeat):
+        started = perf_counter()
+        func()
+        times.append(perf_counter() - started)
+    return min(times)
+
+def bench_codec(args) -> Dict[str, Any]:
+    """Size and speed of the binary codec against JSON, after checking every block round-trips."""
+    chain = make_chain(args.blocks, args.messages)
+    for block in chain:
+        decoded = decode_block(encode_block(block), PyBasicBlockchain2.MessageBlock)
+        assert decoded.to_dict() == block.to_dict(), f"Block {block.index} did not round-trip"
+        assert decoded.compute_hash() == block.hash, f"Block {block.index} hash changed after round-trip"
+
+    json_blobs = [json.dumps(block.to_dict()).encode() for block in chain]
+    binary_blobs = [encode_block(block) for block in chain]
+    json_bytes = sum(map(len, json_blobs))
+    binary_bytes = sum(map(len, binary_blobs))
+    return {
+        "blocks": args.blocks,
+        "messages_per_block": args.messages,
+        "json_bytes": json_bytes,
+        "binary_bytes": binary_bytes,
+        "size_ratio": binary_bytes / json_bytes,
+        "json_encode_s": best_of(args.repeat, lambda: [json.dumps(block.to_dict()).encode() for block in chain]),
+        "binary_encode_s": best_of(args.repeat, lambda: [encode_block(block) for block in chain]),
+        "json_decode_s": best_of(args.repeat, lambda: [PyBasicBlockchain2.MessageBlock.from_dict(json.loads(blob)) for blob in json_blobs]),
+        "binary_decode_s": best_of(args.repeat, lambda: [decode_block(blob, PyBasicBlockchain2.MessageBlock) for blob in binary_blobs]),
+    }
+
+def traced_bytes(build: Callable[[], Any]) -> int:
+    """Bytes still allocated once `build` returns, while its result is alive."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+def bench_memory(args) -> Dict[str, Any]:
+    """Resident size of loaded blocks with dict payloads vs packed columns."""
+    blobs = [json.dumps(block.to_dict()) for block in make_chain(args.blocks, args.messages)]
+    count = sum(len(json.loads(blob)["messages"]) for blob in blobs)
+
+    def load_plain():
+        return [PyBasicBlockchain2.MessageBlock.from_dict(json.loads(blob)) for blob in blobs]
+
+    def load_compact():
+        blocks = load_plain()
+        for block in blocks:
+            block.messages = PyBasicBlockchain2.MessageColumns.pack(block.messages)
+        return blocks
+
+    plain_bytes = traced_bytes(load_plain)
+    compact_bytes = traced_bytes(load_compact)
+    return {
+        "blocks": args.blocks,
+        "messages": count,
+        "dict_bytes_per_message": plain_bytes / count,
+        "compact_bytes_per_message": compact_bytes / count,
+        "saving": 1 - compact_bytes / plain_bytes,
+    }
+
+def bench_range(args) -> Dict[str, Any]:
+    """One-window time-range query through the timestamp index vs a full chain scan."""
+    blockchain = PyBasicBlockchain2.MessagingBlockchain()
+    blockchain.chain = make_chain(args.blocks, args.messages)
+    blockchain.rebuild_message_index()
+    blockchain.rebuild_time_index()
+    first, last = blockchain.chain[1].timestamp - 10, blockchain.chain[-1].timestamp
+    width = (last - first) / args.windows
+    start = first + width * (args.windows // 2)
+    end = start + width
+
+    def scan():
+        return [message for block in blockchain.chain for message in block.messages if start <= message["timestamp"] < end]
+
+    def indexed():
+        return list(blockchain.get_messages_between(start, end))
+
+    expected = scan()
+    assert indexed() == expected, "Index and scan disagree"
+    scan_s = best_of(args.repeat, scan)
+    index_s = best_of(args.repeat, indexed)
+    return {
+        "blocks": args.blocks,
+        "messages": len(blockchain.message_times),
+        "window_messages": len(expected),
+        "scan_s": scan_s,
+        "index_s": index_s,
+        "speedup": scan_s / index_s if index_s else None,
+        "blocks_in_window_s": best_of(args.repeat, lambda: list(blockchain.get_blocks_between(start, end))),
+    }
+
+def int_list(text: str) -> List[int]:
+    return [int(part) for part in text.split(",") if part]
+
+def load_chain(blocks: int, messages_per_block: int) -> PyBasicBlockchain2.MessagingBlockchain:
+    """A MessagingBlockchain holding a synthetic chain, with its message and time indexes rebuilt."""
+    blockchain = PyBasicBlockchain2.MessagingBlockchain()
+    blockchain.chain = make_chain(blocks, messages_per_block)
+    blockchain.rebuild_message_index()
+    blockchain.rebuild_time_index()
+    return blockchain
+
+def bench_mining(args) -> Dict[str, Any]:
+    """Hashes per second of mine_block for each worker count, on the same blocks."""
+    results = {}
+    for workers in args.workers:
+        rng = random.Random(7)
+        people = make_users(100)
+        attempts, seconds = 0, 0.0
+        for index in range(args.blocks):
+            block = PyBasicBlockchain2.MessageBlock(index + 1, 1_700_000_000.0 + index, make_messages(args.messages, people, rng, 1_700_000_000.0), "0" * 64)
+            started = perf_counter()
+            attempts += block.mine_block(args.difficulty, workers)
+            seconds += perf_counter() - started
+        results[f"workers_{workers}"] = {"attempts": attempts, "seconds": seconds, "hash_rate": attempts / seconds}
+    return {"difficulty": args.difficulty, "blocks": args.blocks, "messages_per_block": args.messages, "results": results}
+
+def bench_hashing(args) -> Dict[str, Any]:
+    """compute_hash cost against block size for header and legacy hashing, plus the Merkle root."""
+    rng = random.Random(7)
+    people = make_users(1000)
+    results = {}
+    for size in args.sizes:
+        messages = make_messages(size, people, rng, 1_700_000_000.0)
+        header = PyBasicBlockchain2.MessageBlock(1, 1_700_000_000.0, messages, "0" * 64)
+        legacy = PyBasicBlockchain2.MessageBlock(1, 1_700_000_000.0, messages, "0" * 64, version=PyBasicBlockchain2.HASH_VERSION_LEGACY)
+        legacy_loops = max(1, args.loops // max(1, size))
+        results[f"messages_{size}"] = {
+            "header_hash_us": best_of(args.repeat, lambda: [header.compute_hash() for _ in range(args.loops)]) / args.loops * 1e6,
+            "legacy_hash_us": best_of(args.repeat, lambda: [legacy.compute_hash() for _ in range(legacy_loops)]) / legacy_loops * 1e6,
+            "merkle_root_ms": best_of(args.repeat, lambda: PyBasicBlockchain2.compute_merkle_root(messages)) * 1e3,
+        }
+    return {"loops": args.loops, "results": results}
+
+def bench_validation(args) -> Dict[str, Any]:
+    """is_chain_valid time against chain length: a full audit, and re-checking after one new block."""
+    results = {}
+    for length in args.lengths:
+        blockchain = load_chain(length, args.messages)
+        assert blockchain.is_chain_valid(full=True), blockchain.validation_error
+        full_s = best_of(args.repeat, lambda: blockchain.is_chain_valid(full=True))
+        parallel_s = best_of(args.repeat, lambda: blockchain.is_chain_valid(full=True, workers=args.workers)) if args.workers > 1 else None
+        incremental = []
+        for _ in range(args.repeat):
+            tip = blockchain.get_last_block()
+            blockchain.append_block(PyBasicBlockchain2.MessageBlock(tip.index + 1, tip.timestamp + 10, [], tip.hash, target=tip.target))
+            started = perf_counter()
+            assert blockchain.is_chain_valid(), blockchain.validation_error
+            incremental.append(perf_counter() - started)
+        results[f"blocks_{length}"] = {"full_s": full_s, "full_parallel_s": parallel_s, "incremental_s": min(incremental)}
+    return {"messages_per_block": args.messages, "workers": args.workers, "results": results}
+
+def bench_queries(args) -> Dict[str, Any]:
+    """Latency of per-user history lookups (index vs full scan) and a time-range query."""
+    blockchain = load_chain(args.blocks, args.messages)
+    rng = random.Random(7)
+    lookups = [rng.choice(make_users(1000)) for _ in range(args.lookups)]
+    user = lookups[0]
+
+    def scan_history():
+        received = [message for block in blockchain.chain for message in block.messages if message["recipient"] == user]
+        sent = [message for block in blockchain.chain for message in block.messages if message["sender"] == user]
+        return {"received": received[::-1][:args.limit], "sent": sent[::-1][:args.limit]}
+
+    assert scan_history() == blockchain.get_user_history(user, args.limit, newest_first=True), "Index and scan disagree"
+    start = blockchain.chain[len(blockchain.chain) // 2].timestamp
+    end = start + args.window * 10
+
+    return {
+        "blocks": args.blocks,
+        "messages_per_block": args.messages,
+        "get_user_history_us": best_of(args.repeat, lambda: [blockchain.get_user_history(address, args.limit, newest_first=True) for address in lookups]) / len(lookups) * 1e6,
+        "scan_history_ms": best_of(args.repeat, scan_history) * 1e3,
+        "messages_between_ms": best_of(args.repeat, lambda: list(blockchain.get_messages_between(start, end))) * 1e3,
+    }
+
+def bench_mempool(args) -> Dict[str, Any]:
+    """Adding a flood of messages to a capped mempool, and taking the best block's worth out of it."""
+    rng = random.Random(7)
+    messages = make_messages(args.messages, make_users(1000), rng, 1_700_000_000.0)
+    for message in messages:
+        message["priority"] = rng.randint(0, 100)
+
+    def fill() -> PyBasicBlockchain2.Mempool:
+        mempool = PyBasicBlockchain2.Mempool(max_count=args.capacity)
+        for message in messages:
+            mempool.add(message)
+        return mempool
+
+    add_s = best_of(args.repeat, fill)
+    take_s = []
+    for _ in range(args.repeat):
+        mempool = fill()
+        started = perf_counter()
+        block = mempool.take(args.block_size)
+        take_s.append(perf_counter() - started)
+        ranks = [mempool.priority(message, len(PyBasicBlockchain2.entry_bytes(message))) for message in block]
+        assert ranks == sorted(ranks, reverse=True)
+    stats = fill().stats()
+    return {
+        "messages": len(messages),
+        "capacity": args.capacity,
+        "block_size": args.block_size,
+        "add_us": add_s / len(messages) * 1e6,
+        "take_block_ms": min(take_s) * 1e3,
+        "evicted": stats["evicted"],
+        "rejected": stats["rejected"],
+    }
+
+def serve_chain(blocks: int, messages_per_block: int, ready, stop):
+    """Child process: serve a synthetic chain (the same in every child) until `stop` is set."""
+    with SyncServer(load_chain(blocks, messages_per_block)) as server:
+        ready.put(server.address)
+        stop.wait()
+
+def bench_sync(args) -> Dict[str, Any]:
+    """Catch-up time of a fresh node against chain length and peer count, each peer its own process."""
+    results = {}
+    for length in args.lengths:
+        for peers in args.peers:
+            ready, stop = multiprocessing.Queue(), multiprocessing.Event()
+            servers = [multiprocessing.Process(target=serve_chain, args=(length, args.messages, ready, stop), daemon=True) for _ in range(peers)]
+            for server in servers:
+                server.start()
+            try:
+                addresses = [tuple(ready.get(timeout=300)) for _ in servers]
+                node = load_chain(1, args.messages)  # just the genesis block the peers share
+                sync = ChainSync(node, addresses, workers=args.workers, verify_workers=args.verify_workers)
+                started = perf_counter()
+                assert sync.sync(), sync.errors
+                seconds = perf_counter() - started
+                assert len(node.chain) == length and node.is_chain_valid(), node.validation_error
+            finally:
+                stop.set()
+                for server in servers:
+                    server.join(10)
+            results[f"blocks_{length}_peers_{peers}"] = {
+                "catch_up_s": seconds,
+                "headers_s": sync.stats["headers_seconds"],
+                "bodies_s": sync.stats["bodies_seconds"],
+                "blocks_per_second": length / seconds,
+            }
+    return {"messages_per_block": args.messages, "workers": args.workers, "verify_workers": args.verify_workers, "results": results}
+
+def bench_pruning(args) -> Dict[str, Any]:
+    """Memory of an opened chain with every payload vs pruned to the newest --keep blocks, and what pruning costs."""
+    keep = min(args.keep, args.blocks // 2)  # so a scaled-down run still prunes something
+    with tempfile.TemporaryDirectory() as directory:
+        blocks_path, archive_path = os.path.join(directory, "blocks"), os.path.join(directory, "archive")
+        with BlockStore(blocks_path, PyBasicBlockchain2.MessageBlock) as store:
+            for block in make_chain(args.blocks, args.messages):
+                store.append(block)
+
+        def open_chain(pruned: bool) -> PyBasicBlockchain2.MessagingBlockchain:
+            store = BlockStore(blocks_path, PyBasicBlockchain2.MessageBlock)
+            if not pruned:
+                return PyBasicBlockchain2.MessagingBlockchain(store=store)
+            return PyBasicBlockchain2.MessagingBlockchain(store=store, archive=PayloadArchive(archive_path), keep_blocks=keep)
+
+        full, pruned = open_chain(False), open_chain(True)  # the first pruned open fills the archive
+        archived = pruned.archive.stats()
+        assert pruned.is_chain_valid(full=True), pruned.validation_error
+        assert all(pruned.get_user_messages(user) == full.get_user_messages(user) for user in list(full.message_index.received)[:5])
+        rng = random.Random(7)
+        old = [rng.randrange(pruned.pruned_height) for _ in range(args.lookups)]
+        return {
+            "blocks": args.blocks,
+            "messages_per_block": args.messages,
+            "keep_blocks": keep,
+            "full_bytes": traced_bytes(lambda: open_chain(False)),
+            "pruned_bytes": traced_bytes(lambda: open_chain(True)),
+            "archive_bytes": archived["compressed_bytes"],
+            "compression_ratio": archived["compression_ratio"],
+            "validate_full_s": best_of(args.repeat, lambda: full.is_chain_valid(full=True)),
+            "validate_pruned_s": best_of(args.repeat, lambda: pruned.is_chain_valid(full=True)),
+            "thaw_block_us": best_of(args.repeat, lambda: [pruned.chain[height].messages[0] for height in old]) / len(old) * 1e6,
+        }
+
+def bench_lazy(args) -> Dict[str, Any]:
+    """Memory of an opened chain held in full vs a lazy view with --cache blocks, and scan and lookup cost through the view."""
+    cache = min(args.cache, args.blocks // 2)  # so a scaled-down run still evicts something
+    with tempfile.TemporaryDirectory() as directory:
+        with BlockStore(directory, PyBasicBlockchain2.MessageBlock) as store:
+            for block in make_chain(args.blocks, args.messages):
+                store.append(block)
+
+        def open_chain(cache_blocks: Optional[int]) -> PyBasicBlockchain2.MessagingBlockchain:
+            return PyBasicBlockchain2.MessagingBlockchain(store=BlockStore(directory, PyBasicBlockchain2.MessageBlock), cache_blocks=cache_blocks)
+
+        full, lazy = open_chain(None), open_chain(cache)
+        assert lazy.is_chain_valid(full=True), lazy.validation_error
+
+        def validate(prefetch: int) -> bool:
+            lazy.chain.prefetch = prefetch
+            return lazy.is_chain_valid(full=True)
+
+        rng = random.Random(7)
+        recent = [rng.randrange(args.blocks - cache, args.blocks) for _ in range(args.lookups)]
+        anywhere = [rng.randrange(args.blocks) for _ in range(args.lookups)]
+        return {
+            "blocks": args.blocks,
+            "messages_per_block": args.messages,
+            "cache_blocks": cache,
+            "full_bytes": traced_bytes(lambda: open_chain(None)),
+            "lazy_bytes": traced_bytes(lambda: open_chain(cache)),
+            "validate_full_s": best_of(args.repeat, lambda: full.is_chain_valid(full=True)),
+            "validate_lazy_s": best_of(args.repeat, lambda: validate(0)),
+            "validate_lazy_prefetch_s": best_of(args.repeat, lambda: validate(PyBasicBlockchain2.CHAIN_PREFETCH)),
+            "recent_lookup_us": best_of(args.repeat, lambda: [lazy.chain[height] for height in recent]) / len(recent) * 1e6,
+            "random_lookup_us": best_of(args.repeat, lambda: [lazy.chain[height] for height in anywhere]) / len(anywhere) * 1e6,
+            "cache": lazy.chain.stats(),
+        }
+
+def float_list(text: str) -> List[float]:
+    return [float(part) for part in text.split(",") if part]
+
+def window_means(times: List[float], window: int) -> List[float]:
+    return [sum(times[start:start + window]) / len(times[start:start + window]) for start in range(0, len(times), window)]
+
+def bench_retarget(args) -> Dict[str, Any]:
+    """Block times while the hash rate steps through --hash-rates: how fast retargeting pulls them back to --interval."""
+    rng = random.Random(args.seed)
+    retarget = PyBasicBlockchain2.DifficultyRetarget(args.interval, args.window, PyBasicBlockchain2.difficulty_target(args.difficulty))
+    timestamps, targets, times = [0.0], [], []
+    phase_blocks = max(args.window, args.blocks // len(args.hash_rates))
+    for height in range(1, phase_blocks * len(args.hash_rates) + 1):
+        rate = args.hash_rates[(height - 1) // phase_blocks]
+        target = retarget.target_at(height, timestamps.__getitem__, targets)
+        expected_hashes = (PyBasicBlockchain2.MAX_TARGET + 1) / (target + 1)
+        times.append(rng.expovariate(rate / expected_hashes))  # a block takes an exponential number of seconds to find
+        timestamps.append(timestamps[-1] + times[-1])
+    phases = []
+    for number, rate in enumerate(args.hash_rates):
+        means = window_means(times[number * phase_blocks:(number + 1) * phase_blocks], args.window)
+        settled = [i for i, mean in enumerate(means) if abs(mean - args.interval) <= args.tolerance * args.interval]
+        phases.append({
+            "hash_rate": rate,
+            "first_window_mean": means[0],
+            "settled_mean": sum(means[len(means) // 2:]) / len(means[len(means) // 2:]),
+            "windows_to_converge": settled[0] if settled else None,
+        })
+    result = {"interval": args.interval, "window": args.window, "blocks": len(times), "phases": phases}
+    if args.mine:
+        # The real thing on this machine: mine --mine empty blocks and watch the block time settle
+        blockchain = PyBasicBlockchain2.MessagingBlockchain(retarget=PyBasicBlockchain2.DifficultyRetarget(args.interval, args.window, PyBasicBlockchain2.difficulty_target(args.difficulty)))
+        mined = []
+        for _ in range(args.mine):
+            blockchain.mine_pending_messages("miner")
+            mined.append(blockchain.last_mining_stats["seconds"])
+        assert blockchain.is_chain_valid(full=True), blockchain.validation_error
+        result["mined_window_means"] = window_means(mined, args.window)
+        result["mined_difficulty_bits"] = blockchain.last_mining_stats["difficulty_bits"]
+    return result
+
+SCALED_COUNTS = ("blocks", "messages", "lookups")
+SCALED_LISTS = ("lengths", "sizes")
+
+def bench_all(args) -> Dict[str, Any]:
+    """Every benchmark with its default settings, sizes multiplied by --scale."""
+    results = {}
+    for name, command in args.benchmarks.items():
+        options = command.parse_args([])
+        for field in SCALED_COUNTS:
+            if hasattr(options, field):
+                setattr(options, field, max(1, int(getattr(options, field) * args.scale)))
+        for field in SCALED_LISTS:
+            if hasattr(options, field):
+                setattr(options, field, [max(1, int(value * args.scale)) for value in getattr(options, field)])
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = options.run(options)
+    return results
+
+def run_info() -> Dict[str, Any]:
+    """Where and when a run happened, so saved reports can be told apart."""
+    return {
+        "time": time(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "argv": sys.argv[1:],
+    }
+
+def flatten(data: Any, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of a nested report, keyed by dotted path."""
+    if isinstance(data, dict):
+        flat = {}
+        for key, value in data.items():
+            flat.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+        return flat
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        return {prefix: float(data)}
+    return {}
+
+def better_direction(key: str) -> Optional[int]:
+    """-1 if smaller is better, +1 if bigger is better, None for sizes and counts."""
+    name = key.rsplit(".", 1)[-1]
+    if name.endswith(("_s", "_ms", "_us", "seconds", "size_ratio")) or "bytes" in name:
+        return -1
+    if name.endswith(("per_second", "hash_rate", "speedup", "saving", "delivery_ratio")):
+        return 1
+    return None
+
+def bench_compare(args) -> Dict[str, Any]:
+    """Flag every metric that moved the wrong way by more than --threshold."""
+    with open(args.baseline) as file:
+        baseline = flatten(json.load(file).get("results", {}))
+    with open(args.current) as file:
+        current = flatten(json.load(file).get("results", {}))
+    regressions, improvements = [], []
+    for key in sorted(baseline.keys() & current.keys()):
+        direction = better_direction(key)
+        if direction is None or not baseline[key]:
+            continue
+        change = (current[key] - baseline[key]) / baseline[key]
+        entry = {"metric": key, "baseline": baseline[key], "current": current[key], "change": change}
+        if change * direction < -args.threshold:
+            regressions.append(entry)
+        elif change * direction > args.threshold:
+            improvements.append(entry)
+    return {"threshold": args.threshold, "compared": len(baseline.keys() & current.keys()), "regressions": regressions, "improvements": improvements}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for PyBasicBlockchain2.")
+    parser.add_argument("--output", help="also save the results (with run info) to this JSON file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    codec = commands.add_parser("codec", help="binary vs JSON block encoding")
+    codec.add_argument("--blocks", type=int, default=200)
+    codec.add_argument("--messages", type=int, default=100)
+    codec.add_argument("--repeat", type=int, default=3)
+    codec.set_defaults(run=bench_codec)
+
+    memory = commands.add_parser("memory", help="bytes per message with dict vs columnar payloads")
+    memory.add_argument("--blocks", type=int, default=200)
+    memory.add_argument("--messages", type=int, default=500)
+    memory.set_defaults(run=bench_memory)
+
+    window = commands.add_parser("range", help="time-range query via the timestamp index vs a full scan")
+    window.add_argument("--blocks", type=int, default=2000)
+    window.add_argument("--messages", type=int, default=100)
+    window.add_argument("--windows", type=int, default=90, help="the chain's time span is cut into this many windows; one is queried")
+    window.add_argument("--repeat", type=int, default=3)
+    window.set_defaults(run=bench_range)
+
+    mining = commands.add_parser("mining", help="hashes per second while mining")
+    mining.add_argument("--difficulty", type=int, default=4)
+    mining.add_argument("--blocks", type=int, default=5)
+    mining.add_argument("--messages", type=int, default=100)
+    mining.add_argument("--workers", type=int_list, default=[1, 2], help="comma-separated worker counts")
+    mining.set_defaults(run=bench_mining)
+
+    hashing = commands.add_parser("hashing", help="compute_hash cost against block size")
+    hashing.add_argument("--sizes", type=int_list, default=[1, 10, 100, 1000, 10000], help="comma-separated messages per block")
+    hashing.add_argument("--loops", type=int, default=1000)
+    hashing.add_argument("--repeat", type=int, default=3)
+    hashing.set_defaults(run=bench_hashing)
+
+    validation = commands.add_parser("validation", help="is_chain_valid time against chain length")
+    validation.add_argument("--lengths", type=int_list, default=[100, 1000, 5000], help="comma-separated chain lengths")
+    validation.add_argument("--messages", type=int, default=20)
+    validation.add_argument("--workers", type=int, default=1, help="also time a parallel full audit with this many workers")
+    validation.add_argument("--repeat", type=int, default=3)
+    validation.set_defaults(run=bench_validation)
+
+    queries = commands.add_parser("queries", help="user history and time-range query latency")
+    queries.add_argument("--blocks", type=int, default=2000)
+    queries.add_argument("--messages", type=int, default=100)
+    queries.add_argument("--lookups", type=int, default=1000)
+    queries.add_argument("--limit", type=int, default=20, help="history page size")
+    queries.add_argument("--window", type=int, default=100, help="blocks covered by the time-range query")
+    queries.add_argument("--repeat", type=int, default=3)
+    queries.set_defaults(run=bench_queries)
+
+    mempool = commands.add_parser("mempool", help="mempool add and block assembly cost with a capped pool")
+    mempool.add_argument("--messages", type=int, default=50000, help="messages submitted")
+    mempool.add_argument("--capacity", type=int, default=20000, help="mempool max_count")
+    mempool.add_argument("--block-size", type=int, default=2000, help="messages taken for one block")
+    mempool.add_argument("--repeat", type=int, default=3)
+    mempool.set_defaults(run=bench_mempool)
+
+    sync = commands.add_parser("sync", help="catch-up time from peer processes against chain length and peer count")
+    sync.add_argument("--lengths", type=int_list, default=[500, 2000], help="comma-separated chain lengths")
+    sync.add_argument("--peers", type=int_list, default=[1, 2, 4], help="comma-separated peer counts")
+    sync.add_argument("--messages", type=int, default=20)
+    sync.add_argument("--workers", type=int, default=4, help="download threads")
+    sync.add_argument("--verify-workers", type=int, default=1, help="processes verifying block bodies (1 = in the download threads)")
+    sync.set_defaults(run=bench_sync)
+
+    pruning = commands.add_parser("pruning", help="memory and read cost of a chain pruned to its newest blocks")
+    pruning.add_argument("--blocks", type=int, default=2000)
+    pruning.add_argument("--messages", type=int, default=100)
+    pruning.add_argument("--keep", type=int, default=100, help="blocks that keep their full payload")
+    pruning.add_argument("--lookups", type=int, default=1000, help="reads of random pruned blocks")
+    pruning.add_argument("--repeat", type=int, default=3)
+    pruning.set_defaults(run=bench_pruning)
+
+    lazy = commands.add_parser("lazy", help="memory and access cost of a lazy chain view with an LRU block cache")
+    lazy.add_argument("--blocks", type=int, default=2000)
+    lazy.add_argument("--messages", type=int, default=100)
+    lazy.add_argument("--cache", type=int, default=200, help="blocks the view keeps in memory")
+    lazy.add_argument("--lookups", type=int, default=1000, help="random block lookups")
+    lazy.add_argument("--repeat", type=int, default=3)
+    lazy.set_defaults(run=bench_lazy)
+
+    retarget = commands.add_parser("retarget", help="simulated (and optionally real) block times under difficulty retargeting")
+    retarget.add_argument("--interval", type=float, default=2.0, help="target seconds per block")
+    retarget.add_argument("--window", type=int, default=10, help="blocks per retarget period")
+    retarget.add_argument("--blocks", type=int, default=1200, help="simulated blocks, split evenly over the hash rates")
+    retarget.add_argument("--hash-rates", type=float_list, default=[1e5, 4e5, 5e4, 1e6], help="comma-separated hashes per second, one per phase")
+    retarget.add_argument("--difficulty", type=int, default=4, help="hex zeros of the starting target")
+    retarget.add_argument("--tolerance", type=float, default=0.25, help="a window within this fraction of --interval counts as converged")
+    retarget.add_argument("--mine", type=int, default=0, help="also mine this many real blocks")
+    retarget.add_argument("--seed", type=int, default=1)
+    retarget.set_defaults(run=bench_retarget)
+
+    benchmarks = {"codec": codec, "memory": memory, "range": window, "mining": mining, "hashing": hashing, "validation": validation, "queries": queries, "mempool": mempool, "sync": sync, "pruning": pruning, "lazy": lazy, "retarget": retarget}
+    everything = commands.add_parser("all", help="run every benchmark")
+    everything.add_argument("--scale", type=float, default=1.0, help="multiply block and message counts by this")
+    everything.set_defaults(run=bench_all, benchmarks=benchmarks)
+
+    compare = commands.add_parser("compare", help="compare two saved runs and list regressions")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.10, help="relative change that counts (0.10 = 10%%)")
+    compare.set_defaults(run=bench_compare)
+
+    args = parser.parse_args()
+    results = args.run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"benchmark": "PyBasicBlockchain2", "command": args.command, "run": run_info(), "results": results}, file, indent=2)
+    if args.command == "compare" and results["regressions"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
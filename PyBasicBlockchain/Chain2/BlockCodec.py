@@ -0,0 +1,212 @@
+"""
+Compact binary block format.
+
+Layout (version 2):
+    magic b'PBB' | format version | index | timestamp | previous_hash | nonce |
+    hash version | target | merkle_root | hash | string table | payload
+
+Version 1 records have no target field and are still read.
+
+Integers are LEB128 varints (zigzag for signed values), 64-character hex hashes
+are stored as their raw 32 bytes, and keys plus any string value that repeats
+inside a block (addresses, usually) are written once to a per-block string
+table and referenced by number afterwards.
+"""
+
+import json
+from collections import Counter
+from struct import Struct
+from typing import Any, Dict, List, Tuple
+
+MAGIC = b'PBB'
+FORMAT_VERSION = 2
+
+_F64 = Struct('>d')
+_HEX_DIGITS = frozenset('0123456789abcdef')
+
+# Value tags
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR_REF, _STR, _JSON = range(8)
+# Hash tags
+_HASH_TEXT, _HASH_RAW = 0, 32
+
+class CodecError(ValueError):
+    pass
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        try:
+            byte = data[pos]
+        except IndexError:
+            raise CodecError("Truncated varint") from None
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def _write_bytes(out: bytearray, value: bytes):
+    _write_varint(out, len(value))
+    out += value
+
+def _read_bytes(data: bytes, pos: int) -> Tuple[bytes, int]:
+    length, pos = _read_varint(data, pos)
+    if pos + length > len(data):
+        raise CodecError("Truncated field")
+    return bytes(data[pos:pos + length]), pos + length
+
+def _write_hash(out: bytearray, value: str):
+    if len(value) == 64 and _HEX_DIGITS.issuperset(value):
+        out.append(_HASH_RAW)
+        out += bytes.fromhex(value)
+    else:
+        out.append(_HASH_TEXT)
+        _write_bytes(out, value.encode('utf-8'))
+
+def _read_hash(data: bytes, pos: int) -> Tuple[str, int]:
+    tag = data[pos]
+    if tag == _HASH_RAW:
+        return bytes(data[pos + 1:pos + 33]).hex(), pos + 33
+    raw, pos = _read_bytes(data, pos + 1)
+    return raw.decode('utf-8'), pos
+
+def _write_value(out: bytearray, value: Any, strings: Dict[str, int]):
+    if value is None:
+        out.append(_NONE)
+    elif value is True or value is False:
+        out.append(_TRUE if value else _FALSE)
+    elif type(value) is int:
+        out.append(_INT)
+        _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+    elif type(value) is float:
+        out.append(_FLOAT)
+        out += _F64.pack(value)
+    elif type(value) is str:
+        ref = strings.get(value)
+        if ref is None:
+            out.append(_STR)
+            _write_bytes(out, value.encode('utf-8'))
+        else:
+            out.append(_STR_REF)
+            _write_varint(out, ref)
+    else:
+        out.append(_JSON)
+        _write_bytes(out, json.dumps(value, sort_keys=True).encode('utf-8'))
+
+def _read_value(data: bytes, pos: int, strings: List[str]) -> Tuple[Any, int]:
+    tag = data[pos]
+    pos += 1
+    if tag == _STR_REF:
+        ref, pos = _read_varint(data, pos)
+        return strings[ref], pos
+    if tag == _INT:
+        raw, pos = _read_varint(data, pos)
+        return (raw >> 1) if not raw & 1 else -((raw + 1) >> 1), pos
+    if tag == _FLOAT:
+        return _F64.unpack_from(data, pos)[0], pos + _F64.size
+    if tag == _STR:
+        raw, pos = _read_bytes(data, pos)
+        return raw.decode('utf-8'), pos
+    if tag == _NONE:
+        return None, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _JSON:
+        raw, pos = _read_bytes(data, pos)
+        return json.loads(raw), pos
+    raise CodecError(f"Unknown value tag {tag}")
+
+def _string_table(entries: List[Dict[str, Any]]) -> List[str]:
+    counts = Counter()
+    for entry in entries:
+        counts.update(entry.keys())
+        counts.update(value for value in entry.values() if type(value) is str)
+    keys = {key for entry in entries for key in entry}
+    return [text for text, count in counts.items() if count > 1 or text in keys]
+
+def encode_block(block: Any) -> bytes:
+    """Encode a Block / MessageBlock into the compact binary format."""
+    data = block.to_dict()
+    entries = data[block.PAYLOAD_FIELD]
+    out = bytearray(MAGIC)
+    out.append(FORMAT_VERSION)
+    _write_varint(out, data['index'])
+    _write_value(out, data['timestamp'], {})
+    _write_hash(out, data['previous_hash'])
+    _write_varint(out, data['nonce'])
+    _write_varint(out, data['version'])
+    _write_value(out, data.get('target'), {})
+    _write_hash(out, data['merkle_root'])
+    _write_hash(out, data['hash'])
+
+    table = _string_table(entries)
+    strings = {text: ref for ref, text in enumerate(table)}
+    _write_varint(out, len(table))
+    for text in table:
+        _write_bytes(out, text.encode('utf-8'))
+
+    _write_varint(out, len(entries))
+    for entry in entries:
+        _write_varint(out, len(entry))
+        for key, value in entry.items():
+            _write_varint(out, strings[key])
+            _write_value(out, value, strings)
+    return bytes(out)
+
+def decode_dict(data: bytes, payload_field: str) -> Dict[str, Any]:
+    """Decode the binary format back into the dict produced by `to_dict`."""
+    if data[:3] != MAGIC:
+        raise CodecError("Not a binary block")
+    if data[3] not in (1, FORMAT_VERSION):
+        raise CodecError(f"Unsupported format version {data[3]}")
+    block = {}
+    block['index'], pos = _read_varint(data, 4)
+    block['timestamp'], pos = _read_value(data, pos, [])
+    block['previous_hash'], pos = _read_hash(data, pos)
+    block['nonce'], pos = _read_varint(data, pos)
+    block['version'], pos = _read_varint(data, pos)
+    if data[3] >= 2:
+        block['target'], pos = _read_value(data, pos, [])
+    block['merkle_root'], pos = _read_hash(data, pos)
+    block['hash'], pos = _read_hash(data, pos)
+
+    count, pos = _read_varint(data, pos)
+    table = []
+    for _ in range(count):
+        raw, pos = _read_bytes(data, pos)
+        table.append(raw.decode('utf-8'))
+
+    count, pos = _read_varint(data, pos)
+    entries = []
+    for _ in range(count):
+        fields, pos = _read_varint(data, pos)
+        entry = {}
+        for _ in range(fields):
+            key, pos = _read_varint(data, pos)
+            entry[table[key]], pos = _read_value(data, pos, table)
+        entries.append(entry)
+    block[payload_field] = entries
+    return block
+
+def decode_block(data: bytes, block_cls: Any) -> Any:
+    return block_cls.from_dict(decode_dict(data, block_cls.PAYLOAD_FIELD))
+
+class BinaryCodec:
+    """Binary encode/decode pair for one block class, e.g. for BlockStore."""
+
+    def __init__(self, block_cls: Any):
+        self.block_cls = block_cls
+
+    def encode(self, block: Any) -> bytes:
+        return encode_block(block)
+
+    def decode(self, data: bytes) -> Any:
+        return decode_block(data, self.block_cls)
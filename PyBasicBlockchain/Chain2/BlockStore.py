@@ -0,0 +1,211 @@
+"""
+Append-only on-disk block store.
+
+Blocks are appended to numbered segment files as records of
+[length:u32][crc32:u32][payload]. A fixed-width index file maps each height to
+(segment, offset, length), so any block is one index read plus one record read
+away and opening a store never parses the blocks themselves.
+"""
+
+import json
+import os
+import threading
+import zlib
+from struct import Struct
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+RECORD_HEADER = Struct('>II')  # payload length, crc32 of the payload
+INDEX_ENTRY = Struct('>IQI')  # segment number, record offset, payload length
+INDEX_FILE = 'index.dat'
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+class BlockStore:
+    def __init__(self, path: str, block_cls: Any, segment_size: int = DEFAULT_SEGMENT_SIZE,
+                 encode: Optional[Callable[[Any], bytes]] = None, decode: Optional[Callable[[bytes], Any]] = None,
+                 sync: bool = False):
+        """Open (or create) the store in `path`, recovering from a torn write if needed."""
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.block_cls = block_cls
+        self.segment_size = segment_size
+        self.sync = sync
+        self._encode = encode or self._encode_json
+        self._decode = decode or self._decode_json
+        self._lock = threading.Lock()
+        self._readers: Dict[int, Any] = {}
+        self._index = open(os.path.join(path, INDEX_FILE), 'a+b')
+        self._length = 0
+        self._segment = 0
+        self._writer = None
+        self._recover()
+
+    def _encode_json(self, block: Any) -> bytes:
+        return json.dumps(block.to_dict(), separators=(',', ':')).encode('utf-8')
+
+    def _decode_json(self, data: bytes) -> Any:
+        return self.block_cls.from_dict(json.loads(data))
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f'blocks-{segment:05d}.dat')
+
+    def _segment_numbers(self):
+        names = (name for name in os.listdir(self.path) if name.startswith('blocks-') and name.endswith('.dat'))
+        return sorted(int(name[7:-4]) for name in names)
+
+    def _read_entry(self, height: int) -> Tuple[int, int, int]:
+        self._index.seek(height * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(self._index.read(INDEX_ENTRY.size))
+
+    def _read_record(self, segment: int, offset: int, length: int) -> Optional[bytes]:
+        """Return the payload at `offset`, or None if the record is torn or corrupt."""
+        reader = self._readers.get(segment)
+        if reader is None:
+            if not os.path.exists(self._segment_path(segment)):
+                return None
+            reader = self._readers[segment] = open(self._segment_path(segment), 'rb')
+        reader.seek(offset)
+        header = reader.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return None
+        record_length, checksum = RECORD_HEADER.unpack(header)
+        if length is not None and record_length != length:
+            return None
+        payload = reader.read(record_length)
+        if len(payload) < record_length or zlib.crc32(payload) != checksum:
+            return None
+        return payload
+
+    def _recover(self):
+        """Drop torn index entries, re-index complete records written after the last
+        index entry, and cut every segment back to the last complete record."""
+        self._index.seek(0, os.SEEK_END)
+        length = self._index.tell() // INDEX_ENTRY.size
+        while length and self._read_record(*self._read_entry(length - 1)) is None:
+            length -= 1
+        if length:
+            segment, offset, record_length = self._read_entry(length - 1)
+            end = offset + RECORD_HEADER.size + record_length
+        else:
+            segment, end = 0, 0
+        self._index.truncate(length * INDEX_ENTRY.size)
+
+        recovered = []
+        for number in self._segment_numbers():
+            if number < segment:
+                continue
+            position = end if number == segment else 0
+            while True:
+                payload = self._read_record(number, position, None)
+                if payload is None:
+                    break
+                recovered.append((number, position, len(payload)))
+                position += RECORD_HEADER.size + len(payload)
+            self._close_reader(number)
+            with open(self._segment_path(number), 'r+b') as file:
+                file.truncate(position)
+            if position == 0 and number > segment:
+                os.remove(self._segment_path(number))
+            else:
+                segment = number
+
+        self._index.seek(0, os.SEEK_END)
+        for entry in recovered:
+            self._index.write(INDEX_ENTRY.pack(*entry))
+        self._index.flush()
+        self._length = length + len(recovered)
+        self._segment = segment
+        self._writer = open(self._segment_path(segment), 'ab')
+
+    def _close_reader(self, segment: int):
+        reader = self._readers.pop(segment, None)
+        if reader is not None:
+            reader.close()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, block: Any) -> int:
+        """Append `block` and return its height in the store."""
+        payload = self._encode(block)
+        with self._lock:
+            if self._writer.tell() and self._writer.tell() + RECORD_HEADER.size + len(payload) > self.segment_size:
+                self._writer.close()
+                self._segment += 1
+                self._writer = open(self._segment_path(self._segment), 'ab')
+            offset = self._writer.tell()
+            self._writer.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._writer.flush()
+            if self.sync:
+                os.fsync(self._writer.fileno())
+            self._index.seek(0, os.SEEK_END)
+            self._index.write(INDEX_ENTRY.pack(self._segment, offset, len(payload)))
+            self._index.flush()
+            if self.sync:
+                os.fsync(self._index.fileno())
+            self._length += 1
+            return self._length - 1
+
+    def truncate(self, length: int):
+        """Drop every block at height `length` and above, e.g. to switch to another fork."""
+        with self._lock:
+            if not 0 <= length <= self._length:
+                raise IndexError(f"Cannot truncate {self._length} blocks to {length}")
+            if length == self._length:
+                return
+            if length:
+                segment, offset, record_length = self._read_entry(length - 1)
+                end = offset + RECORD_HEADER.size + record_length
+            else:
+                segment, end = 0, 0
+            # Cut the records before the index: if we crash in between, recovery drops the
+            # index entries whose records are gone instead of re-indexing the dropped blocks.
+            self._writer.close()
+            for number in self._segment_numbers():
+                if number > segment:
+                    self._close_reader(number)
+                    os.remove(self._segment_path(number))
+            self._close_reader(segment)
+            with open(self._segment_path(segment), 'a+b') as file:
+                file.truncate(end)
+            self._index.truncate(length * INDEX_ENTRY.size)
+            self._index.flush()
+            if self.sync:
+                os.fsync(self._index.fileno())
+            self._length = length
+            self._segment = segment
+            self._writer = open(self._segment_path(segment), 'ab')
+
+    def read_raw(self, height: int) -> bytes:
+        """Return the encoded bytes of the block at `height`."""
+        if height < 0:
+            height += self._length
+        if not 0 <= height < self._length:
+            raise IndexError(f"No block at height {height}")
+        with self._lock:
+            payload = self._read_record(*self._read_entry(height))
+        if payload is None:
+            raise IOError(f"Block {height} is corrupt in {self.path}")
+        return payload
+
+    def read(self, height: int) -> Any:
+        return self._decode(self.read_raw(height))
+
+    def __getitem__(self, height: int) -> Any:
+        return self.read(height)
+
+    def __iter__(self) -> Iterator[Any]:
+        for height in range(self._length):
+            yield self.read(height)
+
+    def close(self):
+        with self._lock:
+            self._writer.close()
+            self._index.close()
+            for segment in list(self._readers):
+                self._close_reader(segment)
+
+    def __enter__(self) -> 'BlockStore':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,447 @@
+"""
+Headers-first chain sync between nodes over TCP.
+
+Every node serves its blockchain with a SyncServer. A lagging node runs
+ChainSync against one or more peers:
+
+1. Ask every peer for its height and cumulative work.
+2. Find where the best peer's chain leaves ours (a block locator), then
+   download its headers and check that each one links to the one before it
+   and, for header-hashed blocks, hashes to its stated hash.
+3. If our blocks up to the fork plus those headers add up to more work than
+   our chain, download the bodies in chunks, several at a time and spread
+   over every peer, and verify each body against its header (hash and Merkle
+   root) as it arrives, optionally in a process pool.
+4. Rewind to the fork and append the new blocks. Entries from dropped blocks
+   go back into the mempool, and entries in the new blocks leave it.
+
+Messages are length-prefixed JSON: [length: 4 bytes, big-endian][UTF-8 JSON].
+The work of a block is the expected number of hashes needed to meet the
+target stored in its header, 2 ** 256 // (target + 1), so forks mined at
+different difficulties compare fairly and a lucky low hash counts for no
+more than any other block at the same target. With retargeting, each stored
+target must also be the one the schedule gives for its height.
+"""
+
+import json
+import socket
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from struct import Struct
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+FRAME_HEADER = Struct('>I')
+MAX_FRAME = 64 * 1024 * 1024
+HEADER_FIELDS = ('index', 'timestamp', 'previous_hash', 'nonce', 'version', 'target', 'merkle_root', 'hash')
+HEADER_BATCH = 2000
+BODY_BATCH = 50
+MAX_BODIES_PER_REQUEST = 500
+DEFAULT_WORKERS = 4
+SOCKET_TIMEOUT = 30.0
+LOCATOR_DENSE = 10  # the newest heights in a locator, before the steps start doubling
+
+Peer = Tuple[str, int]
+
+class SyncError(Exception):
+    pass
+
+def send_message(sock: socket.socket, message: Dict[str, Any]):
+    data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError('Peer closed the connection mid-message')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def receive_message(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """The next message, or None if the peer closed the connection cleanly."""
+    first = sock.recv(FRAME_HEADER.size)
+    if not first:
+        return None
+    header = first + _receive_exactly(sock, FRAME_HEADER.size - len(first))
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise SyncError(f'Message of {length} bytes is over the {MAX_FRAME} byte limit')
+    return json.loads(_receive_exactly(sock, length))
+
+def block_work(target: int) -> int:
+    return 2 ** 256 // (target + 1)
+
+def chain_work(targets: Iterable[int]) -> int:
+    return sum(block_work(target) for target in targets)
+
+def header_of(block: Any) -> Dict[str, Any]:
+    return {field: getattr(block, field) for field in HEADER_FIELDS}
+
+class ChainWork:
+    """Cumulative work of a chain, extended incrementally as it grows."""
+
+    def __init__(self):
+        self.prefix: List[int] = []  # work of blocks 0..height
+        self._tip: Optional[str] = None
+
+    def update(self, blockchain: Any) -> 'ChainWork':
+        chain = blockchain.chain
+        counted = len(self.prefix)
+        if counted > len(chain) or (counted and chain[counted - 1].hash != self._tip):
+            self.prefix, counted = [], 0  # the chain was rewound under us; count again
+        total = self.prefix[-1] if self.prefix else 0
+        for height in range(counted, len(chain)):
+            total += block_work(blockchain.block_target(height))
+            self.prefix.append(total)
+        self._tip = chain[-1].hash if len(chain) else None
+        return self
+
+    def through(self, height: int) -> int:
+        return self.prefix[height] if height >= 0 else 0
+
+    @property
+    def total(self) -> int:
+        return self.prefix[-1] if self.prefix else 0
+
+def check_header(block_cls: Any, header: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Why `header` can't follow `previous` (None for a genesis header), or None if it can."""
+    if any(field not in header for field in HEADER_FIELDS):
+        return 'missing fields'
+    if previous is None:
+        if header['index'] != 0:
+            return 'chain does not start at genesis'
+    elif header['index'] != previous['index'] + 1:
+        return 'height out of order'
+    elif header['previous_hash'] != previous['hash']:
+        return 'previous hash mismatch'
+    if header['version'] >= 2:
+        # Header-hashed blocks can be checked without their payload; legacy ones wait for the body.
+        block = block_cls.from_dict(dict(header, **{block_cls.PAYLOAD_FIELD: []}))
+        if block.compute_hash() != header['hash']:
+            return 'hash mismatch'
+    return None
+
+def check_blocks(headers: List[Dict[str, Any]], blocks: List[Any]) -> Optional[str]:
+    """Why `blocks` don't match `headers`, or None if every one does."""
+    for header, block in zip(headers, blocks):
+        if header_of(block) != header:
+            return f"block {header['index']} does not match its header"
+        if block.compute_hash() != block.hash:
+            return f"block {header['index']}: hash mismatch"
+        if not block.has_valid_merkle_root():
+            return f"block {header['index']}: merkle root mismatch"
+    return None
+
+def decode_bodies(block_cls: Any, headers: List[Dict[str, Any]], bodies: List[Optional[Dict[str, Any]]]) -> List[Any]:
+    if len(bodies) != len(headers):
+        raise SyncError(f'asked for {len(headers)} blocks, got {len(bodies)}')
+    for header, body in zip(headers, bodies):
+        if body is None:
+            raise SyncError(f"block {header['index']} is missing")
+    return [block_cls.from_dict(body) for body in bodies]
+
+def verify_bodies(block_cls: Any, headers: List[Dict[str, Any]], bodies: List[Optional[Dict[str, Any]]]) -> Optional[str]:
+    """check_blocks for raw bodies, for running in a worker process."""
+    try:
+        return check_blocks(headers, decode_bodies(block_cls, headers, bodies))
+    except (SyncError, KeyError, TypeError) as error:
+        return str(error)
+
+class _SyncHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.settimeout(None)
+        while True:
+            try:
+                request = receive_message(self.request)
+            except (OSError, ValueError, SyncError):
+                return
+            if request is None:
+                return
+            try:
+                reply = self.server.node.answer(request)
+            except Exception as error:  # a bad request or a chain that moved under us
+                reply = {'error': f'{type(error).__name__}: {error}'}
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class SyncServer:
+    """Serve a blockchain's status, headers and blocks to syncing peers."""
+
+    def __init__(self, blockchain: Any, host: str = '127.0.0.1', port: int = 0):
+        self.blockchain = blockchain
+        self.work = ChainWork()
+        self._work_lock = threading.Lock()
+        self._server = _ThreadingServer((host, port), _SyncHandler)
+        self._server.node = self
+        self.address: Peer = self._server.server_address[:2]
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'SyncServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='sync-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def answer(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        chain = self.blockchain.chain
+        kind = request.get('type')
+        if kind == 'status':
+            with self._work_lock:
+                work = self.work.update(self.blockchain).total
+            return {'height': len(chain) - 1, 'tip': chain[-1].hash, 'work': work}
+        if kind == 'locate':
+            # The newest of the asker's (height, hash) pairs that is also on our chain
+            for height, block_hash in request['locator']:
+                if 0 <= height < len(chain) and chain[height].hash == block_hash:
+                    return {'height': height}
+            return {'height': -1}
+        if kind == 'headers':
+            start = max(0, request['start'])
+            stop = min(len(chain), start + min(request.get('count', HEADER_BATCH), HEADER_BATCH))
+            return {'headers': [header_of(chain[height]) for height in range(start, stop)]}
+        if kind == 'blocks':
+            heights = request['heights'][:MAX_BODIES_PER_REQUEST]
+            return {'blocks': [chain[height].to_dict() if 0 <= height < len(chain) else None for height in heights]}
+        return {'error': f'Unknown request type {kind!r}'}
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'SyncServer':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class PeerConnection:
+    def __init__(self, peer: Peer, timeout: float = SOCKET_TIMEOUT):
+        self.peer = tuple(peer)
+        self.sock = socket.create_connection(self.peer, timeout=timeout)
+
+    def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        send_message(self.sock, message)
+        reply = receive_message(self.sock)
+        if reply is None:
+            raise ConnectionError(f'{self.peer} closed the connection')
+        if 'error' in reply:
+            raise SyncError(f"{self.peer}: {reply['error']}")
+        return reply
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self) -> 'PeerConnection':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ChainSync:
+    def __init__(self, blockchain: Any, peers: Sequence[Peer], workers: int = DEFAULT_WORKERS,
+                 verify_workers: int = 1, body_batch: int = BODY_BATCH, block_cls: Any = None):
+        """Catch `blockchain` up with `peers`, downloading with `workers` threads and
+        verifying bodies in `verify_workers` processes (1 = in the download threads)."""
+        self.blockchain = blockchain
+        self.peers = [tuple(peer) for peer in peers]
+        self.workers = workers
+        self.verify_workers = verify_workers
+        self.body_batch = body_batch
+        self.block_cls = block_cls or (type(blockchain.chain[0]) if blockchain.chain else None)
+        if self.block_cls is None:
+            raise ValueError('Pass block_cls to sync into an empty chain')
+        self.work = ChainWork()
+        self.stats: Dict[str, Any] = {}
+        self.errors: List[str] = []
+
+    def locator(self) -> List[Tuple[int, str]]:
+        """(height, hash) pairs from our tip back to genesis: dense near the tip, then doubling."""
+        chain = self.blockchain.chain
+        if not chain:
+            return []
+        heights, height, step = [], len(chain) - 1, 1
+        while height > 0:
+            heights.append(height)
+            if len(heights) >= LOCATOR_DENSE:
+                step *= 2
+            height -= step
+        heights.append(0)
+        return [(height, chain[height].hash) for height in heights]
+
+    def statuses(self) -> Dict[Peer, Dict[str, Any]]:
+        def ask(peer: Peer) -> Optional[Dict[str, Any]]:
+            try:
+                with PeerConnection(peer) as connection:
+                    return connection.request({'type': 'status'})
+            except (OSError, ValueError, SyncError) as error:
+                self.errors.append(f'{peer}: {error}')
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.peers))) as pool:
+            answers = list(pool.map(ask, self.peers))
+        return {peer: status for peer, status in zip(self.peers, answers) if status is not None}
+
+    def sync(self) -> bool:
+        """Switch to the peer chain with the most work, if it has more than ours. True if our chain changed."""
+        started = perf_counter()
+        statuses = self.statuses()
+        if not statuses:
+            raise SyncError('No peer answered: ' + '; '.join(self.errors))
+        our_work = self.work.update(self.blockchain).total
+        for peer, status in sorted(statuses.items(), key=lambda item: item[1]['work'], reverse=True):
+            if status['work'] <= our_work:
+                break  # nobody left with more work than us
+            try:
+                fork, headers = self.fetch_headers(peer)
+                targets = self.check_targets(fork, headers)
+            except (OSError, ValueError, SyncError) as error:
+                self.errors.append(f'{peer}: {error}')
+                continue
+            if not headers or self.work.through(fork) + chain_work(targets) <= our_work:
+                continue  # the peer's status oversold its chain
+            headers_done = perf_counter()
+            sources = [peer] + [other for other in statuses if other != peer and statuses[other]['height'] > fork]
+            blocks = self.fetch_bodies(headers, sources)
+            bodies_done = perf_counter()
+            dropped = self.apply(fork, blocks)
+            self.stats = {
+                'peer': list(peer), 'peers': len(sources), 'fork_height': fork, 'blocks': len(blocks),
+                'dropped': len(dropped), 'headers_seconds': headers_done - started,
+                'bodies_seconds': bodies_done - headers_done, 'seconds': perf_counter() - started,
+            }
+            return True
+        return False
+
+    def fetch_headers(self, peer: Peer) -> Tuple[int, List[Dict[str, Any]]]:
+        """Our fork height against `peer` and its checked headers after the fork."""
+        chain = self.blockchain.chain
+        with PeerConnection(peer) as connection:
+            fork = connection.request({'type': 'locate', 'locator': self.locator()})['height']
+            previous = header_of(chain[fork]) if fork >= 0 else None
+            headers: List[Dict[str, Any]] = []
+            while True:
+                batch = connection.request({'type': 'headers', 'start': fork + 1 + len(headers), 'count': HEADER_BATCH})['headers']
+                if not batch:
+                    break
+                for header in batch:
+                    problem = check_header(self.block_cls, header, previous)
+                    if problem is not None:
+                        raise SyncError(f"header {header.get('index')}: {problem}")
+                    headers.append(header)
+                    previous = header
+        # The locator only samples our chain, so the first few headers may be blocks we already have
+        shared = 0
+        while shared < len(headers) and fork + 1 + shared < len(chain) and chain[fork + 1 + shared].hash == headers[shared]['hash']:
+            shared += 1
+        return fork + shared, headers[shared:]
+
+    def check_targets(self, fork: int, headers: List[Dict[str, Any]]) -> List[int]:
+        """Make sure every header after `fork` carries a valid target and meets it; returns those targets."""
+        retarget = getattr(self.blockchain, 'retarget', None)
+        chain = self.blockchain.chain
+        if retarget is not None:
+            timestamp_of = lambda height: chain[height].timestamp if height <= fork else headers[height - fork - 1]['timestamp']
+            periods = self.blockchain.targets[:retarget.known_periods(fork)] if fork >= 0 else []  # only periods the fork keeps
+        previous = chain[fork].target if fork >= 0 else None
+        targets = []
+        for height, header in enumerate(headers, fork + 1):
+            target = header['target']
+            if retarget is not None and height >= retarget.start_height:
+                expected = retarget.expected_target(height, previous, timestamp_of, periods)
+                if target is not None and target != expected:
+                    raise SyncError(f'Block {height} has a target off the retarget schedule')
+            else:
+                expected = self.blockchain.target_at(height)  # fixed difficulty: only blocks without a target use it
+            if target is not None and not 0 < target < 2 ** 256:
+                raise SyncError(f'Block {height} has an impossible target')
+            targets.append(expected if target is None else target)
+            if height and int(header['hash'], 16) > targets[-1]:
+                raise SyncError(f'Block {height} does not meet its difficulty target')
+            previous = target
+        return targets
+
+    def fetch_bodies(self, headers: List[Dict[str, Any]], sources: List[Peer]) -> List[Any]:
+        """Download and verify the blocks for `headers`, chunks spread over `sources`."""
+        chunks = [headers[start:start + self.body_batch] for start in range(0, len(headers), self.body_batch)]
+        local = threading.local()
+        opened: List[PeerConnection] = []
+        opened_lock = threading.Lock()
+        verifier = ProcessPoolExecutor(max_workers=self.verify_workers) if self.verify_workers > 1 else None
+
+        def connection(peer: Peer) -> PeerConnection:
+            connections = local.__dict__.setdefault('connections', {})
+            if peer not in connections:
+                connections[peer] = PeerConnection(peer)
+                with opened_lock:
+                    opened.append(connections[peer])
+            return connections[peer]
+
+        def fetch(number: int) -> List[Any]:
+            chunk = chunks[number]
+            problems = []
+            for attempt in range(len(sources)):  # start at a different peer per chunk, fail over to the rest
+                peer = sources[(number + attempt) % len(sources)]
+                try:
+                    bodies = connection(peer).request({'type': 'blocks', 'heights': [header['index'] for header in chunk]})['blocks']
+                except (OSError, ValueError, SyncError) as error:
+                    local.__dict__.get('connections', {}).pop(peer, None)
+                    problems.append(f'{peer}: {error}')
+                    continue
+                try:
+                    blocks = decode_bodies(self.block_cls, chunk, bodies)
+                except (SyncError, KeyError, TypeError) as error:
+                    problems.append(f'{peer}: {error}')
+                    continue
+                if verifier is not None:
+                    problem = verifier.submit(verify_bodies, self.block_cls, chunk, bodies).result()
+                else:
+                    problem = check_blocks(chunk, blocks)
+                if problem is None:
+                    return blocks
+                problems.append(f'{peer}: {problem}')
+            raise SyncError(f"No peer served blocks {chunk[0]['index']}-{chunk[-1]['index']}: " + '; '.join(problems))
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                return [block for blocks in pool.map(fetch, range(len(chunks))) for block in blocks]
+        finally:
+            for peer_connection in opened:
+                peer_connection.close()
+            if verifier is not None:
+                verifier.shutdown()
+
+    def apply(self, fork: int, blocks: List[Any]) -> List[Any]:
+        """Rewind to `fork`, append `blocks` and fix up the mempool; returns the dropped blocks."""
+        blockchain = self.blockchain
+        chain = blockchain.chain
+        if fork >= len(chain) or (fork >= 0 and chain[fork].hash != blocks[0].previous_hash):
+            raise SyncError('Our chain changed during the sync')
+        was_verified = blockchain.verified_height >= max(fork, 0)
+        dropped = blockchain.rewind(fork) if fork < len(chain) - 1 else []
+        for block in blocks:
+            blockchain.append_block(block)
+        if was_verified:
+            # Every new block was checked against its header, and the headers link up
+            blockchain.verified_height = len(blockchain.chain) - 1
+            blockchain.verified_hash = blockchain.chain[-1].hash
+        mempool = getattr(blockchain, 'mempool', None)
+        if mempool is not None:
+            field = self.block_cls.PAYLOAD_FIELD
+            # Dropped entries go back first, so one that is on both forks is then taken out again
+            for block in dropped:
+                for entry in list(getattr(block, field))[:-1]:  # the last entry is the miner's reward
+                    mempool.add(entry)
+            if len(mempool):
+                for block in blocks:
+                    for entry in getattr(block, field):
+                        mempool.remove(entry)
+        return dropped
@@ -0,0 +1,289 @@
+"""
+Benchmarks for the chat app.
+
+    python Benchmark.py protocol --messages 20000 --size 200
+    python Benchmark.py chatlog --messages 20000 --threads 8
+    python Benchmark.py crash --seconds 2
+    python Benchmark.py chat --clients 200 --messages 5
+
+Save a run and compare two runs:
+
+    python Benchmark.py --output before.json chat
+    python Benchmark.py --output after.json chat
+    python Benchmark.py compare before.json after.json --threshold 0.10
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import signal
+import socket
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep, time
+from typing import Any, Callable, Dict, List, Optional
+
+import LoadTest
+
+from ChatLog import DURABILITY_MODES, ChatLog
+from ChatProtocol import MESSAGE, FrameSocket, encode_frame, encode_frames
+
+def make_messages(count: int, size: int) -> List[str]:
+    """Distinct chat lines of roughly `size` characters."""
+    return [f"{i:08d} " + "x" * max(0, size - 9) for i in range(count)]
+
+def transfer(send: Callable[[socket.socket], None], receive: Callable[[socket.socket], List[str]]) -> Dict[str, Any]:
+    """Run `send` and `receive` on the two ends of a socket pair and time the whole exchange."""
+    left, right = socket.socketpair()
+    received: List[str] = []
+    reader = threading.Thread(target=lambda: received.extend(receive(right)))
+    started = perf_counter()
+    reader.start()
+    send(left)
+    left.close()
+    reader.join()
+    elapsed = perf_counter() - started
+    right.close()
+    return {"seconds": elapsed, "received": received}
+
+def receive_raw(sock: socket.socket) -> List[str]:
+    """The old protocol: every recv(1024) is taken to be one message."""
+    messages = []
+    while True:
+        data = sock.recv(1024)
+        if not data:
+            return messages
+        messages.append(data.decode('utf-8', errors='replace'))
+
+def receive_framed(sock: socket.socket) -> List[str]:
+    connection = FrameSocket(sock)
+    messages = []
+    while True:
+        frames = connection.receive_frames()
+        if frames is None:
+            return messages
+        messages.extend(payload for _, payload in frames)
+
+def report(messages: List[str], result: Dict[str, Any]) -> Dict[str, Any]:
+    received = result["received"]
+    intact = len(set(received) & set(messages))
+    return {
+        "messages_per_second": len(messages) / result["seconds"],
+        "messages_received": len(received),
+        "messages_intact": intact,
+        "correct": received == messages,
+    }
+
+def bench_protocol(args) -> Dict[str, Any]:
+    """Raw recv(1024) vs framed one-send-per-message vs framed batched sends."""
+    messages = make_messages(args.messages, args.size)
+
+    def send_raw(sock):
+        for message in messages:
+            sock.sendall(message.encode('utf-8'))
+
+    def send_framed(sock):
+        for message in messages:
+            sock.sendall(encode_frame(MESSAGE, message))
+
+    def send_batched(sock):
+        for start in range(0, len(messages), args.batch):
+            sock.sendall(encode_frames((MESSAGE, message) for message in messages[start:start + args.batch]))
+
+    return {
+        "messages": args.messages,
+        "message_size": args.size,
+        "batch": args.batch,
+        "raw": report(messages, transfer(send_raw, receive_raw)),
+        "framed": report(messages, transfer(send_framed, receive_framed)),
+        "framed_batched": report(messages, transfer(send_batched, receive_framed)),
+    }
+
+def save_per_message(path: str, message: Dict[str, Any]):
+    """The old save_message_to_file: open, append one line, close."""
+    with open(path, 'a') as file:
+        file.write(json.dumps(message) + '\n')
+
+def count_lines(path: str) -> int:
+    with open(path, 'rb') as file:
+        return sum(1 for line in file if line.endswith(b'\n'))
+
+def chat_record(i: int) -> Dict[str, Any]:
+    return {'username': f'user{i % 100}', 'message': f'message number {i}', 'timestamp': time()}
+
+def run_threads(threads: int, messages: int, save: Callable[[Dict[str, Any]], None]) -> float:
+    """Save `messages` records from `threads` handler threads; seconds until all returned."""
+    per_thread = messages // threads
+
+    def handler(offset):
+        for i in range(offset, offset + per_thread):
+            save(chat_record(i))
+
+    workers = [threading.Thread(target=handler, args=(t * per_thread,)) for t in range(threads)]
+    started = perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return perf_counter() - started
+
+def bench_chatlog(args) -> Dict[str, Any]:
+    """Per-message open/append/close vs the group-commit log in every durability mode."""
+    results = {}
+    total = args.messages // args.threads * args.threads
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'per_message.json')
+        seconds = run_threads(args.threads, args.messages, lambda message: save_per_message(path, message))
+        results['per_message'] = {'messages_per_second': total / seconds, 'lines': count_lines(path)}
+        for mode in DURABILITY_MODES:
+            path = os.path.join(directory, f'{mode}.json')
+            log = ChatLog(path, mode, args.sync_interval)
+            started = perf_counter()
+            handler_seconds = run_threads(args.threads, args.messages, log.append)
+            log.close()
+            seconds = perf_counter() - started
+            results[mode] = dict(log.stats(), handler_messages_per_second=total / handler_seconds,
+                                 messages_per_second=total / seconds, lines=count_lines(path))
+    return {'messages': total, 'threads': args.threads, 'results': results}
+
+def crash_child(path: str, mode: str, sync_interval: float, rate: float, appended, written, durable):
+    """Append messages at `rate` per second until killed, publishing the log's counters."""
+    log = ChatLog(path, mode, sync_interval)
+    pause = 1.0 / rate if rate else 0.0
+    i = 0
+    while True:
+        log.append(chat_record(i))
+        i += 1
+        appended.value = log.appended
+        written.value = log.written
+        durable.value = log.durable
+        if pause:
+            sleep(pause)
+
+def bench_crash(args) -> Dict[str, Any]:
+    """SIGKILL a writer mid-stream in each mode and count what made it to the file.
+
+    `lost_on_kill` is what a process crash loses: acknowledged by append() but never
+    written. `at_risk_on_power_loss` was written to the OS but not yet fsynced, so a
+    machine crash at that moment could lose it too.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in DURABILITY_MODES:
+            path = os.path.join(directory, f'{mode}.json')
+            appended, written, durable = (multiprocessing.Value('q', 0) for _ in range(3))
+            child = multiprocessing.Process(target=crash_child, args=(path, mode, args.sync_interval, args.rate, appended, written, durable))
+            child.start()
+            sleep(args.seconds)
+            os.kill(child.pid, signal.SIGKILL)
+            child.join()
+            on_disk = count_lines(path)
+            results[mode] = {
+                'appended': appended.value,
+                'on_disk': on_disk,
+                'lost_on_kill': max(0, appended.value - on_disk),
+                'at_risk_on_power_loss': max(0, on_disk - durable.value),
+            }
+    return {'seconds': args.seconds, 'rate': args.rate, 'sync_interval': args.sync_interval, 'results': results}
+
+def bench_chat(args) -> Dict[str, Any]:
+    """Chat messages per second and delivery latency over loopback (see LoadTest.py)."""
+    return LoadTest.load_test(args)
+
+def run_info() -> Dict[str, Any]:
+    """Where and when a run happened, so saved reports can be told apart."""
+    return {
+        "time": time(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "argv": sys.argv[1:],
+    }
+
+def flatten(data: Any, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of a nested report, keyed by dotted path."""
+    if isinstance(data, dict):
+        flat = {}
+        for key, value in data.items():
+            flat.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+        return flat
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        return {prefix: float(data)}
+    return {}
+
+def better_direction(key: str) -> Optional[int]:
+    """-1 if smaller is better, +1 if bigger is better, None for sizes and counts."""
+    name = key.rsplit(".", 1)[-1]
+    if name.endswith(("_s", "_ms", "_us", "seconds", "size_ratio")) or "bytes" in name:
+        return -1
+    if name.endswith(("per_second", "hash_rate", "speedup", "saving", "delivery_ratio")):
+        return 1
+    return None
+
+def bench_compare(args) -> Dict[str, Any]:
+    """Flag every metric that moved the wrong way by more than --threshold."""
+    with open(args.baseline) as file:
+        baseline = flatten(json.load(file).get("results", {}))
+    with open(args.current) as file:
+        current = flatten(json.load(file).get("results", {}))
+    regressions, improvements = [], []
+    for key in sorted(baseline.keys() & current.keys()):
+        direction = better_direction(key)
+        if direction is None or not baseline[key]:
+            continue
+        change = (current[key] - baseline[key]) / baseline[key]
+        entry = {"metric": key, "baseline": baseline[key], "current": current[key], "change": change}
+        if change * direction < -args.threshold:
+            regressions.append(entry)
+        elif change * direction > args.threshold:
+            improvements.append(entry)
+    return {"threshold": args.threshold, "compared": len(baseline.keys() & current.keys()), "regressions": regressions, "improvements": improvements}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the chat app.")
+    parser.add_argument("--output", help="also save the results (with run info) to this JSON file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    protocol = commands.add_parser("protocol", help="raw vs framed vs batched framed wire protocol")
+    protocol.add_argument("--messages", type=int, default=20000)
+    protocol.add_argument("--size", type=int, default=200, help="characters per message")
+    protocol.add_argument("--batch", type=int, default=64, help="frames per send in the batched run")
+    protocol.set_defaults(run=bench_protocol)
+
+    chatlog = commands.add_parser("chatlog", help="per-message file writes vs the group-commit chat log")
+    chatlog.add_argument("--messages", type=int, default=20000)
+    chatlog.add_argument("--threads", type=int, default=8, help="handler threads saving at once")
+    chatlog.add_argument("--sync-interval", type=float, default=1.0)
+    chatlog.set_defaults(run=bench_chatlog)
+
+    crash = commands.add_parser("crash", help="messages lost when the writer process is killed, per durability mode")
+    crash.add_argument("--seconds", type=float, default=2.0, help="how long to write before the kill")
+    crash.add_argument("--rate", type=float, default=5000, help="messages per second (0 = as fast as possible)")
+    crash.add_argument("--sync-interval", type=float, default=1.0)
+    crash.set_defaults(run=bench_crash)
+
+    chat = commands.add_parser("chat", help="server messages per second and latency over loopback")
+    LoadTest.add_arguments(chat)
+    chat.set_defaults(run=bench_chat)
+
+    compare = commands.add_parser("compare", help="compare two saved runs and list regressions")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.10, help="relative change that counts (0.10 = 10%%)")
+    compare.set_defaults(run=bench_compare)
+
+    args = parser.parse_args()
+    results = args.run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"benchmark": "ChatApp", "command": args.command, "run": run_info(), "results": results}, file, indent=2)
+    if args.command == "compare" and results["regressions"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Size/time-triggered block builder for chat traffic.
+
+Received chat messages go into an in-memory mempool. A background worker cuts
+a block as soon as `max_messages` are waiting or the oldest waiting message is
+`max_delay` seconds old, and mines it into a MessagingBlockchain. Only the
+worker touches the chain, so adding a message is a short locked append and
+never waits on proof-of-work. The queue holds at most `max_pending` messages
+(by default, as many as the chain's mempool); beyond that new messages are
+dropped and counted rather than piling up in memory.
+"""
+
+import sys
+import threading
+from collections import deque
+from time import monotonic
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from PyBasicBlockchain2 import MessagingBlockchain
+
+DEFAULT_MAX_MESSAGES = 100
+DEFAULT_MAX_DELAY = 5.0
+BROADCAST_RECIPIENT = "all"
+MINER_ADDRESS = "ChatServer"
+LATENCY_SAMPLES = 1024
+
+def chat_to_chain_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a saved chat line ({username, message, timestamp}) onto the chain's message fields."""
+    return {
+        "sender": message["username"],
+        "recipient": message.get("recipient", BROADCAST_RECIPIENT),
+        "content": message["message"],
+        "timestamp": message["timestamp"],
+    }
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class BlockBuilder:
+    def __init__(self, blockchain: MessagingBlockchain, max_messages: int = DEFAULT_MAX_MESSAGES,
+                 max_delay: float = DEFAULT_MAX_DELAY, miner_address: str = MINER_ADDRESS, metrics: Optional[Any] = None,
+                 max_pending: Optional[int] = None):
+        self.blockchain = blockchain
+        self.max_messages = max_messages
+        self.max_delay = max_delay
+        self.max_pending = blockchain.mempool.max_count if max_pending is None else max_pending
+        self.miner_address = miner_address
+        self.metrics = metrics
+        self._mempool: Deque[Tuple[float, Dict[str, Any]]] = deque()  # (arrival, chain message)
+        self._condition = threading.Condition()
+        self._closed = False
+        self.messages_received = 0
+        self.messages_mined = 0
+        self.messages_dropped = 0  # duplicates, turned away by a full chain mempool, or by a full queue here
+        self.blocks_cut = 0
+        self.errors = 0  # blocks that failed to cut; the worker logs them and carries on
+        self.last_error: Optional[str] = None
+        self.max_mempool_depth = 0
+        self.cut_latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)   # oldest arrival -> block appended
+        self.mining_seconds: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._worker = threading.Thread(target=self._run, name='block-builder', daemon=True)
+        self._worker.start()
+
+    def add(self, message: Dict[str, Any]) -> bool:
+        """Queue a chat message for the next block; False if the queue is full and the message was dropped."""
+        entry = (monotonic(), chat_to_chain_message(message))
+        with self._condition:
+            if self._closed:
+                raise ValueError("BlockBuilder is closed")
+            self.messages_received += 1
+            if len(self._mempool) >= self.max_pending:
+                self.messages_dropped += 1
+                dropped = True
+            else:
+                self._mempool.append(entry)
+                dropped = False
+            depth = len(self._mempool)
+            if depth > self.max_mempool_depth:
+                self.max_mempool_depth = depth
+            if depth >= self.max_messages:
+                self._condition.notify()
+        if self.metrics is not None:
+            self.metrics.set('block_builder_mempool_depth', depth)
+            if dropped:
+                self.metrics.inc('block_builder_dropped_total')
+        return not dropped
+
+    def _next_batch(self) -> Optional[List[Tuple[float, Dict[str, Any]]]]:
+        """Wait for the size or time trigger and take up to `max_messages` messages."""
+        with self._condition:
+            while True:
+                if self._mempool:
+                    due = self._mempool[0][0] + self.max_delay
+                    if self._closed or len(self._mempool) >= self.max_messages or monotonic() >= due:
+                        count = min(len(self._mempool), self.max_messages)
+                        return [self._mempool.popleft() for _ in range(count)]
+                    self._condition.wait(due - monotonic())
+                elif self._closed:
+                    return None
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._cut(batch)
+            except Exception as error:
+                # A bad message or a failing store must not kill the worker and silently stop mining
+                self.errors += 1
+                self.last_error = f"{type(error).__name__}: {error}"
+                print(f"Block builder failed to cut a block: {self.last_error}", file=sys.stderr)
+                if self.metrics is not None:
+                    self.metrics.inc('block_builder_errors_total')
+
+    def _cut(self, batch: List[Tuple[float, Dict[str, Any]]]):
+        started = monotonic()
+        for _, message in batch:
+            if not self.blockchain.add_message(message):
+                self.messages_dropped += 1
+        self.blockchain.mine_pending_messages(self.miner_address)
+        finished = monotonic()
+        self.blocks_cut += 1
+        mined = len(self.blockchain.get_last_block().messages) - 1  # minus the reward message
+        self.messages_mined += mined
+        self.mining_seconds.append(finished - started)
+        self.cut_latencies.append(finished - batch[0][0])
+        if self.metrics is not None:
+            self.metrics.observe('block_cut_seconds', finished - batch[0][0])
+            self.metrics.observe('block_messages', mined)
+            self.metrics.set('block_builder_mempool_depth', self.mempool_depth)
+
+    @property
+    def mempool_depth(self) -> int:
+        return len(self._mempool)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = list(self.cut_latencies)
+        mining = list(self.mining_seconds)
+        return {
+            "mempool_depth": self.mempool_depth,
+            "max_mempool_depth": self.max_mempool_depth,
+            "messages_received": self.messages_received,
+            "messages_mined": self.messages_mined,
+            "messages_dropped": self.messages_dropped,
+            "blocks_cut": self.blocks_cut,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "chain_height": len(self.blockchain.chain) - 1,
+            "messages_per_block": self.messages_mined / self.blocks_cut if self.blocks_cut else 0.0,
+            "cut_latency_p50_s": percentile(latencies, 0.50),
+            "cut_latency_p99_s": percentile(latencies, 0.99),
+            "mining_p50_s": percentile(mining, 0.50),
+            "mining_p99_s": percentile(mining, 0.99),
+        }
+
+    def close(self):
+        """Mine whatever is still waiting and stop the worker."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._worker.join()
+
+    def __enter__(self) -> 'BlockBuilder':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
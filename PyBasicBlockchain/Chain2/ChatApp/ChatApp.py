@@ -1,21 +1,23 @@
 import socket  # We need sockets for chatting, like the internet's version of a telephone line.
 from threading import Thread  # To handle incoming messages while letting you type. It's multitasking at its finest!
 import sys  # For exiting the program. Because sometimes, we need to hit the eject button!
+from ChatProtocol import EXIT, JOIN, MESSAGE, FrameSocket, ProtocolError  # Our envelope format: length, type, payload.
 
 # Client configuration
 SERVER_HOST = 'localhost'  # The server’s address. In this case, it’s running on your own computer.
 SERVER_PORT = 5000         # The port number. Think of it as the server’s specific phone line.
 
-def receive_messages(client_socket):
+def receive_messages(connection):
     # This function will keep checking for new messages from the server.
     while True:
         try:
-            message = client_socket.recv(1024).decode('utf-8')  # Receive a message. It's like catching a letter from the post office.
-            if message:
-                print(message)  # Display the message. The chat window is where it all happens!
-            else:
-                break  # If there's no message, it means the server might be gone. Time to break out of the loop.
-        except:
+            frames = connection.receive_frames()  # Receive whole messages. It's like catching letters from the post office.
+            if frames is None:
+                break  # If there's nothing, it means the server might be gone. Time to break out of the loop.
+            for frame_type, message in frames:
+                if frame_type == MESSAGE:
+                    print(message)  # Display the message. The chat window is where it all happens!
+        except (OSError, ProtocolError):
             print("Connection lost.")  # If something goes wrong, let the user know the connection has been lost.
             break
 
@@ -23,18 +25,23 @@ def main():
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create a socket. This is our connection to the server.
     client_socket.connect((SERVER_HOST, SERVER_PORT))  # Connect to the server. It's like dialing in to the chat party!
 
+    connection = FrameSocket(client_socket)  # Wrap the socket so every message travels in its own envelope.
+
     username = input("Enter your username: ")  # Ask for the user's name. We need to know who’s chatting.
-    client_socket.send(username.encode('utf-8'))  # Send the username to the server. Time to introduce yourself!
+    connection.send(JOIN, username)  # Send the username to the server. Time to introduce yourself!
 
-    receive_thread = Thread(target=receive_messages, args=(client_socket,))  # Start a new thread to receive messages. Like having a personal assistant!
+    receive_thread = Thread(target=receive_messages, args=(connection,))  # Start a new thread to receive messages. Like having a personal assistant!
     receive_thread.start()
 
     while True:
         message = input()  # Get a message from the user. What’s on your mind?
         if message.lower() == 'exit':
-            client_socket.send(message.encode('utf-8'))  # Send an exit message to the server. Time to say goodbye!
+            connection.send(EXIT)  # Send an exit message to the server. Time to say goodbye!
             break
-        client_socket.send(message.encode('utf-8'))  # Send the message to the server. Share your thoughts with everyone!
+        try:
+            connection.send(MESSAGE, message)  # Send the message to the server. Share your thoughts with everyone!
+        except ProtocolError:
+            print("Message too long, not sent.")  # Bigger than a frame can carry. Try saying it in fewer words!
 
     client_socket.close()  # Close the connection when done. No more chat, no more connection.
     sys.exit()  # Exit the program. It’s like finally hitting the end of the chat session!
@@ -0,0 +1,168 @@
+"""
+Group-commit write-behind log for chat messages.
+
+Handler threads (or the event loop) hand messages to `append`, which only
+puts them on an unbounded queue and never touches the disk. One writer thread
+drains everything that has piled up, writes the whole batch as JSON lines with
+a single write and flush, and then syncs according to the durability mode:
+
+    batch     fsync after every batch; a message is durable once it is written
+    interval  fsync at most every `sync_interval` seconds (and when idle)
+    none      never fsync; the OS decides when the data reaches the disk
+
+A batch that cannot be written (a full disk, a message that is not JSON) is
+logged to stderr and counted, and the writer carries on with the next one.
+"""
+
+import json
+import os
+import sys
+import threading
+from queue import Empty, SimpleQueue
+from time import monotonic
+from typing import Any, Dict, List, Optional
+
+DURABILITY_MODES = ('batch', 'interval', 'none')
+DEFAULT_DURABILITY = 'interval'
+DEFAULT_SYNC_INTERVAL = 1.0
+MAX_BATCH = 4096
+
+_STOP = object()
+
+class ChatLog:
+    def __init__(self, path: str, durability: str = DEFAULT_DURABILITY,
+                 sync_interval: float = DEFAULT_SYNC_INTERVAL, max_batch: int = MAX_BATCH, metrics: Optional[Any] = None):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}, expected one of {DURABILITY_MODES}")
+        self.path = path
+        self.durability = durability
+        self.sync_interval = sync_interval
+        self.max_batch = max_batch
+        self.metrics = metrics
+        self.appended = 0  # handed to append()
+        self.written = 0   # written and flushed to the OS
+        self.durable = 0   # covered by an fsync
+        self.batches = 0
+        self.syncs = 0
+        self.failed = 0    # lost to a write error or not serializable
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()  # appended is bumped from every handler thread
+        self._queue: SimpleQueue = SimpleQueue()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._last_sync = monotonic()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name='chat-log-writer', daemon=True)
+        self._writer.start()
+
+    def append(self, message: Dict[str, Any]):
+        """Queue `message` for the writer thread. Never blocks on disk."""
+        with self._lock:
+            if self._closed:
+                raise ValueError("ChatLog is closed")
+            self.appended += 1
+            self._queue.put(message)
+
+    def _next_batch(self) -> Optional[List[Any]]:
+        """Wait for at least one message, then take everything else that is already queued."""
+        timeout = None
+        if self.durability == 'interval' and self.durable < self.written:
+            timeout = max(0.0, self._last_sync + self.sync_interval - monotonic())
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except Empty:
+            return None
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self.durable = self.written
+        self.syncs += 1
+        if self.metrics is not None:
+            self.metrics.inc('chat_log_syncs_total')
+        self._last_sync = monotonic()
+
+    def _fail(self, error: Exception, lost: int):
+        self.errors += 1
+        self.failed += lost
+        self.last_error = f"{type(error).__name__}: {error}"
+        self._last_sync = monotonic()  # a failing fsync is retried after the interval, not in a tight loop
+        print(f"Chat log failed to write {lost} message(s): {self.last_error}", file=sys.stderr)
+        if self.metrics is not None:
+            self.metrics.inc('chat_log_errors_total')
+
+    def _write(self, batch: List[Any]):
+        lines = []
+        for message in batch:
+            try:
+                lines.append(json.dumps(message) + '\n')
+            except (TypeError, ValueError) as error:
+                self._fail(error, 1)  # one odd message should not cost the rest of the batch
+        try:
+            self._file.write(''.join(lines))
+            self._file.flush()
+        except Exception as error:
+            self._fail(error, len(lines))
+            return
+        self.written += len(lines)
+        self.batches += 1
+        if self.metrics is not None:
+            self.metrics.inc('chat_log_written_total', len(lines))
+            self.metrics.observe('chat_log_batch_messages', len(lines))
+            self.metrics.set('chat_log_backlog', self.appended - self.written - self.failed)
+        if self.durability == 'batch' or (self.durability == 'interval' and monotonic() - self._last_sync >= self.sync_interval):
+            self._sync()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch is not None and batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            # Like the block builder: an error is logged and counted, and the writer keeps going
+            try:
+                if batch is None:
+                    self._sync()  # Idle with unsynced messages and the interval is up.
+                elif batch:
+                    self._write(batch)
+                if stop and self.durability != 'none' and self.durable < self.written:
+                    self._sync()
+            except Exception as error:
+                self._fail(error, 0)  # an fsync failed; the messages are written, just not durable yet
+            if stop:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'durability': self.durability,
+            'appended': self.appended,
+            'written': self.written,
+            'durable': self.durable,
+            'batches': self.batches,
+            'syncs': self.syncs,
+            'failed': self.failed,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'messages_per_batch': self.written / self.batches if self.batches else 0.0,
+        }
+
+    def close(self):
+        """Write out everything still queued and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._writer.join()
+        self._file.close()
+
+    def __enter__(self) -> 'ChatLog':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,115 @@
+"""
+Length-prefixed wire protocol for the chat server and client.
+
+Every record on the wire is a frame:
+
+    [length: u32 big-endian][type: u8][payload: length - 1 bytes]
+
+The payload is UTF-8 text; invalid bytes decode to U+FFFD instead of raising,
+so one garbled frame can't kill a reader thread. Several frames can be coalesced into a single
+write, and readers parse frames out of one reusable buffer, so a long message
+is never split and two pipelined messages are never glued together.
+"""
+
+from struct import Struct
+from typing import Iterable, List, Optional, Tuple
+
+HEADER = Struct('>IB')
+JOIN = 1     # payload: username
+MESSAGE = 2  # payload: chat text (client -> server) or display line (server -> client)
+EXIT = 3     # payload: empty
+FRAME_TYPES = (JOIN, MESSAGE, EXIT)
+MAX_FRAME_SIZE = 1024 * 1024
+RECEIVE_BUFFER_SIZE = 64 * 1024
+
+Frame = Tuple[int, str]
+
+class ProtocolError(ValueError):
+    pass
+
+def encode_frame(frame_type: int, payload: str = '') -> bytes:
+    """Encode one frame; ProtocolError if it is bigger than any reader will accept."""
+    data = payload.encode('utf-8')
+    if len(data) + 1 > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame too large ({len(data) + 1} bytes, limit {MAX_FRAME_SIZE})")
+    return HEADER.pack(len(data) + 1, frame_type) + data
+
+def encode_frames(frames: Iterable[Frame]) -> bytes:
+    """Encode several frames into one buffer so they go out in a single write."""
+    return b''.join(encode_frame(frame_type, payload) for frame_type, payload in frames)
+
+class FrameDecoder:
+    """Incremental frame parser over a single growing-then-compacted buffer."""
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        self.start = 0
+
+    def feed(self, data: bytes) -> List[Frame]:
+        """Add received bytes and return every frame that is now complete."""
+        self.buffer += data
+        frames = []
+        buffer, start, end = self.buffer, self.start, len(self.buffer)
+        while end - start >= HEADER.size:
+            length, frame_type = HEADER.unpack_from(buffer, start)
+            if length < 1 or length > self.max_frame_size or frame_type not in FRAME_TYPES:
+                raise ProtocolError(f"Bad frame header (length={length}, type={frame_type})")
+            frame_end = start + 4 + length
+            if frame_end > end:
+                break
+            frames.append((frame_type, buffer[start + HEADER.size:frame_end].decode('utf-8', errors='replace')))
+            start = frame_end
+        if start == end:
+            del buffer[:]
+            start = 0
+        elif start > RECEIVE_BUFFER_SIZE:
+            del buffer[:start]
+            start = 0
+        self.start = start
+        return frames
+
+class FrameSocket:
+    """Blocking socket wrapper: receives into a reusable buffer and batches sends."""
+
+    def __init__(self, sock, buffer_size: int = RECEIVE_BUFFER_SIZE):
+        self.sock = sock
+        self.decoder = FrameDecoder()
+        self.receive_buffer = bytearray(buffer_size)
+        self.receive_view = memoryview(self.receive_buffer)
+        self.pending: List[bytes] = []
+        self.ready: List[Frame] = []
+
+    def receive_frames(self) -> Optional[List[Frame]]:
+        """Block until at least one frame arrives; None once the peer hangs up."""
+        while True:
+            count = self.sock.recv_into(self.receive_view)
+            if not count:
+                return None
+            frames = self.decoder.feed(self.receive_view[:count])
+            if frames:
+                return frames
+
+    def receive_frame(self) -> Optional[Frame]:
+        """Return the next frame, or None once the peer hangs up."""
+        if not self.ready:
+            frames = self.receive_frames()
+            if frames is None:
+                return None
+            self.ready = frames[::-1]
+        return self.ready.pop()
+
+    def queue(self, frame_type: int, payload: str = ''):
+        """Queue a frame to go out with the next flush()."""
+        self.pending.append(encode_frame(frame_type, payload))
+
+    def flush(self):
+        """Send every queued frame with one sendall()."""
+        if self.pending:
+            data = b''.join(self.pending)
+            self.pending = []
+            self.sock.sendall(data)
+
+    def send(self, frame_type: int, payload: str = ''):
+        self.queue(frame_type, payload)
+        self.flush()
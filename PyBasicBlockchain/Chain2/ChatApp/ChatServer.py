@@ -1,16 +1,29 @@
+import argparse  # For picking the server mode from the command line. Choices, choices!
+import atexit    # To make sure the last scribbles reach the diary when we shut down.
+import asyncio   # One event loop juggling thousands of guests, no thread per guest needed.
 import socket  # We need sockets for chatting, like the post office of the internet!
 import json    # JSON is our way of sending messages in a format that everyone understands.
 import os      # For checking if files exist and making directories. Like a digital handyman!
 import random  # To generate random file names. Who doesn't like randomness?
 import string  # For creating those random names with letters and numbers. No emojis here, sadly!
-from threading import Thread  # To let multiple people chat at the same time. It's like multitasking for our chat server!
+from threading import Lock, Thread  # To let multiple people chat at the same time. It's like multitasking for our chat server!
 from time import time  # To add timestamps to our messages, so we know who was late to the party.
+from BlockBuilder import DEFAULT_MAX_DELAY, DEFAULT_MAX_MESSAGES, BlockBuilder  # Cuts chat messages into blocks in the background.
+from BlockStore import BlockStore  # Keeps the mined chat chain on disk.
+from PayloadArchive import PayloadArchive  # Compressed cold storage for old blocks' messages.
+from Metrics import DEPTH_BUCKETS, JsonLinesSink, Metrics, PrometheusTextSink  # Counters and timings, if anyone asks for them.
+from ChatLog import DEFAULT_DURABILITY, DEFAULT_SYNC_INTERVAL, DURABILITY_MODES, ChatLog  # One writer thread that saves messages in batches.
+from PyBasicBlockchain2 import DifficultyRetarget, MessageBlock, MessagingBlockchain, difficulty_target  # The chain our chat gets mined into.
+from ChatProtocol import EXIT, JOIN, MESSAGE, RECEIVE_BUFFER_SIZE, FrameDecoder, FrameSocket, ProtocolError, encode_frame  # Our envelope format: length, type, payload.
 
 # Server configuration
 SERVER_HOST = 'localhost'  # Where our server lives. It's on your computer, not in the cloud!
 SERVER_PORT = 5000         # The door number to our server. Knock here to chat!
+OUTBOUND_QUEUE_SIZE = 1024 # How many messages a guest may fall behind before we show them the door (async mode).
 BLOCKCHAIN_DIR = 'Blockchain_Tables'  # Directory where we keep our chat history. Like a digital attic.
 CHAT_FILE = os.path.join(BLOCKCHAIN_DIR, 'Chatblockchain.json')  # File where we'll save the chat. It's like a diary, but less embarrassing.
+CHAIN_DIR = os.path.join(BLOCKCHAIN_DIR, 'chain')  # Where the mined chat blocks live. The real blockchain in our blockchain chat!
+ARCHIVE_DIR = os.path.join(BLOCKCHAIN_DIR, 'archive')  # Where pruned blocks' messages go to cool off.
 
 # Ensure the Blockchain_Tables directory exists
 os.makedirs(BLOCKCHAIN_DIR, exist_ok=True)  # Create the directory if it doesn't exist. Because who likes errors?
@@ -25,56 +38,145 @@ if os.path.exists(CHAT_FILE):
     # If the file already exists, make a new file with a random name. No one wants a file collision!
     CHAT_FILE = os.path.join(BLOCKCHAIN_DIR, generate_random_filename())
 
+metrics = None  # The party's scoreboard. Only kept when asked for, so it costs nothing otherwise.
+
+def open_metrics(prometheus_file=None, jsonl_file=None, interval=10.0):
+    # Keep score of messages, queues and mining, and write it out every `interval` seconds.
+    global metrics
+    if metrics is None:
+        sinks = []
+        if prometheus_file:
+            sinks.append(PrometheusTextSink(prometheus_file))
+        if jsonl_file:
+            sinks.append(JsonLinesSink(jsonl_file))
+        metrics = Metrics(sinks, buckets={name: DEPTH_BUCKETS for name in ('chat_outbound_queue_depth', 'chat_log_batch_messages', 'block_messages')})
+        metrics.flush_every(interval)
+        atexit.register(metrics.close)  # One last write on the way out.
+    return metrics
+
+chat_log = None  # The diary's scribe. Opened when the server starts.
+
+def open_chat_log(durability=DEFAULT_DURABILITY, sync_interval=DEFAULT_SYNC_INTERVAL):
+    # Hire a single scribe for every guest's messages. It writes them down in batches.
+    global chat_log
+    if chat_log is None:
+        chat_log = ChatLog(CHAT_FILE, durability, sync_interval, metrics=metrics)
+        atexit.register(chat_log.close)  # Write out whatever is still queued when we shut down.
+    return chat_log
+
+block_builder = None  # The miner. Opened when the server starts.
+
+def open_block_builder(max_messages=DEFAULT_MAX_MESSAGES, max_delay=DEFAULT_MAX_DELAY, difficulty=None, mining_workers=1, mining_profile=None,
+                       keep_blocks=None, cache_blocks=None, block_interval=None):
+    # Load (or start) the chat chain and put a miner to work on it in the background.
+    global block_builder
+    if block_builder is None:
+        archive = PayloadArchive(ARCHIVE_DIR) if keep_blocks is not None else None  # Only old messages go to the archive, and only if asked.
+        store = BlockStore(CHAIN_DIR, MessageBlock)
+        retarget = None
+        if block_interval is not None:  # Let the chain tune its own difficulty to hit the block time we asked for.
+            # Blocks already on disk keep the targets they were mined at, so the schedule starts with the next block.
+            # It starts from --difficulty if given, or else carries on at the target of the newest block.
+            tip = store[len(store) - 1] if len(store) else None
+            if difficulty is not None or tip is None or tip.target is None:
+                initial_target = difficulty_target(4 if difficulty is None else difficulty)
+            else:
+                initial_target = tip.target
+            retarget = DifficultyRetarget(block_interval, initial_target=initial_target, start_height=max(len(store), 1))
+        blockchain = MessagingBlockchain(store=store, metrics=metrics, archive=archive, keep_blocks=keep_blocks,
+                                         cache_blocks=cache_blocks, retarget=retarget)  # With cache_blocks, only the hottest blocks stay in memory.
+        if difficulty is not None:
+            blockchain.difficulty = difficulty
+        blockchain.mining_workers = mining_workers
+        blockchain.mining_profile = mining_profile  # cProfile every block into this file, if set.
+        block_builder = BlockBuilder(blockchain, max_messages, max_delay, metrics=metrics)
+        atexit.register(block_builder.close)  # Mine the leftovers before we shut down.
+    return block_builder
+
 def save_message_to_file(message):
-    # Save the message to the file. Think of it as scribbling on a notepad.
-    with open(CHAT_FILE, 'a') as file:
-        file.write(json.dumps(message) + '\n')  # Write the message to the file in JSON format.
+    # Hand the message to the scribe. It does the writing, so nobody waits on the disk.
+    chat_log.append(message)
+    if block_builder is not None:
+        block_builder.add(message)  # And to the miner's queue. It cuts a block when enough piles up.
 
 def handle_client(client_socket, address):
     # Handle incoming chat from each client. It's like being the host of a digital party.
     print(f"Connection from {address}")  # Announce who’s joining the party!
 
-    username = client_socket.recv(1024).decode('utf-8')  # Get the username. It’s like checking the guest list.
+    connection = FrameSocket(client_socket)  # Unwraps whole frames, however TCP chops them up.
+    try:
+        frame = connection.receive_frame()  # The first frame must be a JOIN with the username. It’s like checking the guest list.
+    except (OSError, ProtocolError):
+        frame = None
+    if frame is None or frame[0] != JOIN:
+        forget_client(client_socket)  # No name, no entry!
+        return
+    username = frame[1]
     welcome_message = f"{username} has joined the chat."  # Create a welcome message. Everyone loves a warm welcome!
     broadcast(welcome_message, client_socket)  # Announce the new guest to everyone else.
 
     while True:
         try:
-            message = client_socket.recv(1024).decode('utf-8')  # Receive a message from the client. Like opening a letter.
-            if message:
-                if message.lower() == 'exit':
-                    # Handle the case where someone wants to leave the party. We need to say goodbye!
-                    goodbye_message = f"{username} has left the chat."
-                    broadcast(goodbye_message, client_socket)
-                    break
+            frame = connection.receive_frame()  # Receive the next frame from the client. Like opening a letter.
+            if frame is None:
+                break  # The client hung up. They're probably done chatting.
+            frame_type, message = frame
+            if frame_type == EXIT or message.lower() == 'exit':
+                # Handle the case where someone wants to leave the party. We need to say goodbye!
+                goodbye_message = f"{username} has left the chat."
+                broadcast(goodbye_message, client_socket)
+                break
+            if frame_type != MESSAGE:
+                continue  # A second JOIN? We already know who you are.
 
-                message_to_save = {
-                    'username': username,
-                    'message': message,
-                    'timestamp': time()  # Add a timestamp to the message. Because time flies when you're having fun!
-                }
-                save_message_to_file(message_to_save)  # Save the message to our digital diary.
+            message_to_save = {
+                'username': username,
+                'message': message,
+                'timestamp': time()  # Add a timestamp to the message. Because time flies when you're having fun!
+            }
+            save_message_to_file(message_to_save)  # Save the message to our digital diary.
+            if metrics is not None:
+                metrics.inc('chat_messages_received_total')
 
-                broadcast(f"{username}: {message}", client_socket)  # Broadcast the message to everyone else.
-            else:
-                break  # If no message, break out of the loop. The client is probably done chatting.
+            broadcast(f"{username}: {message}", client_socket)  # Broadcast the message to everyone else.
         except:
             break  # Handle exceptions. Because sometimes, things go wrong and we need to break out.
 
-    client_socket.close()  # Close the connection. The party's over for this guest.
+    forget_client(client_socket)  # Close the connection. The party's over for this guest.
+
+def forget_client(client_socket):
+    # Take the guest off the list and close their connection.
+    with clients_lock:
+        if client_socket in clients:
+            clients.remove(client_socket)
+        send_locks.pop(client_socket, None)
+        if metrics is not None:
+            metrics.set('chat_clients', len(clients))
+    client_socket.close()
 
 def broadcast(message, client_socket):
     # Send the message to all clients except the sender. It’s like announcing news to everyone at the party.
-    for client in clients:
+    try:
+        frame = encode_frame(MESSAGE, message)  # Seal the message in an envelope once for everybody.
+    except ProtocolError:
+        if metrics is not None:
+            metrics.inc('chat_oversized_total')
+        return  # With the username in front it no longer fits in a frame. Better silence than a kicked guest.
+    with clients_lock:
+        recipients = [(client, send_locks[client]) for client in clients]  # Take a snapshot of the guest list so nobody edits it under our feet.
+    for client, send_lock in recipients:
         if client != client_socket:
             try:
-                client.send(message.encode('utf-8'))  # Send the message to the client. Time to spread the gossip!
+                with send_lock:  # One sender per socket at a time, so frames never get mixed up.
+                    client.sendall(frame)  # Send the message to the client. Time to spread the gossip!
+                if metrics is not None:
+                    metrics.inc('chat_frames_sent_total')
             except:
-                client.close()  # Close the connection if sending fails. Nobody likes a broken chat!
-                clients.remove(client)  # Remove the client from the list of active clients.
+                forget_client(client)  # Close the connection if sending fails. Nobody likes a broken chat!
 
-def start_server():
+def start_server(durability=DEFAULT_DURABILITY, sync_interval=DEFAULT_SYNC_INTERVAL):
     # Start the server. It’s like opening the doors to the chat party.
+    open_chat_log(durability, sync_interval)
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create a socket. This is the digital doorbell.
     server.bind((SERVER_HOST, SERVER_PORT))  # Bind the socket to the host and port. Like assigning a specific address.
     server.listen(5)  # Listen for incoming connections. We’re ready for guests!
@@ -82,11 +184,171 @@ def start_server():
 
     while True:
         client_socket, client_address = server.accept()  # Accept a new client. Welcome them to the party!
-        clients.append(client_socket)  # Add the new client to the list of active clients.
+        with clients_lock:
+            clients.append(client_socket)  # Add the new client to the list of active clients.
+            send_locks[client_socket] = Lock()
+            if metrics is not None:
+                metrics.set('chat_clients', len(clients))
         client_handler = Thread(target=handle_client, args=(client_socket, client_address))  # Handle each client in a new thread.
         client_handler.start()  # Start the thread. Time for some multitasking!
 
+class AsyncChatServer:
+    # The same chat party, hosted by a single asyncio event loop. Every guest gets a bounded
+    # outbound queue and a writer task, so broadcasting never waits on any one socket. A guest
+    # whose queue fills up is too slow to keep up and gets disconnected.
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, queue_size=OUTBOUND_QUEUE_SIZE, chat_log=None, block_builder=None, metrics=None):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.chat_log = chat_log  # Optional scribe (see ChatLog.py). Without one, messages aren't saved.
+        self.block_builder = block_builder  # Optional miner (see BlockBuilder.py).
+        self.clients = {}  # StreamWriter -> outbound queue. The async guest list!
+        self.slow_disconnects = 0  # How many guests we kicked out for not keeping up.
+        self.metrics = metrics  # Optional scoreboard (see Metrics.py).
+        self.server = None
+
+    async def start(self):
+        # Open the doors. With port 0 the OS picks a free port, which we remember.
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        print(f"Async server listening on {self.host}:{self.port}...")
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        print(f"Connection from {writer.get_extra_info('peername')}")
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.clients[writer] = queue
+        if self.metrics is not None:
+            self.metrics.set('chat_clients', len(self.clients))
+        sender = asyncio.create_task(self.send_loop(writer, queue))
+        try:
+            username = None
+            async for frame_type, message in self.read_frames(reader):
+                if username is None:
+                    if frame_type != JOIN:
+                        break  # No name, no entry!
+                    username = message
+                    self.broadcast(f"{username} has joined the chat.", writer)
+                    continue
+                if frame_type == EXIT or message.lower() == 'exit':
+                    self.broadcast(f"{username} has left the chat.", writer)
+                    break
+                if frame_type == MESSAGE:
+                    if self.metrics is not None:
+                        self.metrics.inc('chat_messages_received_total')
+                    self.save_message({'username': username, 'message': message, 'timestamp': time()})
+                    self.broadcast(f"{username}: {message}", writer)
+                if writer not in self.clients:
+                    break  # We got dropped for being too slow.
+        except (ConnectionError, ProtocolError):
+            pass  # A broken connection ends the party for this guest, nobody else.
+        finally:
+            self.disconnect(writer)
+            sender.cancel()
+
+    def save_message(self, message):
+        # Like save_message_to_file, but with this server's own scribe and miner.
+        if self.chat_log is not None:
+            self.chat_log.append(message)
+        if self.block_builder is not None:
+            self.block_builder.add(message)
+
+    @staticmethod
+    async def read_frames(reader):
+        # Yield whole frames as they arrive, parsed out of one reusable buffer.
+        decoder = FrameDecoder()
+        while True:
+            data = await reader.read(RECEIVE_BUFFER_SIZE)
+            if not data:
+                return
+            for frame in decoder.feed(data):
+                yield frame
+
+    def broadcast(self, message, sender_writer):
+        # Queue the message for every other guest. Never blocks, never touches a socket.
+        try:
+            data = encode_frame(MESSAGE, message)
+        except ProtocolError:
+            if self.metrics is not None:
+                self.metrics.inc('chat_oversized_total')
+            return  # Too big to relay once the username is in front.
+        for writer, queue in list(self.clients.items()):
+            if writer is sender_writer:
+                continue
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                self.slow_disconnects += 1
+                self.disconnect(writer)  # Too slow to keep up; don't let them hold up the party.
+                if self.metrics is not None:
+                    self.metrics.inc('chat_slow_disconnects_total')
+                continue
+            if self.metrics is not None:
+                self.metrics.inc('chat_frames_queued_total')
+                self.metrics.observe('chat_outbound_queue_depth', queue.qsize())  # How far behind this guest is.
+
+    async def send_loop(self, writer, queue):
+        # Each guest's own mail carrier: waits on that guest's socket only.
+        try:
+            while True:
+                chunks = [await queue.get()]
+                while not queue.empty():
+                    chunks.append(queue.get_nowait())  # Grab every frame that piled up and send them in one go.
+                writer.write(b''.join(chunks))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.disconnect(writer)
+
+    def disconnect(self, writer):
+        if self.clients.pop(writer, None) is not None:
+            writer.close()
+            if self.metrics is not None:
+                self.metrics.set('chat_clients', len(self.clients))
+
+def start_async_server(host=SERVER_HOST, port=SERVER_PORT, queue_size=OUTBOUND_QUEUE_SIZE,
+                       durability=DEFAULT_DURABILITY, sync_interval=DEFAULT_SYNC_INTERVAL):
+    server = AsyncChatServer(host, port, queue_size, chat_log=open_chat_log(durability, sync_interval), block_builder=block_builder, metrics=metrics)
+    asyncio.run(server.serve_forever())
+
 clients = []  # List of active clients. Our guest list!
+clients_lock = Lock()  # Only one thread gets to edit the guest list at a time.
+send_locks = {}  # Client socket -> lock, so two threads never write to one socket at once.
 
 if __name__ == "__main__":
-    start_server()  # Start the server if this file is run directly. Time to kick off the party!
+    parser = argparse.ArgumentParser(description='Blockchain chat server.')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Serve every client from one asyncio event loop')
+    parser.add_argument('--queue-size', type=int, default=OUTBOUND_QUEUE_SIZE, help='Messages a client may lag behind before it is dropped (async mode)')
+    parser.add_argument('--durability', choices=DURABILITY_MODES, default=DEFAULT_DURABILITY, help='When saved messages are fsynced: every batch, every --sync-interval seconds, or never')
+    parser.add_argument('--sync-interval', type=float, default=DEFAULT_SYNC_INTERVAL, help='Seconds between fsyncs with --durability interval')
+    parser.add_argument('--no-mining', action='store_true', help='Only log messages; do not mine them into the chat chain')
+    parser.add_argument('--block-messages', type=int, default=DEFAULT_MAX_MESSAGES, help='Cut a block once this many messages are waiting')
+    parser.add_argument('--block-seconds', type=float, default=DEFAULT_MAX_DELAY, help='Cut a block once the oldest waiting message is this old')
+    parser.add_argument('--difficulty', type=int, help='Proof-of-work difficulty of chat blocks (the starting point with --block-interval)')
+    parser.add_argument('--block-interval', type=float, help='Retarget the difficulty every few blocks to mine one block about every this many seconds')
+    parser.add_argument('--mining-workers', type=int, default=1, help='Processes used to mine each block')
+    parser.add_argument('--metrics-file', help='Write Prometheus text metrics to this file (e.g. for the node_exporter textfile collector)')
+    parser.add_argument('--metrics-jsonl', help='Append a JSON snapshot of the metrics to this file')
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help='Seconds between metric writes')
+    parser.add_argument('--profile-mining', help='cProfile each mined block into this file')
+    parser.add_argument('--keep-blocks', type=int, help='Keep messages in memory for only the newest this many blocks; older ones are archived')
+    parser.add_argument('--cache-blocks', type=int, help='Load chat blocks from disk as needed, keeping this many in memory')
+    args = parser.parse_args()
+    if args.metrics_file or args.metrics_jsonl:
+        open_metrics(args.metrics_file, args.metrics_jsonl, args.metrics_interval)  # Before the scribe and the miner, so they report too.
+    if not args.no_mining:
+        atexit.register(lambda: print(json.dumps(block_builder.stats())))  # Say how the mining went, once the leftovers are mined.
+        open_block_builder(args.block_messages, args.block_seconds, args.difficulty, args.mining_workers, args.profile_mining, args.keep_blocks, args.cache_blocks,
+                           args.block_interval)
+    if args.use_async:
+        start_async_server(queue_size=args.queue_size, durability=args.durability, sync_interval=args.sync_interval)  # One loop to rule them all!
+    else:
+        start_server(args.durability, args.sync_interval)  # Start the server if this file is run directly. Time to kick off the party!
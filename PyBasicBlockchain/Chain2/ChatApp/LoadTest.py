@@ -0,0 +1,134 @@
+import argparse  # For tuning how big a crowd we throw at the server.
+import asyncio   # Thousands of fake chatters, one event loop.
+import json      # The report comes out as JSON so runs can be compared.
+import multiprocessing  # The server gets its own process so it doesn't share a CPU core with the crowd.
+import os        # For silencing the spawned server's chatter.
+import re        # For fishing our stamped messages out of the byte stream.
+import sys       # For pointing the server's prints at the void.
+from time import perf_counter, time  # Stopwatches for throughput and latency.
+
+import ChatServer  # The server under test.
+from ChatProtocol import JOIN, MESSAGE, FrameDecoder, encode_frame  # The framed wire protocol.
+
+STAMP = re.compile(r'lt (\d+) (\d+) (\d+\.\d+);')  # "lt <client> <seq> <sent at>;" inside every load-test message.
+
+def run_server(port, queue_size, ready):
+    """Run an AsyncChatServer in this (child) process and report its port."""
+    sys.stdout = open(os.devnull, 'w')  # Thousands of "Connection from" lines help nobody.
+    async def main():
+        server = ChatServer.AsyncChatServer('127.0.0.1', port, queue_size)  # No chat log or miner: just the broadcast path.
+        await server.start()
+        ready.put(server.port)
+        await server.serve_forever()
+    asyncio.run(main())
+
+def percentile(values, fraction):
+    """The value below which `fraction` of the sorted values fall."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def chatter(client_id, host, port, args, started, latencies, counters):
+    """One fake user: join, wait for everyone, send messages, and time every delivery."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_frame(JOIN, f'loadtest-{client_id}'))
+    await writer.drain()
+
+    async def receive():
+        decoder = FrameDecoder()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            now = time()
+            for _, text in decoder.feed(data):
+                match = STAMP.search(text)
+                if match:
+                    latencies.append(now - float(match.group(3)))
+                    counters['delivered'] += 1
+
+    receiver = asyncio.create_task(receive())
+    await started.wait()
+    for seq in range(args.messages):
+        writer.write(encode_frame(MESSAGE, f'lt {client_id} {seq} {time():.6f};'))
+        await writer.drain()
+        counters['sent'] += 1
+        await asyncio.sleep(args.interval)
+    await asyncio.sleep(args.settle)
+    receiver.cancel()
+    writer.close()
+
+async def run_load(host, port, args):
+    """Connect every client, start them together and collect the numbers."""
+    started = asyncio.Event()
+    latencies = []
+    counters = {'sent': 0, 'delivered': 0}
+    tasks = []
+    for client_id in range(args.clients):
+        tasks.append(asyncio.create_task(chatter(client_id, host, port, args, started, latencies, counters)))
+        if client_id % 100 == 99:
+            await asyncio.sleep(0.05)  # Don't flood the listen backlog all at once.
+    await asyncio.sleep(args.warmup)
+    begin = perf_counter()
+    started.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = perf_counter() - begin - args.settle
+    expected = counters['sent'] * (args.clients - 1)
+    return {
+        'clients': args.clients,
+        'messages_per_client': args.messages,
+        'sent': counters['sent'],
+        'delivered': counters['delivered'],
+        'expected_deliveries': expected,
+        'delivery_ratio': counters['delivered'] / expected if expected else None,
+        'seconds': elapsed,
+        'sent_per_second': counters['sent'] / elapsed,
+        'delivered_per_second': counters['delivered'] / elapsed,
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+
+def spawn_server(queue_size):
+    """Start an AsyncChatServer in a child process; return the process and its port."""
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_server, args=(0, queue_size, ready), daemon=True)
+    server.start()
+    return server, ready.get(timeout=10)
+
+def load_test(args):
+    """Run one load test against --port, or against a freshly spawned server."""
+    server = None
+    port = args.port
+    if not port:
+        server, port = spawn_server(args.queue_size)
+    try:
+        return asyncio.run(run_load(args.host, port, args))
+    finally:
+        if server is not None:
+            server.terminate()
+
+def add_arguments(parser):
+    parser.add_argument('--clients', type=int, default=200, help='How many chatters to connect')
+    parser.add_argument('--messages', type=int, default=5, help='Messages each chatter sends')
+    parser.add_argument('--interval', type=float, default=0.05, help='Seconds between a chatter\'s messages')
+    parser.add_argument('--warmup', type=float, default=1.0, help='Seconds to wait for every join to land')
+    parser.add_argument('--settle', type=float, default=1.0, help='Seconds to keep listening after the last send')
+    parser.add_argument('--queue-size', type=int, default=ChatServer.OUTBOUND_QUEUE_SIZE, help='Outbound queue size of the spawned server')
+    parser.add_argument('--host', default='127.0.0.1', help='Server to test (with --port); default spawns an async server')
+    parser.add_argument('--port', type=int, default=0, help='Port of an already running server')
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the chat server with many local clients.')
+    add_arguments(parser)
+    parser.add_argument('--output', help='Also write the report to this JSON file')
+    args = parser.parse_args()
+
+    report = load_test(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+if __name__ == '__main__':
+    main()
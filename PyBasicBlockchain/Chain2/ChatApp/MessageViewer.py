@@ -4,10 +4,41 @@ import random
 import sys
 import argparse
 import time
+from datetime import datetime
 from termcolor import colored
 
 # Colors for terminal output
 COLORS = ['red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white']
+POLL_INTERVAL = 0.25  # Seconds between checks for new lines in --follow mode
+
+def iter_messages(file_path, follow=False, poll_interval=POLL_INTERVAL):
+    """Yield messages from the JSON-lines file one at a time, optionally waiting for new ones."""
+    with open(file_path, 'r') as file:
+        partial = ''  # Text of a line the server has not finished writing yet
+        while True:
+            line = file.readline()
+            if not line:
+                if not follow:
+                    break
+                if os.path.getsize(file_path) < file.tell():
+                    # The file was truncated; start over from the top
+                    file.seek(0)
+                    partial = ''
+                time.sleep(poll_interval)
+                continue
+            if not line.endswith('\n'):
+                if follow:
+                    partial += line  # Wait for the rest of the line
+                    continue
+            line, partial = partial + line, ''
+            if not line.strip():
+                continue
+            try:
+                # Attempt to parse each line of the file as JSON
+                yield json.loads(line.strip())
+            except json.JSONDecodeError:
+                # Print an error message if JSON decoding fails
+                print(f"Error decoding JSON: {line.strip()}")
 
 def load_messages(file_path):
     """Load messages from the specified JSON file."""
@@ -15,53 +46,81 @@ def load_messages(file_path):
         # Check if the file exists at the given path
         print(f"File not found: {file_path}")
         sys.exit()  # Exit the program if the file is not found
+    return list(iter_messages(file_path))
 
-    messages = []  # List to hold all messages
-    with open(file_path, 'r') as file:
-        # Open the file in read mode
-        for line in file:
-            try:
-                # Attempt to parse each line of the file as JSON
-                messages.append(json.loads(line.strip()))
-            except json.JSONDecodeError:
-                # Print an error message if JSON decoding fails
-                print(f"Error decoding JSON: {line.strip()}")
-    return messages
+def filter_messages(messages, since=None, until=None, users=None):
+    """Keep messages inside [since, until] that were sent by one of `users`."""
+    for msg in messages:
+        timestamp = msg.get('timestamp', 0)
+        if since is not None and timestamp < since:
+            continue
+        if until is not None and timestamp > until:
+            continue
+        if users and msg.get('username') not in users:
+            continue
+        yield msg
+
+class UserColors:
+    """Assign a unique color to each user the first time they show up."""
+
+    def __init__(self):
+        self.user_colors = {}  # Dictionary to hold user-color pairs
+        self.available_colors = COLORS.copy()  # Copy of the COLORS list to shuffle and use
+        random.shuffle(self.available_colors)  # Shuffle colors to ensure randomness
+
+    def get(self, user):
+        if user not in self.user_colors:
+            if self.available_colors:
+                # Assign a unique color if available
+                self.user_colors[user] = self.available_colors.pop()
+            else:
+                # Reuse colors if we run out
+                self.user_colors[user] = random.choice(COLORS)
+        return self.user_colors[user]
 
 def assign_colors(users):
     """Assign a unique color to each user."""
-    user_colors = {}  # Dictionary to hold user-color pairs
-    available_colors = COLORS.copy()  # Copy of the COLORS list to shuffle and use
-    random.shuffle(available_colors)  # Shuffle colors to ensure randomness
-
+    user_colors = UserColors()
     for user in set(users):
-        # Iterate over unique users
-        if available_colors:
-            # Assign a unique color if available
-            user_colors[user] = available_colors.pop()
-        else:
-            # Reuse colors if we run out
-            user_colors[user] = random.choice(COLORS)
-
-    return user_colors
-
-def display_messages(messages, user_colors):
-    """Display messages with unique colors for each user."""
+        user_colors.get(user)
+    return user_colors.user_colors
+
+def display_messages(messages, user_colors, delay=0.0):
+    """Display messages with unique colors for each user, as they arrive."""
+    shown = 0
     for msg in messages:
         username = msg['username']  # Extract the username from the message
         message = msg['message']    # Extract the message text
         timestamp = msg['timestamp']  # Extract the timestamp
 
-        color = user_colors.get(username, 'white')  # Get the color for the user, default to 'white'
+        color = user_colors.get(username)  # Get (or pick) the color for the user
         formatted_message = f"[{timestamp:<18}] {username:<13} : {message}"  # Format the message for display
-        time.sleep(0.2)  # Pause for a short duration to simulate real-time message flow
-        print(colored(formatted_message, color))  # Print the message with the assigned color
+        if delay:
+            time.sleep(delay)  # Optional pause to simulate real-time message flow
+        print(colored(formatted_message, color), flush=True)  # Print the message with the assigned color
+        shown += 1
+    return shown
+
+def parse_time(value):
+    """Accept a Unix timestamp or an ISO date/time such as 2024-05-01T12:00."""
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Not a timestamp or ISO date: {value}") from None
 
 def main():
     parser = argparse.ArgumentParser(description='Display messages from a JSON file.')
     # Create an argument parser for command-line arguments
     parser.add_argument('file', type=str, help='Path to the JSON file containing chat messages')
     # Add an argument for the file path
+    parser.add_argument('-f', '--follow', action='store_true', help='Keep watching the file and show new messages as they are written')
+    parser.add_argument('--since', type=parse_time, help='Only show messages at or after this time (Unix timestamp or ISO date)')
+    parser.add_argument('--until', type=parse_time, help='Only show messages at or before this time (Unix timestamp or ISO date)')
+    parser.add_argument('--user', action='append', help='Only show messages from this user (repeatable)')
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to pause between messages (default: no pause)')
     args = parser.parse_args()  # Parse the command-line arguments
 
     file_path = args.file  # Get the file path from the arguments
@@ -71,16 +130,16 @@ def main():
         print(f"Message file does not exist: {file_path}")
         return  # Exit if the file does not exist
 
-    messages = load_messages(file_path)  # Load messages from the file
-
-    if not messages:
-        print("No messages to display.")
-        return  # Exit if there are no messages
+    messages = iter_messages(file_path, follow=args.follow)  # Read messages lazily from the file
+    messages = filter_messages(messages, args.since, args.until, set(args.user or ()))
 
-    users = [msg['username'] for msg in messages]  # Extract usernames from messages
-    user_colors = assign_colors(users)  # Assign colors to users
+    try:
+        shown = display_messages(messages, UserColors(), args.delay)  # Display the messages with colors
+    except KeyboardInterrupt:
+        return  # Stop following quietly on Ctrl+C
 
-    display_messages(messages, user_colors)  # Display the messages with colors
+    if not shown:
+        print("No messages to display.")
 
 if __name__ == "__main__":
     main()  # Execute the main function if the script is run directly
@@ -0,0 +1,108 @@
+"""
+Regression tests for the chat server's helpers. Run from this folder with `python -m pytest`.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from BlockBuilder import BlockBuilder
+from ChatLog import ChatLog
+from ChatProtocol import EXIT, JOIN, MAX_FRAME_SIZE, MESSAGE, FrameDecoder, ProtocolError, encode_frame, encode_frames
+from Metrics import Metrics
+from PyBasicBlockchain2 import MessagingBlockchain
+
+def histogram(metrics: Metrics, name: str) -> dict:
+    return next(entry for entry in metrics.snapshot()["histograms"] if entry["name"] == name)
+
+def test_block_builder_queue_is_bounded_and_counts_what_was_mined():
+    blockchain = MessagingBlockchain()
+    blockchain.difficulty = 1
+    metrics = Metrics()
+    builder = BlockBuilder(blockchain, max_messages=100, max_delay=60, metrics=metrics, max_pending=2)
+    hello = {"username": "alice", "message": "hello", "timestamp": 1.0}
+    assert builder.add(hello)
+    assert builder.add(dict(hello))  # the same line again: the chain mempool turns it away
+    assert not builder.add({"username": "bob", "message": "hi", "timestamp": 2.0})  # the queue is full
+    builder.close()
+    assert builder.stats()["messages_dropped"] == 2
+    assert builder.messages_mined == 1
+    assert histogram(metrics, "block_messages")["sum"] == 1
+
+def test_chat_log_writer_survives_a_bad_batch():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "chat.json")
+        log = ChatLog(path, durability="batch")
+        log.append({"username": "alice", "message": object(), "timestamp": 1.0})  # not JSON
+        log.append({"username": "alice", "message": "hi", "timestamp": 2.0})
+        log.close()
+        with open(path, encoding="utf-8") as file:
+            assert [json.loads(line)["message"] for line in file] == ["hi"]
+        assert (log.failed, log.errors) == (1, 1)
+
+def test_chat_log_counts_appends_from_every_thread():
+    with tempfile.TemporaryDirectory() as directory:
+        log = ChatLog(os.path.join(directory, "chat.json"), durability="none")
+        def chat(user):
+            for number in range(500):
+                log.append({"username": user, "message": str(number), "timestamp": float(number)})
+        threads = [threading.Thread(target=chat, args=(f"user{n}",)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.close()
+        assert log.appended == log.written == 8 * 500
+
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.mark.parametrize("durability, sync_interval, synced_before_close", [
+    ("batch", 60.0, True),     # every batch is synced as soon as it is written
+    ("interval", 0.05, True),  # the idle writer syncs once the interval is up
+    ("interval", 60.0, False), # nothing synced until close
+    ("none", 0.05, False),     # never synced, not even on close
+])
+def test_chat_log_durability_modes(durability, sync_interval, synced_before_close):
+    with tempfile.TemporaryDirectory() as directory:
+        with pytest.raises(ValueError):
+            ChatLog(os.path.join(directory, "chat.json"), durability="sometimes")
+        log = ChatLog(os.path.join(directory, "chat.json"), durability=durability, sync_interval=sync_interval)
+        for number in range(3):
+            log.append({"username": "alice", "message": str(number), "timestamp": float(number)})
+        assert wait_until(lambda: log.written == 3)
+        assert wait_until(lambda: log.durable == 3, timeout=0.5) == synced_before_close
+        log.close()
+        assert log.durable == (0 if durability == "none" else 3)
+        assert (log.syncs == 0) == (durability == "none")
+
+def test_frame_decoder_splits_pipelined_frames_and_joins_split_ones():
+    frames = [(JOIN, "alice"), (MESSAGE, "hello, wörld"), (MESSAGE, ""), (EXIT, "")]
+    data = encode_frames(frames)
+    assert FrameDecoder().feed(data) == frames  # several frames in one read
+    decoder, received = FrameDecoder(), []
+    for offset in range(len(data)):
+        received += decoder.feed(data[offset:offset + 1])  # and one byte at a time
+    assert received == frames and decoder.buffer == bytearray()
+    assert FrameDecoder().feed(encode_frame(MESSAGE) + b"\x00\x00\x00\x03\x02\xff\xfe") == [(MESSAGE, ""), (MESSAGE, "\ufffd\ufffd")]  # bad UTF-8 is replaced, not raised
+
+def test_frame_decoder_rejects_a_bad_header():
+    with pytest.raises(ProtocolError):
+        FrameDecoder().feed(b"\x00\x00\x00\x02\x09x")  # no such frame type
+    with pytest.raises(ProtocolError):
+        FrameDecoder(max_frame_size=4).feed(encode_frame(MESSAGE, "too long"))
+
+def test_a_frame_too_large_to_read_is_refused_when_encoding():
+    payload = "x" * (MAX_FRAME_SIZE - 1)
+    assert FrameDecoder().feed(encode_frame(MESSAGE, payload)) == [(MESSAGE, payload)]
+    with pytest.raises(ProtocolError):
+        encode_frame(MESSAGE, payload + "x")
@@ -0,0 +1,199 @@
+"""
+Opt-in counters, gauges and histograms with pluggable sinks.
+
+The blockchain classes and the chat server take an optional `metrics` object
+and only ever call three methods on it:
+
+    metrics.inc(name, amount=1, **labels)
+    metrics.set(name, value, **labels)
+    metrics.observe(name, value, **labels)
+
+With `metrics=None` (the default) every hook is a single `is None` check.
+`Metrics.flush()` hands a snapshot to each sink: `InMemorySink`,
+`PrometheusTextSink` (text exposition format, rewritten atomically, e.g. for
+node_exporter's textfile collector) or `JsonLinesSink` (one line per flush).
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+def _label_text(labels: Sequence[Tuple[str, str]], extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{label}="{value}"' for label, value in pairs) + '}'
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+class Metrics:
+    def __init__(self, sinks: Sequence[Any] = (), buckets: Optional[Dict[str, Sequence[float]]] = None):
+        self.sinks = list(sinks)
+        self.buckets = dict(buckets or {})
+        self.counters: Dict[Key, float] = {}
+        self.gauges: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, name: str, **labels) -> Iterator[None]:
+        """Observe how long the block takes, in seconds."""
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'time': time(),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self.counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self.gauges.items())],
+                'histograms': [dict(histogram.snapshot(), name=name, labels=dict(labels)) for (name, labels), histogram in sorted(self.histograms.items())],
+            }
+
+    def prometheus_text(self) -> str:
+        lines = []
+        typed = set()
+
+        def declare(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name, 'counter')
+                lines.append(f'{name}{_label_text(labels)} {value}')
+            for (name, labels), value in sorted(self.gauges.items()):
+                declare(name, 'gauge')
+                lines.append(f'{name}{_label_text(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                declare(name, 'histogram')
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_label_text(labels, [("le", str(bound))])} {cumulative}')
+                lines.append(f'{name}_sum{_label_text(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{_label_text(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        """Hand the current values to every sink."""
+        for sink in self.sinks:
+            sink.write(self)
+
+    def flush_every(self, interval: float):
+        """Flush from a background thread every `interval` seconds until close()."""
+        def run():
+            while not self._stop.wait(interval):
+                self.flush()
+        self._flusher = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+        self._flusher.start()
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+class InMemorySink:
+    def __init__(self, keep: int = 100):
+        self.keep = keep
+        self.snapshots: List[Dict[str, Any]] = []
+
+    def write(self, metrics: Metrics):
+        self.snapshots.append(metrics.snapshot())
+        del self.snapshots[:-self.keep]
+
+class PrometheusTextSink:
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, metrics: Metrics):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            file.write(metrics.prometheus_text())
+        os.replace(temporary, self.path)
+
+class JsonLinesSink:
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, metrics: Metrics):
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(metrics.snapshot()) + '\n')
+
+@contextmanager
+def profiled(path: Optional[str] = None, top: int = 25) -> Iterator[cProfile.Profile]:
+    """cProfile the block; dump stats to `path` (for snakeviz / pstats) or print the top entries."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if path:
+            profile.dump_stats(path)
+        else:
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(top)
@@ -0,0 +1,95 @@
+"""
+Compressed cold storage for pruned block payloads.
+
+When a blockchain prunes a block, its payload (the list of transactions or
+messages) is appended here as zlib-compressed JSON, one record per block
+height, in a BlockStore (segment files plus a height index). The block keeps
+only its header and Merkle root and reads the payload back on demand through
+a small LRU cache, so memory stays bounded however long the chain gets.
+"""
+
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from BlockStore import DEFAULT_SEGMENT_SIZE, BlockStore
+
+DEFAULT_CACHE_SIZE = 64
+DEFAULT_LEVEL = 6
+
+class PayloadArchive:
+    def __init__(self, path: str, cache_size: int = DEFAULT_CACHE_SIZE, level: int = DEFAULT_LEVEL,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE, sync: bool = False):
+        """Open (or create) the archive in `path`; keep up to `cache_size` payloads in memory."""
+        self.level = level
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[int, List[Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.raw_bytes = 0         # JSON bytes archived since opening
+        self.compressed_bytes = 0  # what they took on disk
+        self.hits = 0
+        self.misses = 0
+        self.store = BlockStore(path, None, segment_size, encode=self._encode, decode=self._decode, sync=sync)
+
+    def _encode(self, payload: List[Dict[str, Any]]) -> bytes:
+        data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        compressed = zlib.compress(data, self.level)
+        self.raw_bytes += len(data)
+        self.compressed_bytes += len(compressed)
+        return compressed
+
+    def _decode(self, data: bytes) -> List[Dict[str, Any]]:
+        return json.loads(zlib.decompress(data))
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def append(self, payload: List[Dict[str, Any]]) -> int:
+        """Archive `payload` and return its position (the block height when pruning in order)."""
+        return self.store.append(payload)
+
+    def read(self, position: int, check: Optional[Callable[[List[Dict[str, Any]]], bool]] = None) -> List[Dict[str, Any]]:
+        """The payload at `position`. On a cache miss it is loaded and must pass `check`, if given."""
+        with self._lock:
+            payload = self._cache.get(position)
+            if payload is not None:
+                self._cache.move_to_end(position)
+                self.hits += 1
+                return payload
+            self.misses += 1
+        payload = self.store.read(position)
+        if check is not None and not check(payload):
+            raise IOError(f"Archived payload {position} does not match its block in {self.store.path}")
+        with self._lock:
+            self._cache[position] = payload
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return payload
+
+    def truncate(self, length: int):
+        """Drop every payload at position `length` and above."""
+        with self._lock:
+            for position in [position for position in self._cache if position >= length]:
+                del self._cache[position]
+        self.store.truncate(length)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'payloads': len(self),
+            'raw_bytes': self.raw_bytes,
+            'compressed_bytes': self.compressed_bytes,
+            'compression_ratio': self.raw_bytes / self.compressed_bytes if self.compressed_bytes else None,
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+        }
+
+    def close(self):
+        self.store.close()
+
+    def __enter__(self) -> 'PayloadArchive':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,48 +1,1002 @@
+import cProfile
 import hashlib
+import heapq
+from bisect import bisect_left, bisect_right
 import json
-from time import time
-from typing import List, Dict, Any
+import math
+import queue
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Value
+from time import perf_counter, time
+from typing import Callable, Iterator, List, Dict, Any, Optional, Tuple
+
+MINING_CHUNK_SIZE = 4096
+HASH_VERSION_LEGACY = 1
+HASH_VERSION_HEADER = 2
+HASH_VERSION_TARGET = 3  # the header also carries the block's target
+MEMPOOL_MAX_COUNT = 100_000
+MEMPOOL_MAX_BYTES = 64 * 1024 * 1024
+MEMPOOL_SKIP_LIMIT = 64  # stop filling a block after this many entries in a row did not fit
+MEMPOOL_COMPACT_SLACK = 1024
+BLOCK_MAX_MESSAGES = 5000
+BLOCK_MAX_BYTES = 1024 * 1024
+CHAIN_PREFETCH = 64  # blocks a lazy chain reads ahead of a sequential scan
+MAX_TARGET = 2 ** 256 - 1
+RETARGET_WINDOW = 10
+RETARGET_MAX_ADJUST = 4.0  # largest factor a single retarget may change the target by
+_best_nonce = None
+
+def _init_miner(best_nonce):
+    global _best_nonce
+    _best_nonce = best_nonce
+
+def _search_nonces(block: 'MessageBlock', required: str, start: int, worker: int, workers: int) -> Tuple[Optional[int], int]:
+    hash_nonce = block.nonce_hasher()
+    attempts = 0
+    chunk_start = start + worker * MINING_CHUNK_SIZE
+    while chunk_start < _best_nonce.value:
+        for nonce in range(chunk_start, chunk_start + MINING_CHUNK_SIZE):
+            attempts += 1
+            if hash_nonce(nonce) <= required:
+                with _best_nonce.get_lock():
+                    if nonce < _best_nonce.value:
+                        _best_nonce.value = nonce
+                return nonce, attempts
+        chunk_start += workers * MINING_CHUNK_SIZE
+    return None, attempts
+
+def _timed_query(metrics: Any, name: str, method: Callable) -> Callable:
+    def timed(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.observe("query_seconds", perf_counter() - started, query=name)
+    return timed
+
+def _check_block(block: 'MessageBlock') -> Optional[str]:
+    if block.hash != block.compute_hash():
+        return "hash mismatch"
+    # Pruned payloads were checked before archiving and are checked again whenever they are loaded
+    if type(block.messages) is ArchivedPayload:
+        return None
+    if not block.has_valid_merkle_root():
+        return "merkle root mismatch"
+    return None
+
+def entry_bytes(entry: Dict[str, Any]) -> bytes:
+    return json.dumps(entry if type(entry) is dict else dict(entry), sort_keys=True).encode()
+
+def hash_entry(entry: Dict[str, Any]) -> str:
+    # Leaves and branches use different tags so a leaf can never pose as a branch.
+    return hashlib.sha256(b'\x00' + entry_bytes(entry)).hexdigest()
+
+def is_timestamp(value: Any) -> bool:
+    # A real number that sorts: no strings, bools or NaN
+    return type(value) in (int, float) and value == value
+
+def message_time(message: Dict[str, Any], block: "MessageBlock") -> float:
+    # When a message counts as sent for time queries; the block's time if it carries no usable timestamp
+    timestamp = message.get("timestamp")
+    return timestamp if is_timestamp(timestamp) else block.timestamp
+
+def message_priority(message: Dict[str, Any], size: int) -> float:
+    # Messages are mined first come, first served unless they carry a "priority"
+    return message.get("priority", 0) if type(message) is dict else 0
+
+def difficulty_target(difficulty: int) -> int:
+    """The numeric target equivalent to requiring `difficulty` leading hex zeros."""
+    return MAX_TARGET >> (4 * difficulty)
+
+def target_hex(target: int) -> str:
+    # Hex digests are fixed-width, so string comparison against this is numeric comparison
+    return format(target, "064x")
+
+def difficulty_bits(target: int) -> float:
+    return 256 - math.log2(target + 1)
+
+def _hash_pair(left: str, right: str) -> str:
+    return hashlib.sha256(b'\x01' + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+def _merkle_levels(entries: List[Dict[str, Any]]) -> List[List[str]]:
+    levels = [[hash_entry(entry) for entry in entries]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [_hash_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+def compute_merkle_root(entries: List[Dict[str, Any]]) -> str:
+    if not entries:
+        return hashlib.sha256(b'').hexdigest()
+    return _merkle_levels(entries)[-1][0]
+
+def build_merkle_proof(entries: List[Dict[str, Any]], position: int) -> List[Tuple[str, str]]:
+    if not 0 <= position < len(entries):
+        raise IndexError(f"No entry at position {position}")
+    proof = []
+    for level in _merkle_levels(entries)[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append(('L' if sibling < position else 'R', level[sibling]))
+        position //= 2
+    return proof
+
+def verify_merkle_proof(entry: Dict[str, Any], proof: List[Tuple[str, str]], merkle_root: str) -> bool:
+    current = hash_entry(entry)
+    for side, sibling in proof:
+        current = _hash_pair(sibling, current) if side == 'L' else _hash_pair(current, sibling)
+    return current == merkle_root
+
+_address_ids: Dict[str, int] = {}
+_addresses: List[str] = []
+
+def intern_address(address: str) -> int:
+    address_id = _address_ids.get(address)
+    if address_id is None:
+        address_id = _address_ids[address] = len(_addresses)
+        _addresses.append(sys.intern(address))
+    return address_id
+
+def plain_entries(entries: Sequence) -> List[Dict[str, Any]]:
+    if type(entries) is list and all(type(entry) is dict for entry in entries):
+        return entries
+    return [dict(entry) for entry in entries]
+
+class MessageRow(MutableMapping):
+    # Dict-like view of one message stored in a MessageColumns.
+    __slots__ = ("_columns", "_position")
+
+    def __init__(self, columns: 'MessageColumns', position: int):
+        self._columns = columns
+        self._position = position
+
+    def __getitem__(self, key: str) -> Any:
+        return self._columns.get_field(self._position, key)
+
+    def __setitem__(self, key: str, value: Any):
+        self._columns.set_field(self._position, key, value)
+
+    def __delitem__(self, key: str):
+        raise TypeError("Fields of a compact message can't be deleted")
+
+    def __iter__(self):
+        return iter(MessageColumns.FIELDS)
+
+    def __len__(self) -> int:
+        return len(MessageColumns.FIELDS)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+class MessageColumns(Sequence):
+    # Column-oriented message payload: interned address ids, contents and timestamps.
+    FIELDS = ("sender", "recipient", "content", "timestamp")
+    __slots__ = ("senders", "recipients", "contents", "timestamps")
+
+    @classmethod
+    def pack(cls, entries: Sequence) -> Sequence:
+        # Only messages with exactly the standard fields are packed; anything else is
+        # returned unchanged so callers never lose data.
+        if isinstance(entries, cls):
+            return entries
+        fields = set(cls.FIELDS)
+        for entry in entries:
+            if not isinstance(entry, Mapping) or entry.keys() != fields or type(entry["sender"]) is not str or type(entry["recipient"]) is not str:
+                return entries
+        columns = cls.__new__(cls)
+        columns.senders = array("I", [intern_address(entry["sender"]) for entry in entries])
+        columns.recipients = array("I", [intern_address(entry["recipient"]) for entry in entries])
+        columns.contents = [entry["content"] for entry in entries]
+        timestamps = [entry["timestamp"] for entry in entries]
+        columns.timestamps = array("d", timestamps) if all(type(timestamp) is float for timestamp in timestamps) else timestamps
+        return columns
+
+    def get_field(self, position: int, key: str) -> Any:
+        if key == "sender":
+            return _addresses[self.senders[position]]
+        if key == "recipient":
+            return _addresses[self.recipients[position]]
+        if key == "content":
+            return self.contents[position]
+        if key == "timestamp":
+            return self.timestamps[position]
+        raise KeyError(key)
+
+    def set_field(self, position: int, key: str, value: Any):
+        if key in ("sender", "recipient"):
+            if type(value) is not str:
+                raise TypeError(f"{key} of a compact message must be a string")
+            (self.senders if key == "sender" else self.recipients)[position] = intern_address(value)
+        elif key == "content":
+            self.contents[position] = value
+        elif key == "timestamp":
+            if type(self.timestamps) is array and type(value) is not float:
+                self.timestamps = list(self.timestamps)
+            self.timestamps[position] = value
+        else:
+            raise KeyError(key)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [MessageRow(self, i) for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("message index out of range")
+        return MessageRow(self, position)
+
+    def __len__(self) -> int:
+        return len(self.senders)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Sequence) and len(self) == len(other) and all(row == entry for row, entry in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(plain_entries(self))
+
+    def __reduce__(self):
+        # Address ids are process-local, so pickles carry plain dicts and re-pack on load.
+        return (MessageColumns.pack, (plain_entries(self),))
+
+class ArchivedPayload(Sequence):
+    """The messages of a pruned block, read back from a PayloadArchive on access."""
+    __slots__ = ("archive", "position", "count", "merkle_root")
+
+    def __init__(self, archive: Any, position: int, count: int, merkle_root: str):
+        self.archive = archive  # None once pickled into another process
+        self.position = position
+        self.count = count
+        self.merkle_root = merkle_root
+
+    def load(self) -> List[Dict[str, Any]]:
+        if self.archive is None:
+            raise LookupError("This pruned payload is detached from its archive")
+        return self.archive.read(self.position, self._matches)
+
+    def _matches(self, entries: List[Dict[str, Any]]) -> bool:
+        return len(entries) == self.count and compute_merkle_root(entries) == self.merkle_root
+
+    def __getitem__(self, position):
+        return self.load()[position]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Sequence) and len(self) == len(other) and all(entry == other_entry for entry, other_entry in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"ArchivedPayload(position={self.position}, count={self.count})"
+
+    def __reduce__(self):
+        # Validation workers only need the header of a pruned block, so do not ship the payload
+        return (ArchivedPayload, (None, self.position, self.count, self.merkle_root))
 
 class MessageBlock:
-    def __init__(self, index: int, timestamp: float, messages: List[Dict[str, Any]], previous_hash: str):
+    PAYLOAD_FIELD = "messages"
+    __slots__ = ("index", "timestamp", "messages", "previous_hash", "nonce", "version", "target", "merkle_root", "hash")
+
+    def __init__(self, index: int, timestamp: float, messages: List[Dict[str, Any]], previous_hash: str, version: int = HASH_VERSION_TARGET,
+                 target: Optional[int] = None):
         self.index = index
         self.timestamp = timestamp
         self.messages = messages
         self.previous_hash = previous_hash
         self.nonce = 0
+        self.version = version
+        self.target = target if version >= HASH_VERSION_TARGET else None
+        self.merkle_root = compute_merkle_root(messages)
         self.hash = self.compute_hash()  # Compute the initial hash
 
-    def compute_hash(self) -> str:
-        block_string = json.dumps(self.__dict__, sort_keys=True)
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "timestamp": self.timestamp,
+            "messages": plain_entries(self.messages),
+            "previous_hash": self.previous_hash,
+            "nonce": self.nonce,
+            "version": self.version,
+            "target": self.target,
+            "merkle_root": self.merkle_root,
+            "hash": self.hash
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'MessageBlock':
+        # Bypasses __init__ so the stored hash is kept as-is; is_chain_valid re-checks it.
+        block = cls.__new__(cls)
+        block.index = data["index"]
+        block.timestamp = data["timestamp"]
+        block.messages = data["messages"]
+        block.previous_hash = data["previous_hash"]
+        block.nonce = data["nonce"]
+        block.version = data.get("version", HASH_VERSION_LEGACY)
+        block.target = data.get("target") if block.version >= HASH_VERSION_TARGET else None  # only a hashed target counts
+        block.merkle_root = data.get("merkle_root") or compute_merkle_root(block.messages)
+        block.hash = data["hash"]
+        return block
+
+    def has_valid_merkle_root(self) -> bool:
+        return self.merkle_root == compute_merkle_root(self.messages)
+
+    def get_inclusion_proof(self, position: int) -> List[Tuple[str, str]]:
+        return build_merkle_proof(self.messages, position)
+
+    def header_prefix(self) -> bytes:
+        # Header fields up to (not including) the nonce; serialized once per mining run.
+        if self.version < HASH_VERSION_TARGET:
+            return f"{self.version}|{self.index}|{self.timestamp!r}|{self.previous_hash}|{self.merkle_root}|".encode()
+        target = "" if self.target is None else format(self.target, "x")
+        return f"{self.version}|{self.index}|{self.timestamp!r}|{self.previous_hash}|{target}|{self.merkle_root}|".encode()
+
+    def compute_legacy_hash(self) -> str:
+        block_string = json.dumps({
+            "index": self.index,
+            "timestamp": self.timestamp,
+            "messages": plain_entries(self.messages),
+            "previous_hash": self.previous_hash,
+            "nonce": self.nonce
+        }, sort_keys=True)
         return hashlib.sha256(block_string.encode()).hexdigest()
 
-    def mine_block(self, difficulty: int):
-        required_prefix = '0' * difficulty
-        while not self.hash.startswith(required_prefix):
-            self.nonce += 1
-            self.hash = self.compute_hash()
+    def nonce_hasher(self) -> Callable[[int], str]:
+        if self.version == HASH_VERSION_LEGACY:
+            def hash_legacy(nonce: int) -> str:
+                self.nonce = nonce
+                return self.compute_legacy_hash()
+            return hash_legacy
+        midstate = hashlib.sha256(self.header_prefix())
+        def hash_header(nonce: int) -> str:
+            attempt = midstate.copy()
+            attempt.update(str(nonce).encode())
+            return attempt.hexdigest()
+        return hash_header
 
-class MessagingBlockchain:
+    def compute_hash(self) -> str:
+        return self.nonce_hasher()(self.nonce)
+
+    def mining_target(self, difficulty: int, target: Optional[int] = None) -> int:
+        # An explicit target wins, then the block's own, then the one for `difficulty` hex zeros
+        if target is not None:
+            return target
+        return difficulty_target(difficulty) if self.target is None else self.target
+
+    def mine_block(self, difficulty: int, workers: int = 1, target: Optional[int] = None) -> int:
+        """Find a nonce whose hash is <= `target` (by default, the block's own target)."""
+        if workers > 1:
+            return self.mine_block_parallel(difficulty, workers, target)
+        required = target_hex(self.mining_target(difficulty, target))
+        hash_nonce = self.nonce_hasher()
+        nonce = self.nonce
+        block_hash = hash_nonce(nonce)
+        attempts = 1
+        while block_hash > required:
+            nonce += 1
+            block_hash = hash_nonce(nonce)
+            attempts += 1
+        self.nonce = nonce
+        self.hash = block_hash
+        return attempts
+
+    def mine_block_parallel(self, difficulty: int, workers: int, target: Optional[int] = None) -> int:
+        # Every worker scans its own chunks; the lowest winning nonce is kept so the
+        # result matches what the serial loop would have found.
+        required = target_hex(self.mining_target(difficulty, target))
+        best_nonce = Value('q', 2 ** 63 - 1)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_miner, initargs=(best_nonce,)) as pool:
+            futures = [pool.submit(_search_nonces, self, required, self.nonce, worker, workers) for worker in range(workers)]
+            results = [future.result() for future in futures]
+        self.nonce = min(nonce for nonce, _ in results if nonce is not None)
+        self.hash = self.compute_hash()
+        return sum(attempts for _, attempts in results)
+
+Posting = Tuple[int, int]  # (block index, position of the message inside the block)
+
+class Postings:
+    # One user's messages in chain order, as parallel arrays rather than a tuple per message
+    __slots__ = ("blocks", "positions")
+
+    def __init__(self):
+        self.blocks = array('q')
+        self.positions = array('q')
+
+    def add(self, block: int, position: int):
+        self.blocks.append(block)
+        self.positions.append(position)
+
+    def slots(self, start: int, stop: int) -> List[Posting]:
+        return list(zip(self.blocks[start:stop], self.positions[start:stop]))
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+class MessageIndex:
+    def __init__(self):
+        self.sent: Dict[str, Postings] = {}
+        self.received: Dict[str, Postings] = {}
+
+    def apply_block(self, block: MessageBlock):
+        for position, message in enumerate(block.messages):
+            self._postings(self.sent, message['sender']).add(block.index, position)
+            self._postings(self.received, message['recipient']).add(block.index, position)
+
+    @staticmethod
+    def _postings(users: Dict[str, Postings], user: str) -> Postings:
+        postings = users.get(user)
+        if postings is None:
+            postings = users[user] = Postings()
+        return postings
+
+    def rebuild(self, chain: List[MessageBlock]):
+        self.sent = {}
+        self.received = {}
+        for block in chain:
+            self.apply_block(block)
+
+    @staticmethod
+    def page(postings: Optional[Postings], limit: Optional[int] = None, offset: int = 0, newest_first: bool = False) -> List[Posting]:
+        # Postings are appended in chain order, so newest-first is just a reversed slice.
+        if postings is None:
+            return []
+        if newest_first:
+            stop = max(len(postings) - offset, 0)
+            start = 0 if limit is None else max(stop - limit, 0)
+            return postings.slots(start, stop)[::-1]
+        return postings.slots(offset, len(postings) if limit is None else offset + limit)
+
+class TimestampIndex:
+    # Parallel arrays sorted by timestamp; appends are O(1) while clocks move forward.
     def __init__(self):
+        self.times = array('d')
+        self.blocks = array('q')
+        self.positions = array('q')
+
+    def add(self, timestamp: float, block: int, position: int = 0):
+        if not self.times or timestamp >= self.times[-1]:
+            self.times.append(timestamp)
+            self.blocks.append(block)
+            self.positions.append(position)
+        else:
+            slot = bisect_right(self.times, timestamp)
+            self.times.insert(slot, timestamp)
+            self.blocks.insert(slot, block)
+            self.positions.insert(slot, position)
+
+    def span(self, start: Optional[float] = None, end: Optional[float] = None) -> range:
+        # Slots with start <= timestamp < end
+        low = 0 if start is None else bisect_left(self.times, start)
+        high = len(self.times) if end is None else bisect_left(self.times, end)
+        return range(low, max(low, high))
+
+    def between(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Posting]:
+        for slot in self.span(start, end):
+            yield self.blocks[slot], self.positions[slot]
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+class Mempool:
+    def __init__(self, max_count: int = MEMPOOL_MAX_COUNT, max_bytes: int = MEMPOOL_MAX_BYTES, priority: Optional[Callable[[Dict[str, Any], int], float]] = None):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.priority = priority or message_priority
+        self.entries: Dict[str, list] = {}  # hash -> [priority, arrival, hash, message, size]
+        self.bytes = 0
+        self._best: List[Tuple[float, int, str]] = []  # negated, so the best message is on top
+        self._worst: List[Tuple[float, int, str]] = []  # the first to be evicted is on top
+        self._arrivals = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def add(self, message: Dict[str, Any]) -> bool:
+        """Queue `message`; False if it is already waiting, has no numeric priority, or ranks too low to fit."""
+        if type(message) is not dict:
+            message = dict(message)  # rows from compact blocks (e.g. after a reorg) go back in as plain dicts
+        data = entry_bytes(message)
+        key = hashlib.sha256(b'\x00' + data).hexdigest()  # same key as hash_entry
+        if key in self.entries:
+            self.duplicates += 1
+            return False
+        size = len(data)
+        # Rank it before touching any state: a priority that is not a number would break the heaps halfway through
+        try:
+            priority = float(self.priority(message, size))
+        except (TypeError, ValueError):
+            priority = math.nan
+        if math.isnan(priority):
+            self.rejected += 1
+            return False
+        victims: List[list] = []
+        freed = 0
+        while len(self.entries) - len(victims) >= self.max_count or self.bytes - freed + size > self.max_bytes:
+            worst = self._pop_worst()
+            if worst is None or worst[0] >= priority:
+                for record in ([worst] if worst else []) + victims:
+                    heapq.heappush(self._worst, (record[0], -record[1], record[2]))
+                self.rejected += 1
+                return False
+            victims.append(worst)
+            freed += worst[4]
+        for record in victims:
+            self._drop(record[2])
+        self.evicted += len(victims)
+        self._arrivals += 1
+        self.entries[key] = [priority, self._arrivals, key, message, size]
+        self.bytes += size
+        heapq.heappush(self._best, (-priority, self._arrivals, key))
+        heapq.heappush(self._worst, (priority, -self._arrivals, key))
+        return True
+
+    def _live(self, key: str, arrival: int) -> Optional[list]:
+        # Heaps keep stale items after a removal; only the item with the current arrival counts
+        record = self.entries.get(key)
+        return record if record is not None and record[1] == arrival else None
+
+    def _pop_worst(self) -> Optional[list]:
+        while self._worst:
+            _, arrival, key = heapq.heappop(self._worst)
+            record = self._live(key, -arrival)
+            if record is not None:
+                return record
+        return None
+
+    def _drop(self, key: str) -> Optional[Dict[str, Any]]:
+        record = self.entries.pop(key, None)
+        if record is None:
+            return None
+        self.bytes -= record[4]
+        if len(self._best) > 2 * len(self.entries) + MEMPOOL_COMPACT_SLACK:
+            self._compact()
+        return record[3]
+
+    def _compact(self):
+        self._best = [(-record[0], record[1], record[2]) for record in self.entries.values()]
+        self._worst = [(record[0], -record[1], record[2]) for record in self.entries.values()]
+        heapq.heapify(self._best)
+        heapq.heapify(self._worst)
+
+    def take(self, max_count: Optional[int] = None, max_bytes: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Remove and return the highest-priority messages that fit in `max_count` entries and `max_bytes` bytes."""
+        taken: List[Dict[str, Any]] = []
+        skipped: List[Tuple[float, int, str]] = []
+        used = 0
+        while self._best and (max_count is None or len(taken) < max_count) and len(skipped) < MEMPOOL_SKIP_LIMIT:
+            item = heapq.heappop(self._best)
+            record = self._live(item[2], item[1])
+            if record is None:
+                continue
+            if max_bytes is not None and used + record[4] > max_bytes:
+                skipped.append(item)  # doesn't fit what is left of the block; keep it for the next one
+                continue
+            used += record[4]
+            self.entries.pop(item[2])
+            self.bytes -= record[4]
+            taken.append(record[3])
+        for item in skipped:
+            heapq.heappush(self._best, item)
+        if len(self._worst) > 2 * len(self.entries) + MEMPOOL_COMPACT_SLACK:
+            self._compact()
+        return taken
+
+    def remove(self, message: Dict[str, Any]) -> bool:
+        """Forget `message` (e.g. because another node already mined it)."""
+        return self._drop(hash_entry(message)) is not None
+
+    def clear(self):
+        self.entries = {}
+        self.bytes = 0
+        self._best = []
+        self._worst = []
+
+    def __contains__(self, message: Dict[str, Any]) -> bool:
+        return hash_entry(message) in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for record in self.entries.values():
+            yield record[3]
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self.entries), "bytes": self.bytes, "duplicates": self.duplicates, "rejected": self.rejected, "evicted": self.evicted}
+
+class PendingEntries(list):
+    """A snapshot of the mempool. Appending to it queues the entry in the mempool too; any other edit raises."""
+    __slots__ = ("_add",)
+
+    def __init__(self, entries: Iterator[Dict[str, Any]], add: Callable[[Dict[str, Any]], bool]):
+        super().__init__(entries)
+        self._add = add
+
+    def append(self, entry: Dict[str, Any]):
+        if self._add(entry):
+            super().append(entry)
+
+    def extend(self, entries: Iterator[Dict[str, Any]]):
+        for entry in entries:
+            self.append(entry)
+
+    def __iadd__(self, entries: Iterator[Dict[str, Any]]) -> "PendingEntries":
+        self.extend(entries)
+        return self
+
+    def _read_only(self, *args, **kwargs):
+        # Changing a copy would look like it worked while the mempool stayed as it was
+        raise TypeError("Pending entries are a snapshot of the mempool; assign a new list or use the mempool to change them")
+
+    insert = remove = pop = clear = sort = reverse = __setitem__ = __delitem__ = __imul__ = _read_only
+
+class DifficultyRetarget:
+    """Moves the mining target every `window` blocks so blocks arrive about every `block_interval` seconds."""
+
+    def __init__(self, block_interval: float, window: int = RETARGET_WINDOW, initial_target: int = difficulty_target(4),
+                 max_adjust: float = RETARGET_MAX_ADJUST, start_height: int = 1):
+        self.block_interval = block_interval
+        self.window = window
+        self.initial_target = initial_target
+        self.max_adjust = max_adjust
+        self.start_height = start_height  # blocks below this keep whatever target they were mined at
+
+    def period(self, height: int) -> int:
+        # The first `window` blocks from start_height (and everything before) are period 0
+        return max(height - self.start_height, 0) // self.window
+
+    def known_periods(self, height: int) -> int:
+        # How many period targets depend only on blocks up to `height`
+        return max(height - self.start_height + 1, 0) // self.window + 1
+
+    def next_target(self, target: int, elapsed: float) -> int:
+        """The target after a period whose `window` blocks took `elapsed` seconds under `target`."""
+        # `window` random block times give a biased rate (the mean of window / elapsed is window / (window - 1)
+        # times the true one), so aim at window - 1 intervals to keep the average block time on target
+        expected = max(self.window - 1, 1) * self.block_interval
+        elapsed = min(max(elapsed, expected / self.max_adjust), expected * self.max_adjust)
+        # Integer microseconds keep this exact, so every node computes the same target
+        return max(1, min(MAX_TARGET, target * round(elapsed * 1e6) // round(expected * 1e6)))
+
+    def target_at(self, height: int, timestamp_of: Callable[[int], float], targets: List[int]) -> int:
+        """Target of the block at `height`. `timestamp_of(h)` is block h's timestamp; `targets` caches one target per period."""
+        if not targets:
+            targets.append(self.initial_target)
+        while len(targets) <= self.period(height):
+            start = (len(targets) - 1) * self.window + self.start_height - 1
+            elapsed = timestamp_of(start + self.window) - timestamp_of(start)
+            targets.append(self.next_target(targets[-1], elapsed))
+        return targets[self.period(height)]
+
+    def expected_target(self, height: int, previous_target: Optional[int], timestamp_of: Callable[[int], float], targets: List[int]) -> int:
+        """The target the block at `height` must carry, given the target stored in the block before it."""
+        if previous_target is None or height <= self.start_height:
+            # The first retargeted block, or one that follows blocks stored without a target
+            return self.target_at(height, timestamp_of, targets)
+        if (height - self.start_height) % self.window:
+            return previous_target
+        elapsed = timestamp_of(height - 1) - timestamp_of(height - 1 - self.window)
+        return self.next_target(previous_target, elapsed)
+
+class ChainView(Sequence):
+    """The chain as a sequence whose blocks are loaded from `source` on access and kept in a bounded LRU cache."""
+
+    def __init__(self, source: Any, cache_size: int, length: Optional[int] = None,
+                 prepare: Optional[Callable[[MessageBlock], None]] = None, prefetch: int = CHAIN_PREFETCH):
+        self.source = source  # anything with source[height], e.g. a BlockStore
+        self.cache_size = cache_size
+        self.prepare = prepare  # applied to every block freshly loaded from the source
+        self.prefetch = prefetch
+        self._length = len(source) if length is None else length
+        self._cache: "OrderedDict[int, MessageBlock]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _load(self, height: int) -> MessageBlock:
+        block = self.source[height]
+        if self.prepare is not None:
+            self.prepare(block)
+        return block
+
+    def _cached(self, height: int) -> Optional[MessageBlock]:
+        with self._lock:
+            block = self._cache.get(height)
+            if block is None:
+                self.misses += 1
+            else:
+                self._cache.move_to_end(height)
+                self.hits += 1
+            return block
+
+    def _remember(self, height: int, block: MessageBlock):
+        with self._lock:
+            self._cache[height] = block
+            self._cache.move_to_end(height)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[i] for i in range(*height.indices(len(self)))]
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError("block index out of range")
+        block = self._cached(height)
+        if block is None:
+            block = self._load(height)
+            self._remember(height, block)
+        return block
+
+    def append(self, block: MessageBlock):
+        # The owning blockchain has already written the block to the source
+        self._remember(self._length, block)
+        self._length += 1
+
+    def __delitem__(self, index):
+        start, stop, step = index.indices(len(self)) if isinstance(index, slice) else (None, None, None)
+        if start is None or stop != len(self) or step != 1:
+            raise TypeError("A ChainView can only drop blocks from the end")
+        with self._lock:
+            for height in [height for height in self._cache if height >= start]:
+                del self._cache[height]
+        self._length = min(self._length, start)
+
+    def __iter__(self) -> Iterator[MessageBlock]:
+        return self.scan()
+
+    def scan(self, start: int = 0, stop: Optional[int] = None) -> Iterator[MessageBlock]:
+        """Blocks [start, stop) in order, with a helper thread reading up to `prefetch` blocks ahead."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if self.prefetch <= 0 or stop - start < 2:
+            for height in range(start, stop):
+                yield self[height]
+            return
+        ahead: "queue.Queue" = queue.Queue(self.prefetch)
+        done = threading.Event()
+
+        def read_ahead():
+            for height in range(start, stop):
+                try:
+                    block = self._cached(height) or self._load(height)
+                except BaseException as error:  # re-raised in the scanning thread
+                    block = error
+                while not done.is_set():
+                    try:
+                        ahead.put((height, block), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if done.is_set() or isinstance(block, BaseException):
+                    return
+
+        helper = threading.Thread(target=read_ahead, name="chain-prefetch", daemon=True)
+        helper.start()
+        try:
+            for _ in range(start, stop):
+                height, block = ahead.get()
+                if isinstance(block, BaseException):
+                    raise block
+                self._remember(height, block)
+                yield block
+        finally:
+            done.set()  # stops the helper when the caller abandons the scan
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"length": len(self), "cached": len(self._cache), "cache_size": self.cache_size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+class MessagingBlockchain:
+    TIMED_QUERIES = ("get_message_proof", "get_user_messages", "get_sent_messages", "get_user_history")
+
+    def __init__(self, store: Optional[Any] = None, compact: bool = False, metrics: Optional[Any] = None,
+                 archive: Optional[Any] = None, keep_blocks: Optional[int] = None, keep_seconds: Optional[float] = None,
+                 cache_blocks: Optional[int] = None, retarget: Optional[DifficultyRetarget] = None):
         self.chain: List[MessageBlock] = []
-        self.pending_messages: List[Dict[str, Any]] = []
-        self.difficulty = 4
+        if cache_blocks is not None and store is not None:
+            # Keep only the most recently used blocks in memory; the rest are reread from the store.
+            # Sized from the store, so opening it decodes nothing until a block is asked for.
+            self.chain = ChainView(store, cache_blocks, prepare=self._prepare_loaded)
+        self.store = store
+        # Pruning: blocks older than both keep_blocks and keep_seconds move their messages to the archive
+        self.archive = archive
+        self.keep_blocks = keep_blocks
+        self.keep_seconds = keep_seconds
+        self.pruned_height = 0
+        self.compact = compact
+        self.mempool = Mempool()
+        self.max_block_messages = BLOCK_MAX_MESSAGES
+        self.max_block_bytes = BLOCK_MAX_BYTES
+        self.difficulty = 4  # leading hex zeros, used when retarget is None
+        self.retarget = retarget
+        self.targets: List[int] = []  # one per retarget period, computed as needed
         self.mining_reward = 1
-        self.create_genesis_block()
+        self.mining_workers = 1
+        self.last_mining_stats: Dict[str, float] = {}
+        self.verified_height = 0
+        self.verified_hash: Optional[str] = None
+        self.validation_error: Optional[str] = None
+        # Built on first use rather than on every start, then kept up to date as blocks arrive
+        self._message_index: Optional[MessageIndex] = None
+        self._block_times: Optional[TimestampIndex] = None
+        self._message_times: Optional[TimestampIndex] = None
+        self.set_metrics(metrics)
+        self.mining_profile: Optional[str] = None
+        if archive is not None and len(archive) > (len(store) if store is not None else 0):
+            archive.truncate(len(store) if store is not None else 0)  # left over from another chain
+        if store is not None and len(store):
+            self.load_from_store()
+        else:
+            self.create_genesis_block()
+
+    def set_metrics(self, metrics: Optional[Any]):
+        # Query timing wraps instance attributes, so lookups cost nothing extra while metrics are off
+        self.metrics = metrics
+        for name in self.TIMED_QUERIES:
+            if metrics is None:
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, _timed_query(metrics, name, getattr(type(self), name).__get__(self)))
 
     def create_genesis_block(self):
-        genesis_block = MessageBlock(0, time(), [], "0")
+        genesis_block = MessageBlock(0, time(), [], "0", target=self.target_at(0))
         genesis_block.mine_block(self.difficulty)
-        self.chain.append(genesis_block)
+        self.append_block(genesis_block)
+
+    def append_block(self, block: MessageBlock):
+        if self.store is not None:
+            self.store.append(block)
+        if self.compact:
+            block.messages = MessageColumns.pack(block.messages)
+        self.chain.append(block)
+        if self._message_index is not None:
+            self._message_index.apply_block(block)
+        if self._block_times is not None:
+            self._index_times(block)
+        if self.archive is not None:
+            self.prune()
+
+    def _prepare_loaded(self, block: MessageBlock):
+        if block.index < self.pruned_height and block.version >= HASH_VERSION_HEADER:
+            # The store still holds the full block; keep a reloaded pruned block pruned
+            block.messages = ArchivedPayload(self.archive, block.index, len(block.messages), block.merkle_root)
+        elif self.compact:
+            block.messages = MessageColumns.pack(block.messages)
+
+    def load_from_store(self):
+        if self.archive is not None:
+            self.pruned_height = len(self.archive)  # archived by a previous run; they reload as ArchivedPayload
+        if isinstance(self.chain, ChainView):
+            if self.archive is not None:
+                self.prune()  # only loads blocks that left the keep window since the last run
+            return
+        for block in self.store:
+            self._prepare_loaded(block)
+            self.chain.append(block)
+            if self.archive is not None:
+                self.prune()
+
+    def prune(self) -> int:
+        """Move the messages of blocks outside the keep window into self.archive; returns how many blocks were pruned."""
+        if self.archive is None or (self.keep_blocks is None and self.keep_seconds is None):
+            return 0
+        limit = len(self.chain)
+        if self.keep_blocks is not None:
+            limit -= self.keep_blocks
+        if self.keep_seconds is not None:
+            cutoff = time() - self.keep_seconds
+            height = self.pruned_height
+            while height < limit and self.chain[height].timestamp < cutoff:
+                height += 1
+            limit = height
+        pruned = 0
+        for height in range(self.pruned_height, limit):
+            block = self.chain[height]
+            if height == len(self.archive):  # a previous run may have archived it already
+                self.archive.append(plain_entries(block.messages))
+            # Legacy hashes cover the whole payload, so those blocks keep their messages
+            if block.version >= HASH_VERSION_HEADER:
+                block.messages = ArchivedPayload(self.archive, height, len(block.messages), block.merkle_root)
+                pruned += 1
+        self.pruned_height = max(self.pruned_height, limit)
+        return pruned
+
+    def rewind(self, height: int) -> List[MessageBlock]:
+        """Drop every block above `height` (-1 drops genesis too) and return them, oldest first."""
+        dropped = self.chain[height + 1:]
+        del self.chain[height + 1:]
+        if self.store is not None:
+            self.store.truncate(len(self.chain))
+        if self.archive is not None and self.pruned_height > len(self.chain):
+            for block in dropped:
+                if type(block.messages) is ArchivedPayload:
+                    block.messages = block.messages.load()
+            self.archive.truncate(len(self.chain))
+            self.pruned_height = len(self.chain)
+        if self.verified_height > height:
+            self.verified_height = max(height, 0)
+            self.verified_hash = self.chain[height].hash if height >= 0 else None
+        if self.retarget is not None:
+            del self.targets[self.retarget.known_periods(height) if height >= 0 else 0:]
+        self._message_index = None
+        self._block_times = self._message_times = None
+        return dropped
+
+    def target_at(self, height: int) -> int:
+        """The target a new block at `height` should carry (and the one older, target-less blocks must meet)."""
+        if self.retarget is None or height < self.retarget.start_height:
+            return difficulty_target(self.difficulty)
+        previous = self.chain[height - 1].target if 0 < height <= len(self.chain) else None
+        return self.retarget.expected_target(height, previous, lambda h: self.chain[h].timestamp, self.targets)
+
+    def block_target(self, height: int) -> int:
+        """The target the block at `height` was mined against: hash <= target."""
+        # Stored in the header, so a later difficulty change does not invalidate old blocks
+        target = self.chain[height].target
+        return self.target_at(height) if target is None else target
+
+    def target_problem(self, height: int) -> Optional[str]:
+        target = self.chain[height].target
+        if target is None:
+            return None  # older blocks carry none; block_target holds them to target_at
+        if not 0 < target <= MAX_TARGET:
+            return "target out of range"
+        if self.retarget is not None and height >= self.retarget.start_height and target != self.target_at(height):
+            return "target off schedule"
+        return None
 
     def get_last_block(self) -> MessageBlock:
         return self.chain[-1]
 
-    def add_message(self, message: Dict[str, Any]):
-        self.pending_messages.append(message)
+    @property
+    def pending_messages(self) -> PendingEntries:
+        # Arrival order; append() goes through add_message, so the old list idiom still queues the message
+        return PendingEntries(self.mempool, self.add_message)
+
+    @pending_messages.setter
+    def pending_messages(self, messages: List[Dict[str, Any]]):
+        self.mempool.clear()
+        for message in messages:
+            self.mempool.add(message)
+
+    def add_message(self, message: Dict[str, Any]) -> bool:
+        # False if the message has a timestamp that is not a number, is already waiting,
+        # or the mempool is full of higher-priority ones
+        accepted = is_timestamp(message.get("timestamp", 0)) and self.mempool.add(message)
+        if self.metrics is not None:
+            self.metrics.set("mempool_size", len(self.mempool))
+            self.metrics.set("mempool_bytes", self.mempool.bytes)
+            if not accepted:
+                self.metrics.inc("mempool_rejected_total")
+        return accepted
 
-    def mine_pending_messages(self, miner_address: str):
-        self.pending_messages.append({
+    def mine_pending_messages(self, miner_address: str, workers: Optional[int] = None):
+        messages = self.mempool.take(self.max_block_messages, self.max_block_bytes)
+        messages.append({
             "sender": "Network",
             "recipient": miner_address,
             "content": f"Mining reward: {self.mining_reward}",
@@ -51,44 +1005,159 @@ class MessagingBlockchain:
         new_block = MessageBlock(
             index=len(self.chain),
             timestamp=time(),
-            messages=self.pending_messages.copy(),
-            previous_hash=self.get_last_block().hash
+            messages=messages,
+            previous_hash=self.get_last_block().hash,
+            target=self.target_at(len(self.chain))
         )
-        new_block.mine_block(self.difficulty)
-        self.chain.append(new_block)
-        self.pending_messages = []
+        workers = workers or self.mining_workers
+        target = new_block.target
+        started = time()
+        if self.mining_profile:
+            profile = cProfile.Profile()
+            attempts = profile.runcall(new_block.mine_block, self.difficulty, workers, target)
+            profile.dump_stats(self.mining_profile)
+        else:
+            attempts = new_block.mine_block(self.difficulty, workers, target)
+        elapsed = time() - started
+        self.last_mining_stats = {
+            "workers": workers,
+            "attempts": attempts,
+            "seconds": elapsed,
+            "hash_rate": attempts / elapsed if elapsed else 0.0,
+            "difficulty_bits": difficulty_bits(target)
+        }
+        self.append_block(new_block)
+        if self.metrics is not None:
+            self.metrics.inc("hash_attempts_total", attempts)
+            self.metrics.inc("blocks_mined_total")
+            self.metrics.set("mining_difficulty_bits", difficulty_bits(target))
+            self.metrics.observe("block_mine_seconds", elapsed)
+            self.metrics.set("mempool_size", len(self.mempool))
+            self.metrics.set("mempool_bytes", self.mempool.bytes)
 
-    def is_chain_valid(self) -> bool:
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i - 1]
+    def find_invalid_block(self, full: bool = False, workers: int = 1) -> Optional[int]:
+        if self.metrics is None:
+            return self._find_invalid_block(full, workers)
+        started = perf_counter()
+        bad_block = self._find_invalid_block(full, workers)
+        self.metrics.observe("validation_seconds", perf_counter() - started, full=full)
+        if bad_block is not None:
+            self.metrics.inc("validation_failures_total")
+        return bad_block
 
-            if current_block.hash != current_block.compute_hash():
-                print(f"Block {current_block.index} hash mismatch: {current_block.hash} != {current_block.compute_hash()}")
-                return False
-            if current_block.previous_hash != previous_block.hash:
-                print(f"Block {current_block.index} previous hash mismatch: {current_block.previous_hash} != {previous_block.hash}")
-                return False
-        return True
+    def _find_invalid_block(self, full: bool = False, workers: int = 1) -> Optional[int]:
+        # Picks up after the last verified height unless a full audit is asked for. Hash
+        # checks are independent per block; only the previous_hash links are sequential.
+        start = 1
+        if not full and 0 < self.verified_height < len(self.chain) and self.chain[self.verified_height].hash == self.verified_hash:
+            start = self.verified_height + 1
+        heights = range(start, len(self.chain))
+        if self.metrics is not None:
+            self.metrics.inc("blocks_validated_total", len(heights))
+        if workers > 1 and len(heights) > 1:
+            blocks = [self.chain[i] for i in heights]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                problems = list(pool.map(_check_block, blocks, chunksize=max(1, len(blocks) // (workers * 4))))
+        else:
+            # Streamed, so a lazy chain is checked without loading every block at once
+            problems = map(_check_block, self.iter_blocks(start))
+        for i, problem in zip(heights, problems):
+            if problem is None and self.chain[i].previous_hash != self.chain[i - 1].hash:
+                problem = "previous hash mismatch"
+            if problem is None:
+                problem = self.target_problem(i)
+            if problem is None and self.chain[i].hash > target_hex(self.block_target(i)):
+                problem = "hash above target"
+            if problem is not None:
+                self.validation_error = f"Block {i}: {problem}"
+                self.verified_height = i - 1
+                self.verified_hash = self.chain[i - 1].hash
+                return i
+        self.validation_error = None
+        self.verified_height = len(self.chain) - 1
+        self.verified_hash = self.chain[-1].hash
+        return None
+
+    def is_chain_valid(self, full: bool = False, workers: int = 1) -> bool:
+        return self.find_invalid_block(full, workers) is None
+
+    def get_message_proof(self, block_index: int, position: int) -> Dict[str, Any]:
+        block = self.chain[block_index]
+        return {
+            "block_index": block.index,
+            "block_hash": block.hash,
+            "merkle_root": block.merkle_root,
+            "message": block.messages[position],
+            "proof": block.get_inclusion_proof(position)
+        }
+
+    @property
+    def message_index(self) -> MessageIndex:
+        if self._message_index is None:
+            self.rebuild_message_index()
+        return self._message_index
+
+    @property
+    def block_times(self) -> TimestampIndex:
+        if self._block_times is None:
+            self.rebuild_time_index()
+        return self._block_times
+
+    @property
+    def message_times(self) -> TimestampIndex:
+        if self._message_times is None:
+            self.rebuild_time_index()
+        return self._message_times
+
+    def rebuild_message_index(self):
+        message_index = MessageIndex()
+        message_index.rebuild(self.chain)
+        self._message_index = message_index
+
+    def _index_times(self, block: MessageBlock):
+        self._block_times.add(block.timestamp, block.index)
+        for position, message in enumerate(block.messages):
+            self._message_times.add(message_time(message, block), block.index, position)
+
+    def rebuild_time_index(self):
+        self._block_times = TimestampIndex()
+        self._message_times = TimestampIndex()
+        try:
+            for block in self.chain:
+                self._index_times(block)
+        except BaseException:
+            self._block_times = self._message_times = None  # never leave a half-built index behind
+            raise
+
+    def iter_blocks(self, start_height: int = 0, stop_height: Optional[int] = None) -> Iterator[MessageBlock]:
+        if isinstance(self.chain, ChainView):
+            yield from self.chain.scan(start_height, stop_height)
+            return
+        for height in range(*slice(start_height, stop_height).indices(len(self.chain))):
+            yield self.chain[height]
+
+    def get_blocks_between(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[MessageBlock]:
+        for block_index, _ in self.block_times.between(start, end):
+            yield self.chain[block_index]
+
+    def get_messages_between(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        # Individual messages by their own timestamp, oldest first; blocks are only touched per message
+        for block_index, position in self.message_times.between(start, end):
+            yield self.chain[block_index].messages[position]
+
+    def _resolve(self, postings: List[Posting]) -> List[Dict[str, Any]]:
+        return [self.chain[block_index].messages[position] for block_index, position in postings]
+
+    def get_user_messages(self, user_address: str, limit: Optional[int] = None, offset: int = 0, newest_first: bool = False) -> List[Dict[str, Any]]:
+        postings = self.message_index.received.get(user_address)
+        return self._resolve(MessageIndex.page(postings, limit, offset, newest_first))
+
+    def get_sent_messages(self, user_address: str, limit: Optional[int] = None, offset: int = 0, newest_first: bool = False) -> List[Dict[str, Any]]:
+        postings = self.message_index.sent.get(user_address)
+        return self._resolve(MessageIndex.page(postings, limit, offset, newest_first))
 
-    def get_user_messages(self, user_address: str) -> List[Dict[str, Any]]:
-        user_messages = []
-        for block in self.chain:
-            for message in block.messages:
-                if message['recipient'] == user_address:
-                    user_messages.append(message)
-        return user_messages
-
-    def get_sent_messages(self, user_address: str) -> List[Dict[str, Any]]:
-        sent_messages = []
-        for block in self.chain:
-            for message in block.messages:
-                if message['sender'] == user_address:
-                    sent_messages.append(message)
-        return sent_messages
-
-    def get_user_history(self, user_address: str) -> Dict[str, List[Dict[str, Any]]]:
+    def get_user_history(self, user_address: str, limit: Optional[int] = None, offset: int = 0, newest_first: bool = False) -> Dict[str, List[Dict[str, Any]]]:
         return {
-            "received": self.get_user_messages(user_address),
-            "sent": self.get_sent_messages(user_address)
+            "received": self.get_user_messages(user_address, limit, offset, newest_first),
+            "sent": self.get_sent_messages(user_address, limit, offset, newest_first)
         }
@@ -0,0 +1,241 @@
+"""
+Regression tests for the messaging blockchain library. Run from this folder with `python -m pytest`.
+"""
+
+import os
+import random
+import tempfile
+
+import pytest
+
+import PyBasicBlockchain2
+from BlockCodec import FORMAT_VERSION, MAGIC, CodecError, decode_block, encode_block
+from BlockStore import BlockStore
+from ChainSync import ChainSync, SyncServer
+from PayloadArchive import PayloadArchive
+
+def make_node(directory: str, genesis: PyBasicBlockchain2.MessageBlock) -> PyBasicBlockchain2.MessagingBlockchain:
+    # A compact, store-backed chain that shares `genesis` with its peers
+    store = BlockStore(os.path.join(directory, "chain"), PyBasicBlockchain2.MessageBlock)
+    store.append(genesis)
+    node = PyBasicBlockchain2.MessagingBlockchain(store=store, compact=True)
+    node.difficulty = 1
+    return node
+
+def test_mining_after_a_fork_switch_on_a_compact_stored_chain():
+    peer = PyBasicBlockchain2.MessagingBlockchain()
+    peer.difficulty = 1
+    with tempfile.TemporaryDirectory() as directory:
+        node = make_node(directory, peer.chain[0])
+        message = {"sender": "alice", "recipient": "bob", "content": "hi", "timestamp": 1.0}
+        node.add_message(message)
+        node.mine_pending_messages("node-miner")
+        for _ in range(2):
+            peer.mine_pending_messages("peer-miner")  # a longer fork without the message
+        with SyncServer(peer) as server:
+            assert ChainSync(node, [server.address]).sync()
+        assert [block.hash for block in node.chain] == [block.hash for block in peer.chain]
+        assert node.pending_messages == [message]
+        node.mine_pending_messages("node-miner")  # used to fail encoding the re-queued row for the store
+        assert dict(node.chain[-1].messages[0]) == message
+        assert node.is_chain_valid()
+        node.store.close()
+
+def test_a_message_on_both_forks_is_not_requeued():
+    peer = PyBasicBlockchain2.MessagingBlockchain()
+    peer.difficulty = 1
+    with tempfile.TemporaryDirectory() as directory:
+        node = make_node(directory, peer.chain[0])
+        message = {"sender": "alice", "recipient": "bob", "content": "hi", "timestamp": 1.0}
+        node.add_message(message)
+        node.mine_pending_messages("node-miner")
+        peer.add_message(message)
+        for _ in range(2):
+            peer.mine_pending_messages("peer-miner")  # the same message, on a longer fork
+        with SyncServer(peer) as server:
+            assert ChainSync(node, [server.address]).sync()
+        assert len(node.mempool) == 0
+        node.mine_pending_messages("node-miner")
+        assert len(node.get_user_messages("bob")) == 1
+        node.store.close()
+
+def test_a_message_with_a_priority_that_is_not_a_number_leaves_no_trace():
+    mempool = PyBasicBlockchain2.Mempool()
+    assert not mempool.add({"sender": "alice", "recipient": "bob", "content": "hi", "priority": "high"})
+    assert (len(mempool), mempool.bytes, mempool.rejected) == (0, 0, 1)
+    assert mempool.add({"sender": "alice", "recipient": "bob", "content": "hi", "priority": 2})
+    assert [message["priority"] for message in mempool.take(10, 10_000)] == [2]
+
+def test_appending_to_pending_messages_queues_them():
+    blockchain = PyBasicBlockchain2.MessagingBlockchain()
+    blockchain.difficulty = 1
+    message = {"sender": "alice", "recipient": "bob", "content": "hi", "timestamp": 1.0}
+    blockchain.pending_messages.append(message)
+    assert blockchain.pending_messages == [message]
+    with pytest.raises(TypeError):
+        blockchain.pending_messages.pop()
+    blockchain.mine_pending_messages("miner")
+    assert [dict(entry) for entry in blockchain.get_user_messages("bob")] == [message]
+
+def test_a_message_timestamp_that_is_not_a_number_is_indexed_at_its_block_time():
+    blockchain = PyBasicBlockchain2.MessagingBlockchain()
+    blockchain.difficulty = 1
+    odd = {"sender": "alice", "recipient": "bob", "content": "hi", "timestamp": "yesterday"}
+    assert not blockchain.add_message(odd)
+    tip = blockchain.get_last_block()
+    block = PyBasicBlockchain2.MessageBlock(tip.index + 1, tip.timestamp + 1, [odd], tip.hash)  # say, from a peer
+    block.mine_block(1)
+    blockchain.append_block(block)
+    assert list(blockchain.get_messages_between(block.timestamp, block.timestamp + 1)) == [odd]
+    assert blockchain.get_user_messages("bob") == [odd]
+
+def test_user_history_pages_newest_first():
+    blockchain = PyBasicBlockchain2.MessagingBlockchain()
+    blockchain.difficulty = 1
+    for number in range(7):
+        blockchain.add_message({"sender": "alice", "recipient": "bob", "content": f"hi {number}", "timestamp": float(number)})
+        if number % 3 == 2:
+            blockchain.mine_pending_messages("miner")  # spread them over a few blocks
+    blockchain.mine_pending_messages("miner")
+    def contents(**page):
+        return [message["content"] for message in blockchain.get_user_messages("bob", **page)]
+    assert contents() == [f"hi {number}" for number in range(7)]
+    assert contents(limit=3, newest_first=True) == ["hi 6", "hi 5", "hi 4"]
+    assert contents(limit=3, offset=3, newest_first=True) == ["hi 3", "hi 2", "hi 1"]
+    assert contents(limit=3, offset=6, newest_first=True) == ["hi 0"]
+    assert contents(offset=7, newest_first=True) == [] and contents(limit=2, offset=5) == ["hi 5", "hi 6"]
+    assert blockchain.get_sent_messages("bob") == [] and blockchain.get_user_messages("nobody", limit=5) == []
+    assert blockchain.get_user_history("alice", limit=1, newest_first=True)["sent"][0]["content"] == "hi 6"
+
+def test_longer_chain_beats_a_lucky_low_hash():
+    peer = PyBasicBlockchain2.MessagingBlockchain()
+    peer.difficulty = 1
+    with tempfile.TemporaryDirectory() as directory:
+        node = make_node(directory, peer.chain[0])
+        block = PyBasicBlockchain2.MessageBlock(1, peer.chain[0].timestamp + 1, [], peer.chain[0].hash, target=node.target_at(1))
+        block.mine_block(1, target=PyBasicBlockchain2.difficulty_target(5))  # far more leading zeros than the target it carries
+        node.append_block(block)
+        for _ in range(2):
+            peer.mine_pending_messages("peer-miner")
+        with SyncServer(peer) as server:
+            assert ChainSync(node, [server.address]).sync()
+        assert node.chain[-1].hash == peer.chain[-1].hash
+        node.store.close()
+
+def test_blocks_must_meet_the_fixed_difficulty_target():
+    blockchain = PyBasicBlockchain2.MessagingBlockchain()
+    blockchain.difficulty = 2
+    blockchain.mine_pending_messages("miner")
+    assert blockchain.is_chain_valid()
+    tip = blockchain.chain[-1]
+    target = PyBasicBlockchain2.target_hex(blockchain.target_at(tip.index))
+    while tip.hash <= target:
+        tip.nonce += 1  # keep the hash honest but miss the target
+        tip.hash = tip.compute_hash()
+    assert not blockchain.is_chain_valid()
+    assert blockchain.validation_error == f"Block {tip.index}: hash above target"
+
+def test_blocks_keep_their_target_when_the_difficulty_changes():
+    blockchain = PyBasicBlockchain2.MessagingBlockchain()
+    blockchain.difficulty = 1
+    for _ in range(3):
+        blockchain.mine_pending_messages("miner")
+    blockchain.difficulty = 3
+    assert blockchain.is_chain_valid(full=True)
+    blockchain.retarget = PyBasicBlockchain2.DifficultyRetarget(1.0, 2, PyBasicBlockchain2.difficulty_target(1), start_height=len(blockchain.chain))
+    for _ in range(4):
+        blockchain.mine_pending_messages("miner")
+    assert blockchain.is_chain_valid(full=True)
+    assert blockchain.chain[-1].target != blockchain.chain[1].target  # the schedule has moved since it was turned on
+
+def test_a_block_cannot_claim_an_easier_target():
+    blockchain = PyBasicBlockchain2.MessagingBlockchain(retarget=PyBasicBlockchain2.DifficultyRetarget(1.0, 2, PyBasicBlockchain2.difficulty_target(1)))
+    for _ in range(2):
+        blockchain.mine_pending_messages("miner")
+    tip = blockchain.chain[-1]
+    tip.target = PyBasicBlockchain2.MAX_TARGET
+    assert not blockchain.is_chain_valid(full=True)
+    assert blockchain.validation_error == f"Block {tip.index}: hash mismatch"  # the target is part of the hashed header
+    tip.hash = tip.compute_hash()
+    assert not blockchain.is_chain_valid(full=True)
+    assert blockchain.validation_error == f"Block {tip.index}: target off schedule"
+
+def test_retargeting_settles_on_the_block_interval():
+    rng = random.Random(1)
+    retarget = PyBasicBlockchain2.DifficultyRetarget(2.0, 10, PyBasicBlockchain2.difficulty_target(4))
+    timestamps, targets, times = [0.0], [], []
+    for height in range(1, 4001):
+        target = retarget.target_at(height, timestamps.__getitem__, targets)
+        expected_hashes = (PyBasicBlockchain2.MAX_TARGET + 1) / (target + 1)
+        times.append(rng.expovariate(1e5 / expected_hashes))  # a steady 100k hashes a second
+        timestamps.append(timestamps[-1] + times[-1])
+    settled = times[len(times) // 2:]
+    assert abs(sum(settled) / len(settled) - 2.0) <= 0.05 * 2.0
+
+def test_pruned_blocks_stay_pruned_when_a_lazy_chain_reloads_them():
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlockStore(os.path.join(directory, "chain"), PyBasicBlockchain2.MessageBlock)
+        blockchain = PyBasicBlockchain2.MessagingBlockchain(store=store, archive=PayloadArchive(os.path.join(directory, "archive")),
+                                                            keep_blocks=2, cache_blocks=2)
+        blockchain.difficulty = 1
+        for number in range(1, 7):
+            blockchain.add_message({"sender": "alice", "recipient": "bob", "content": f"hi {number}", "timestamp": float(number)})
+            blockchain.mine_pending_messages("miner")
+        assert blockchain.pruned_height == len(blockchain.chain) - 2
+        blockchain.chain.clear_cache()  # every block now comes back from the store
+        old = blockchain.chain[1]
+        assert type(old.messages) is PyBasicBlockchain2.ArchivedPayload
+        assert dict(old.messages[0]) == {"sender": "alice", "recipient": "bob", "content": "hi 1", "timestamp": 1.0}
+        assert len(store[1].messages) == 2  # pruning saves memory only: the store keeps every block whole
+        assert blockchain.is_chain_valid(full=True)
+        store.close()
+        blockchain.archive.close()
+
+def test_opening_a_lazy_chain_loads_no_blocks_until_asked():
+    with tempfile.TemporaryDirectory() as directory:
+        chain_path, archive_path = os.path.join(directory, "chain"), os.path.join(directory, "archive")
+        with BlockStore(chain_path, PyBasicBlockchain2.MessageBlock) as store:
+            blockchain = PyBasicBlockchain2.MessagingBlockchain(store=store, archive=PayloadArchive(archive_path), keep_blocks=2)
+            blockchain.difficulty = 1
+            for number in range(1, 7):
+                blockchain.add_message({"sender": "alice", "recipient": "bob", "content": f"hi {number}", "timestamp": float(number)})
+                blockchain.mine_pending_messages("miner")
+            blockchain.archive.close()
+        with BlockStore(chain_path, PyBasicBlockchain2.MessageBlock) as store:
+            reopened = PyBasicBlockchain2.MessagingBlockchain(store=store, archive=PayloadArchive(archive_path), keep_blocks=2, cache_blocks=4)
+            assert len(reopened.chain) == 7 and reopened.chain.stats()["cached"] == 0  # nothing decoded yet
+            assert reopened.pruned_height == 5
+            assert [message["content"] for message in reopened.get_user_messages("bob")] == [f"hi {number}" for number in range(1, 7)]
+            assert reopened.is_chain_valid(full=True)
+            reopened.archive.close()
+
+def test_binary_blocks_decode_to_the_same_block():
+    blockchain = PyBasicBlockchain2.MessagingBlockchain()
+    blockchain.difficulty = 1
+    blockchain.add_message({"sender": "alice", "recipient": "bob", "content": "héllo 👋", "timestamp": 1.5})
+    blockchain.add_message({"sender": "bob", "recipient": "alice", "content": None, "timestamp": 2.0, "priority": -3,
+                            "read": True, "tags": ["a", {"b": 1}], "size": 2 ** 70})
+    blockchain.mine_pending_messages("miner")
+    for block in blockchain.chain:
+        data = encode_block(block)
+        assert data[:4] == MAGIC + bytes([FORMAT_VERSION])
+        decoded = decode_block(data, PyBasicBlockchain2.MessageBlock)
+        assert decoded.to_dict() == block.to_dict()
+        assert decoded.compute_hash() == decoded.hash and decoded.target == block.target
+    with pytest.raises(CodecError):
+        decode_block(b"JSON" + data[4:], PyBasicBlockchain2.MessageBlock)
+
+# A block written by the first binary format, before targets were stored
+FORMAT_1_BLOCK = bytes.fromhex(
+    "50424201010441d954fc40200000200000000000000000000000000000000000000000000000000000000000000000040220a369e87e45740"
+    "95aeabde14f65de5c8ccddd6558d4000511769444a430d6d703200885cabd0874e3e20c18b974569a94a91766bf703bf5125f80b6ed47a96c9"
+    "773060673656e64657209726563697069656e7407636f6e74656e740974696d657374616d7005616c69636503626f62020400050401050502"
+    "0602686903043ff00000000000000400050501050402060368657903044000000000000000")
+
+def test_a_format_1_binary_block_still_decodes():
+    block = decode_block(FORMAT_1_BLOCK, PyBasicBlockchain2.MessageBlock)
+    assert (block.index, block.version, block.target, block.nonce) == (1, PyBasicBlockchain2.HASH_VERSION_HEADER, None, 4)
+    assert [message["content"] for message in block.messages] == ["hi", "hey"]
+    assert block.compute_hash() == block.hash == "0885cabd0874e3e20c18b974569a94a91766bf703bf5125f80b6ed47a96c9773"
+    rewritten = encode_block(block)
+    assert rewritten[3] == FORMAT_VERSION and decode_block(rewritten, PyBasicBlockchain2.MessageBlock).to_dict() == block.to_dict()